@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Compare event loops under the same synthetic MegaD event load.
+
+Run from the project root::
+
+    python benchmarks/bench_loops.py --devices 500 --events 20
+
+Every available loop (asyncio, and uvloop when installed) serves the
+same load from :mod:`pymegad.loadgen`; the load generator itself always
+runs on the asyncio loop.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pymegad import loadgen  # noqa: E402
+from pymegad.eventloop import available_loops  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=500)
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--keep-alive', action='store_true')
+    parser.add_argument('--port', type=int, default=16099)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for kind in available_loops():
+        result = loadgen.run(args.devices, args.events, args.concurrency,
+                             keep_alive=args.keep_alive, port=args.port,
+                             event_loop=kind)
+        results[kind] = result
+        print('== {} ==\n{}\n'.format(kind, result.report()))
+
+    print('{:<10} {:>12} {:>10} {:>10}'.format('loop', 'events/s', 'p50 ms', 'p99 ms'))
+    for kind, result in results.items():
+        print('{:<10} {:>12.0f} {:>10.3f} {:>10.3f}'.format(
+            kind, result.throughput,
+            loadgen.percentile(result.latencies, 0.5) * 1000,
+            loadgen.percentile(result.latencies, 0.99) * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
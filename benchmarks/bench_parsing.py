@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmarks of the per-event hot path.
+
+Run from the project root::
+
+    python benchmarks/bench_parsing.py
+
+For end-to-end throughput and latency use ``python -m pymegad.loadgen``.
+"""
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pymegad import loadgen  # noqa: E402
+from pymegad.parser import parse_request  # noqa: E402
+
+DEVICE = loadgen.device_ips(1)[0]
+PUSH = '/?pt=7&m=1'
+ALL_STATUSES = ';'.join(['ON', 'OFF', 'ON/3', 'OFF'] * 9 + ['temp:24.5', ''])
+HEAD = b'GET /?pt=7&m=1 HTTP/1.1\r\nHost: 192.168.0.2\r\n\r\n'
+
+
+def make_server():
+    from pymegad.main import MegadServer
+    return MegadServer('127.0.0.1', 0, config=loadgen.synthetic_config([DEVICE]))
+
+
+def bench(name, stmt, number):
+    best = min(timeit.repeat(stmt, number=number, repeat=5))
+    print('{:<28} {:>9.3f} us/op'.format(name, best / number * 1e6))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--number', type=int, default=20000)
+    args = parser.parse_args(argv)
+    logging.disable(logging.CRITICAL)
+
+    server = make_server()
+    changing = ['ON;' * 38, 'OFF;' * 38]
+    bench('parse_request', lambda: parse_request(HEAD), args.number)
+    bench('cmd_decode', lambda: server.cmd_decode(PUSH), args.number)
+    bench('update_all (no change)',
+          lambda: server.update_all(DEVICE, ALL_STATUSES), args.number)
+    bench('update_all (all change)',
+          lambda: server.update_all(DEVICE, changing.reverse() or changing[0]),
+          args.number)
+    bench('parse_cmd (push)', lambda: server.parse_cmd(DEVICE, PUSH), args.number)
+    bench('parse_cmd (all)',
+          lambda: server.parse_cmd(DEVICE, '/?all=' + ALL_STATUSES), args.number)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
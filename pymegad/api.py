@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""Read-only JSON view of the port states and sensor readings.
+
+Served by :class:`pymegad.main.MegadServer` on the same port as the
+device events, to the addresses its allowlist lets in::
+
+    GET /state                  all devices
+    GET /state/<ip>             one device
+    GET /state/<ip>/<port>      one port
+    GET /sensors                latest readings of all sensor ports
+    GET /sensors/<ip>/<port>    latest readings of one sensor port
+
+Every payload carries the registry ``version``, which is also the ETag;
+``If-None-Match`` with the current version is answered with 304.
+``?version=N&wait=S`` holds the request up to ``S`` seconds until the
+version is past ``N`` (long-poll). Serialized payloads are kept per path
+and reused until the version changes. With a registry shared between
+worker processes, changes made by other workers wake no one, so waiters
+also check the version every ``SHARED_RECHECK`` seconds.
+
+Sensor ports are not on/off ports and only show up under ``/sensors``.
+``/sensors/<ip>/<port>?step=S`` adds the history of the port's ``name``
+series (``value`` by default), aggregated into windows of ``S`` seconds
+between the optional ``start`` and ``end`` timestamps; it needs numpy.
+"""
+
+import asyncio
+import json
+import logging
+
+from pymegad.parser import header_value
+from pymegad.sensors import DEFAULT_NAME
+
+_LOGGER = logging.getLogger(__name__)
+
+STATE_PATH = b'/state'
+SENSORS_PATH = b'/sensors'
+MAX_WAIT = 300.0
+SHARED_RECHECK = 0.5
+
+OK = b'200 OK'
+NOT_MODIFIED = b'304 Not Modified'
+BAD_REQUEST = b'400 Bad Request'
+NOT_FOUND = b'404 Not Found'
+METHOD_NOT_ALLOWED = b'405 Method Not Allowed'
+
+
+def is_state_request(target):
+    path = target.split(b'?', 1)[0]
+    return path == STATE_PATH or path.startswith(STATE_PATH + b'/')
+
+
+def is_sensors_request(target):
+    path = target.split(b'?', 1)[0]
+    return path == SENSORS_PATH or path.startswith(SENSORS_PATH + b'/')
+
+
+def _error(status, message):
+    return status, None, json.dumps({'error': message}).encode()
+
+
+def _json(payload):
+    return OK, None, json.dumps(payload, separators=(',', ':'), sort_keys=True).encode()
+
+
+class StateApi:
+    def __init__(self, registry):
+        self._registry = registry
+        self._payloads = {}
+        self._changed = None
+        self.hits = 0
+        self.misses = 0
+
+    def on_transition(self, device, port, old, new):
+        """Registry listener waking the long-poll waiters."""
+        changed = self._changed
+        if changed is not None:
+            self._changed = None
+            if not changed.done():
+                changed.set_result(None)
+
+    async def wait_for_version(self, version, timeout):
+        """Wait until the registry version is past ``version``; returns
+        whether it is."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._registry.version <= version:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            if self._changed is None:
+                self._changed = loop.create_future()
+            if self._registry.shared:
+                remaining = min(remaining, SHARED_RECHECK)
+            try:
+                await asyncio.wait_for(asyncio.shield(self._changed),
+                                       remaining)
+            except asyncio.TimeoutError:
+                continue
+        return True
+
+    async def respond(self, request):
+        """Answer a state request with ``(status, etag, body)``."""
+        if request.method != b'GET':
+            return _error(METHOD_NOT_ALLOWED, 'only GET is supported')
+        params = request.params
+        if 'wait' in params:
+            try:
+                version = int(params.get('version', self._registry.version))
+                wait = min(float(params['wait']), MAX_WAIT)
+            except ValueError:
+                return _error(BAD_REQUEST, 'version and wait must be numbers')
+            await self.wait_for_version(version, wait)
+
+        version = self._registry.version
+        etag = '"{}"'.format(version).encode()
+        if header_value(request.head, b'if-none-match') == etag:
+            return NOT_MODIFIED, etag, b''
+        path = request.target.split(b'?', 1)[0].rstrip(b'/')
+        cached = self._payloads.get(path)
+        if cached is not None and cached[0] == version:
+            self.hits += 1
+            return OK, etag, cached[1]
+        self.misses += 1
+        payload = self._payload(path.decode('latin-1').split('/')[2:], version)
+        if payload is None:
+            return _error(NOT_FOUND, 'unknown device or port')
+        body = json.dumps(payload, separators=(',', ':'), sort_keys=True).encode()
+        self._payloads[path] = (version, body)
+        return OK, etag, body
+
+    def _payload(self, parts, version):
+        registry = self._registry
+        if not parts:
+            return {'version': version, 'devices': {
+                ip: _ports(registry.device_states(ip)) for ip in registry.devices()}}
+        device = registry.device(parts[0])
+        if device is None or len(parts) > 2:
+            return None
+        if len(parts) == 1:
+            return {'version': version, 'device': parts[0],
+                    'ports': _ports(device.as_dict())}
+        try:
+            port = int(parts[1])
+        except ValueError:
+            return None
+        if port not in device:
+            return None
+        return {'version': version, 'device': parts[0], 'port': port,
+                'state': registry.get_state(parts[0], port)}
+
+    def forget(self):
+        """Drop the cached payloads, e.g. after the device set changed."""
+        self._payloads.clear()
+
+
+def _ports(states):
+    return {str(port): state for port, state in states.items()}
+
+
+class SensorApi:
+    def __init__(self, sensors):
+        self._sensors = sensors
+
+    def respond(self, request):
+        """Answer a sensor request with ``(status, etag, body)``."""
+        if request.method != b'GET':
+            return _error(METHOD_NOT_ALLOWED, 'only GET is supported')
+        parts = request.target.split(b'?', 1)[0].rstrip(b'/').decode('latin-1').split('/')[2:]
+        if not parts:
+            return self._all_sensors()
+        if len(parts) == 2:
+            return self._sensor(parts[0], parts[1], request.params)
+        return _error(NOT_FOUND, 'unknown sensor')
+
+    def _all_sensors(self):
+        devices = {}
+        for device, port in self._sensors.ports():
+            ports = devices.setdefault(device, {})
+            ports[str(port)] = _readings(self._sensors.latest(device, port))
+        return _json({'devices': devices})
+
+    def _sensor(self, device, port, params):
+        try:
+            port = int(port)
+        except ValueError:
+            return _error(NOT_FOUND, 'unknown sensor')
+        latest = self._sensors.latest(device, port)
+        if not latest:
+            return _error(NOT_FOUND, 'unknown sensor')
+        payload = {'device': device, 'port': port, 'type': self._sensors.type(device, port),
+                   'values': _readings(latest)}
+        if 'step' in params:
+            try:
+                payload['history'] = self._history(device, port, params)
+            except ValueError:
+                return _error(BAD_REQUEST, 'step, start and end must be numbers')
+            if payload['history'] is None:
+                return _error(NOT_FOUND, 'no history for this sensor')
+        return _json(payload)
+
+    def _history(self, device, port, params):
+        step = float(params['step'])
+        start = float(params['start']) if 'start' in params else None
+        end = float(params['end']) if 'end' in params else None
+        if step <= 0:
+            raise ValueError(step)
+        series = self._sensors.series(device, port, params.get('name', DEFAULT_NAME))
+        if series is None:
+            return None
+        return {key: values.tolist() for key, values
+                in series.downsample(step, start, end).items()}
+
+
+def _readings(latest):
+    return {name: {'time': timestamp, 'value': value}
+            for name, (timestamp, value) in latest.items()}
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""Capture of raw device requests and their replay.
+
+With the ``capture_path`` server option set, every request head read by
+:class:`pymegad.main.MegadServer` is appended to a binary capture file
+together with its arrival time and peer address. Records are buffered and
+appended with one ``write`` per flush to a file opened with ``O_APPEND``,
+so the workers of worker mode can share one capture file.
+
+A capture can be replayed into an in-process server or against a live one
+over TCP, at the recorded pace, N times faster or as fast as possible. The
+in-process server dispatches device requests like a live one, through
+``handle_command``, but keeps no state, records no capture and sends no
+commands to devices; requests to the state API and event stream are
+skipped::
+
+    python -m pymegad.capture info events.capture
+    python -m pymegad.capture replay events.capture --speed 10
+    python -m pymegad.capture replay events.capture --speed 0 \\
+        --target 127.0.0.1:16030
+"""
+
+import argparse
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+
+from pymegad.api import is_sensors_request, is_state_request
+from pymegad.parser import parse_request
+from pymegad.stream import is_events_request
+
+_LOGGER = logging.getLogger(__name__)
+
+CAPTURE_MAGIC = b'MGDC'
+CAPTURE_VERSION = 1
+# magic, version
+CAPTURE_HEADER = struct.Struct('<4sH')
+# timestamp, ip length, head length; followed by the ip and the head
+CAPTURE_RECORD = struct.Struct('<dBI')
+# Buffered records are written out once they reach this size.
+FLUSH_SIZE = 65536
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._buffer = bytearray()
+        self.records = 0
+
+    def open(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self.path):
+            # Publish the file with its header in place, so that another
+            # process never appends a record in front of it.
+            temporary = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(temporary, 'wb') as new:
+                new.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+            try:
+                os.link(temporary, self.path)
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(temporary)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+
+    def record(self, timestamp, ip, head):
+        if self._fd is None:
+            return
+        encoded = ip.encode('utf-8')
+        buffer = self._buffer
+        buffer += CAPTURE_RECORD.pack(timestamp, len(encoded), len(head))
+        buffer += encoded
+        buffer += head
+        self.records += 1
+        if len(buffer) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered records with a single write."""
+        if self._fd is not None and self._buffer:
+            os.write(self._fd, self._buffer)
+            self._buffer.clear()
+
+    def close(self):
+        if self._fd is not None:
+            self.flush()
+            os.close(self._fd)
+            self._fd = None
+
+
+def read_capture(path):
+    """Yield the ``(timestamp, ip, head)`` records of a capture file."""
+    with open(path, 'rb') as source:
+        if os.fstat(source.fileno()).st_size < CAPTURE_HEADER.size:
+            return
+        data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version = CAPTURE_HEADER.unpack_from(data)
+        if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+            raise ValueError('{} is not a capture file'.format(path))
+        offset = CAPTURE_HEADER.size
+        end = len(data) - CAPTURE_RECORD.size
+        while offset <= end:
+            timestamp, ip_length, head_length = CAPTURE_RECORD.unpack_from(
+                data, offset)
+            offset += CAPTURE_RECORD.size
+            if offset + ip_length + head_length > len(data):
+                break
+            ip = data[offset:offset + ip_length].decode('utf-8')
+            offset += ip_length
+            yield timestamp, ip, data[offset:offset + head_length]
+            offset += head_length
+    finally:
+        data.close()
+
+
+async def _paced(records, speed):
+    """Yield records at ``speed`` times the recorded pace (0: no waits)."""
+    loop = asyncio.get_running_loop()
+    origin = started = None
+    for timestamp, ip, head in records:
+        if speed > 0:
+            if origin is None:
+                origin, started = timestamp, loop.time()
+            delay = started + (timestamp - origin) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield timestamp, ip, head
+
+
+def is_device_request(target):
+    return not (is_state_request(target) or is_sensors_request(target) or
+                is_events_request(target))
+
+
+class NullClient:
+    """Stands in for :class:`pymegad.client.MegadClient` during replays:
+    every command is accepted without contacting a device."""
+
+    def __init__(self, loop):
+        self._loop = loop
+
+    def queue_command(self, ip, password, port, state):
+        accepted = self._loop.create_future()
+        accepted.set_result('')
+        return accepted
+
+    async def request(self, ip, password, query):
+        return ''
+
+    def close(self):
+        pass
+
+
+def replay_server(loop, config_path=None):
+    """Build an in-process server safe to replay into: no state store, no
+    capture and no commands to real devices."""
+    from pymegad.main import MegadServer
+    server = MegadServer('127.0.0.1', 0, loop=loop, config_path=config_path,
+                         persist=False, reloadable=False)
+    server.capture = None
+    server.client.close()
+    server.client = NullClient(loop)
+    return server
+
+
+async def replay_into(server, records, speed=1.0):
+    """Dispatch the device requests of ``records`` through
+    ``server.handle_command``; returns how many were dispatched."""
+    request = None
+    count = 0
+    async for _, ip, head in _paced(records, speed):
+        request = parse_request(head, request)
+        if request is None or request.method != b'GET' or \
+                not is_device_request(request.target):
+            continue
+        server.handle_command(ip, request.params)
+        count += 1
+    return count
+
+
+async def replay_to(host, port, records, speed=1.0, bind_peers=False):
+    """Send the records to a live server, one connection per request.
+
+    With ``bind_peers`` every connection is made from the recorded peer
+    address, which then has to be configured on this host. Returns the
+    number of requests answered.
+    """
+    count = 0
+    async for _, ip, head in _paced(records, speed):
+        try:
+            reader, writer = await asyncio.open_connection(
+                host, port, local_addr=(ip, 0) if bind_peers else None)
+        except OSError as exc:
+            _LOGGER.error('Cannot connect for %s: %s', ip, exc)
+            continue
+        try:
+            writer.write(head)
+            await reader.readuntil(b'\r\n\r\n')
+            count += 1
+        except (OSError, asyncio.IncompleteReadError) as exc:
+            _LOGGER.error('Replaying %s failed: %s', ip, exc)
+        finally:
+            writer.close()
+    return count
+
+
+def _info(path):
+    records = 0
+    devices = set()
+    first = last = None
+    for timestamp, ip, _ in read_capture(path):
+        records += 1
+        devices.add(ip)
+        first = timestamp if first is None else first
+        last = timestamp
+    print('records:  {}'.format(records))
+    print('devices:  {}'.format(len(devices)))
+    if records:
+        print('duration: {:.3f} s'.format(last - first))
+
+
+def _replay(args):
+    records = read_capture(args.capture)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    started = time.perf_counter()
+    try:
+        if args.target:
+            host, _, port = args.target.rpartition(':')
+            count = loop.run_until_complete(replay_to(
+                host, int(port), records, args.speed, args.bind_peers))
+        else:
+            server = replay_server(loop, args.config)
+            try:
+                count = loop.run_until_complete(replay_into(server, records, args.speed))
+            finally:
+                server.close()
+    finally:
+        loop.close()
+    elapsed = time.perf_counter() - started
+    print('replayed: {} requests in {:.3f} s ({:.0f}/s)'.format(
+        count, elapsed, count / elapsed if elapsed else 0.0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='MegaD request capture tool')
+    commands = parser.add_subparsers(dest='command')
+    info = commands.add_parser('info', help='summarize a capture file')
+    info.add_argument('capture')
+    replay = commands.add_parser('replay', help='replay a capture file')
+    replay.add_argument('capture')
+    replay.add_argument('--speed', type=float, default=1.0,
+                        help='pace relative to the recording; 0 replays as fast as possible')
+    replay.add_argument('--target', metavar='HOST:PORT',
+                        help='replay against a running server instead of in-process')
+    replay.add_argument('--bind-peers', action='store_true',
+                        help='connect from the recorded device addresses')
+    replay.add_argument('--config', help='config.yaml of the in-process server')
+    args = parser.parse_args(argv)
+    if args.command == 'info':
+        _info(args.capture)
+    elif args.command == 'replay':
+        logging.basicConfig(level=logging.WARNING)
+        _replay(args)
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
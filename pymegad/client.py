@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Outbound HTTP client driving MegaD outputs.
+
+Commands queued for the same device within one loop iteration are
+coalesced into a single ``/<password>/?cmd=7:1;8:0`` request. Each device
+has its own pool of kept-alive connections, closed after ``idle_timeout``
+seconds without use, and a cap on requests in flight.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+
+from pymegad.eventloop import loop_kwargs
+from pymegad.parser import REQUEST_END, is_keep_alive
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_HTTP_PORT = 80
+DEFAULT_IDLE_TIMEOUT = 30.0
+
+
+class CommandError(Exception):
+    pass
+
+
+class _DeviceChannel:
+    def __init__(self, ip, password, max_in_flight, loop=None):
+        self.ip = ip
+        self.password = password
+        # port -> (state, waiters)
+        self.pending = OrderedDict()
+        self.flush_scheduled = False
+        self.semaphore = asyncio.Semaphore(max_in_flight, **loop_kwargs(loop))
+        self.idle = []
+
+
+class MegadClient:
+    def __init__(self, loop, port=DEFAULT_HTTP_PORT, max_in_flight=2,
+                 timeout=5.0, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self._loop = loop
+        self._port = port
+        self._max_in_flight = max_in_flight
+        self._timeout = timeout
+        self._idle_timeout = idle_timeout
+        self._channels = {}
+
+    def _channel(self, ip, password):
+        channel = self._channels.get(ip)
+        if channel is None:
+            channel = _DeviceChannel(ip, password, self._max_in_flight, self._loop)
+            self._channels[ip] = channel
+        channel.password = password
+        return channel
+
+    def queue_command(self, ip, password, port, state):
+        """Queue ``port`` to be switched to ``state``; returns a future.
+
+        A later command for the same port replaces an earlier one that
+        has not been sent yet. The earlier future then completes with the
+        later one if both ask for the same state, and is cancelled
+        otherwise, since that switch never happens.
+        """
+        channel = self._channel(ip, password)
+        state = 1 if state else 0
+        waiter = self._loop.create_future()
+        waiters = [waiter]
+        queued = channel.pending.pop(port, None)
+        if queued is not None:
+            if queued[0] == state:
+                waiters = queued[1] + waiters
+            else:
+                for superseded in queued[1]:
+                    superseded.cancel()
+        channel.pending[port] = (state, waiters)
+        if not channel.flush_scheduled:
+            channel.flush_scheduled = True
+            self._loop.create_task(self._flush(channel))
+        return waiter
+
+    async def _flush(self, channel):
+        # Commands keep accumulating while every request slot is busy.
+        await channel.semaphore.acquire()
+        try:
+            channel.flush_scheduled = False
+            pending = list(channel.pending.items())
+            channel.pending.clear()
+            commands = ';'.join('{}:{}'.format(port, state)
+                                for port, (state, _) in pending)
+            waiters = [waiter for _, (_, port_waiters) in pending
+                       for waiter in port_waiters]
+            try:
+                body = await self._send(channel, 'cmd=' + commands)
+            except asyncio.CancelledError:
+                for waiter in waiters:
+                    waiter.cancel()
+                raise
+            except Exception as exc:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(exc)
+                return
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(body)
+        finally:
+            channel.semaphore.release()
+
+    async def request(self, ip, password, query):
+        """Send ``GET /<password>/?<query>`` to a device, returning the body."""
+        channel = self._channel(ip, password)
+        await channel.semaphore.acquire()
+        try:
+            return await self._send(channel, query)
+        finally:
+            channel.semaphore.release()
+
+    async def _send(self, channel, query):
+        try:
+            return await asyncio.wait_for(
+                self._exchange(channel, query), timeout=self._timeout)
+        except asyncio.TimeoutError:
+            raise CommandError('Timeout talking to {}'.format(channel.ip))
+        except (OSError, ValueError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError) as exc:
+            raise CommandError('Bad response from {}: {}'.format(
+                channel.ip, exc))
+
+    async def _exchange(self, channel, query):
+        path = '/{}/?{}'.format(channel.password, query) \
+            if channel.password else '/?{}'.format(query)
+        message = 'GET {} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(
+            path, channel.ip).encode('latin-1')
+        while channel.idle:
+            reader, writer, expiry = channel.idle.pop()
+            expiry.cancel()
+            if reader.at_eof():
+                writer.close()
+                continue
+            try:
+                return await self._roundtrip(
+                    channel, reader, writer, message)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The device dropped the kept-alive connection; retry.
+                writer.close()
+            except BaseException:
+                writer.close()
+                raise
+        reader, writer = await asyncio.open_connection(
+            channel.ip, self._port)
+        try:
+            return await self._roundtrip(
+                channel, reader, writer, message)
+        except BaseException:
+            # Also on the timeout cancelling the exchange.
+            writer.close()
+            raise
+
+    async def _roundtrip(self, channel, reader, writer, message):
+        writer.write(message)
+        await writer.drain()
+        head = await reader.readuntil(REQUEST_END)
+        status_line = head[:head.find(b'\r\n')].split(None, 2)
+        if len(status_line) < 2:
+            raise ValueError('malformed status line {!r}'.format(head[:64]))
+        version = status_line[0]
+        length = None
+        lower_head = head.lower()
+        pos = lower_head.find(b'\r\ncontent-length:')
+        if pos >= 0:
+            end = lower_head.find(b'\r\n', pos + 2)
+            length = int(head[pos + 17:end].strip())
+        if length is None:
+            body = await reader.read()
+            writer.close()
+        else:
+            body = await reader.readexactly(length)
+            if is_keep_alive(head, version):
+                self._park(channel, reader, writer)
+            else:
+                writer.close()
+        if status_line[1] != b'200':
+            raise CommandError('{} answered {}'.format(
+                channel.ip, head[:head.find(b'\r\n')].decode('latin-1')))
+        _LOGGER.debug('Device %s answered: %s', channel.ip, body)
+        return body.decode('latin-1')
+
+    def _park(self, channel, reader, writer):
+        """Keep a connection for reuse, closing it once idle too long."""
+        def expire():
+            for index, entry in enumerate(channel.idle):
+                if entry[1] is writer:
+                    del channel.idle[index]
+                    break
+            writer.close()
+        expiry = self._loop.call_later(self._idle_timeout, expire)
+        channel.idle.append((reader, writer, expiry))
+
+    def close(self):
+        for channel in self._channels.values():
+            while channel.idle:
+                _, writer, expiry = channel.idle.pop()
+                expiry.cancel()
+                writer.close()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""YAML configuration loading with a compiled on-disk cache.
+
+Parsed files are marshalled into the user cache directory, keyed by the
+absolute path. A cache entry is used when the file's mtime and size are
+unchanged, or when its content hash still matches; only then is the
+YAML parsed again, with the C-accelerated safe loader when available.
+Cache files that are not owned by the current user or are writable by
+others are ignored, and data marshal cannot store is simply not cached.
+
+``config.yaml`` is read from the working directory unless a path is
+given; the package ships ``mega.yaml`` and an example ``config.yaml``.
+"""
+
+import hashlib
+import logging
+import marshal
+import os
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+_LOGGER = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MEGA_PATH = os.path.join(PACKAGE_DIR, 'mega.yaml')
+DEFAULT_CONFIG_PATH = 'config.yaml'
+EXAMPLE_CONFIG_PATH = os.path.join(PACKAGE_DIR, 'config.yaml')
+CACHE_VERSION = 2
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pymegad')
+
+
+def _cache_path(path, cache_dir):
+    key = hashlib.sha1(path.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, key + '.marshal')
+
+
+def _trusted(stat):
+    if hasattr(os, 'getuid') and stat.st_uid != os.getuid():
+        return False
+    return not stat.st_mode & 0o022
+
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path, 'rb') as cached:
+            if not _trusted(os.fstat(cached.fileno())):
+                _LOGGER.warning('Ignoring config cache %s: not owned by this user '
+                                'or writable by others', cache_path)
+                return None
+            entry = marshal.load(cached)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(entry, dict) or entry.get('version') != CACHE_VERSION:
+        return None
+    return entry
+
+
+def _write_cache(cache_path, entry):
+    temporary = cache_path + '.{}.tmp'.format(os.getpid())
+    try:
+        content = marshal.dumps(entry)
+    except ValueError as exc:
+        _LOGGER.debug('Config cache not written to %s: %s', cache_path, exc)
+        return
+    try:
+        os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+        descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'wb') as cached:
+            cached.write(content)
+        os.replace(temporary, cache_path)
+    except OSError as exc:
+        _LOGGER.debug('Config cache not written to %s: %s', cache_path, exc)
+
+
+def load_yaml(path, cache_dir=None, use_cache=True):
+    """Load a YAML file, reusing the cached result when it is unchanged."""
+    path = os.path.abspath(path)
+    if not use_cache:
+        with open(path, 'rb') as source:
+            return yaml.load(source, Loader=SafeLoader)
+
+    cache_path = _cache_path(path, cache_dir or default_cache_dir())
+    stat = os.stat(path)
+    entry = _read_cache(cache_path)
+    if entry is not None and entry['path'] == path and \
+            entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+        return entry['data']
+
+    with open(path, 'rb') as source:
+        content = source.read()
+    digest = hashlib.sha1(content).hexdigest()
+    if entry is not None and entry['path'] == path and \
+            entry['digest'] == digest:
+        data = entry['data']
+    else:
+        data = yaml.load(content, Loader=SafeLoader)
+        _LOGGER.debug('Parsed %s', path)
+    _write_cache(cache_path, {
+        'version': CACHE_VERSION,
+        'path': path,
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'digest': digest,
+        'data': data,
+    })
+    return data
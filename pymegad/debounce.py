@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Debouncing and click classification for flapping inputs.
+
+Buttons and reed contacts make a controller report several transitions
+within milliseconds. For ports configured with ``debounce`` the reported
+states are held back until the input has been quiet for that many
+seconds (or ``debounce_max`` passed since the burst began) and only the
+settled state reaches the registry; a burst ending where it started
+produces no transition at all.
+
+Ports with ``clicks`` enabled additionally have their settled presses
+classified: a press held for ``long_press`` seconds is ``long``, and
+short presses following each other within ``click_window`` seconds are
+counted into ``single``, ``double`` or ``multi`` clicks::
+
+    ports:
+      3:
+        name: Hall button
+        debounce: 0.05
+        clicks: true
+        long_press: 0.8
+        click_window: 0.4
+"""
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+CLICK_SINGLE = 'single'
+CLICK_DOUBLE = 'double'
+CLICK_MULTI = 'multi'
+CLICK_LONG = 'long'
+CLICKS = (CLICK_SINGLE, CLICK_DOUBLE, CLICK_MULTI, CLICK_LONG)
+
+DEFAULT_LONG_PRESS = 0.8
+DEFAULT_CLICK_WINDOW = 0.4
+
+
+class _PortInput:
+    __slots__ = ('debounce', 'debounce_max', 'clicks', 'long_press',
+                 'click_window', 'pending', 'first', 'timer', 'pressed_at',
+                 'count', 'click_timer')
+
+    def __init__(self, settings):
+        self.debounce = float(settings.get('debounce') or 0)
+        self.debounce_max = float(settings.get('debounce_max') or
+                                  self.debounce * 10)
+        self.clicks = bool(settings.get('clicks'))
+        self.long_press = float(settings.get('long_press') or DEFAULT_LONG_PRESS)
+        self.click_window = float(settings.get('click_window') or
+                                  DEFAULT_CLICK_WINDOW)
+        self.pending = None
+        self.first = None
+        self.timer = None
+        self.pressed_at = None
+        self.count = 0
+        self.click_timer = None
+
+    def cancel(self):
+        for timer in (self.timer, self.click_timer):
+            if timer is not None:
+                timer.cancel()
+        self.timer = self.click_timer = None
+
+
+class Debouncer:
+    def __init__(self, loop, registry):
+        self._loop = loop
+        self._registry = registry
+        self._inputs = {}
+        self._listeners = []
+        self.coalesced = 0
+
+    def add_listener(self, callback):
+        """Call ``callback(device, port, kind, count)`` for every click."""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def configure(self, devices):
+        """Take the per-port settings from the ``{ip: {'ports': ...}}``
+        device list, keeping the state of ports whose settings are kept."""
+        inputs = {}
+        for ip, params in devices.items():
+            for port, settings in (params.get('ports') or {}).items():
+                if not isinstance(settings, dict) or not \
+                        (settings.get('debounce') or settings.get('clicks')):
+                    continue
+                key = (ip, int(port))
+                current = self._inputs.pop(key, None)
+                fresh = _PortInput(settings)
+                if current is not None and all(
+                        getattr(current, name) == getattr(fresh, name)
+                        for name in ('debounce', 'debounce_max', 'clicks',
+                                     'long_press', 'click_window')):
+                    fresh = current
+                inputs[key] = fresh
+        for port_input in self._inputs.values():
+            port_input.cancel()
+        self._inputs = inputs
+
+    def close(self):
+        for port_input in self._inputs.values():
+            port_input.cancel()
+
+    def feed(self, device, port, state):
+        """Ingest a reported state; returns False when it was applied
+        directly because the port is not debounced."""
+        port_input = self._inputs.get((device, port))
+        if port_input is None or port_input.debounce <= 0:
+            self._registry.set_state(device, port, state)
+            return False
+        now = self._loop.time()
+        if port_input.timer is None:
+            port_input.first = now
+        else:
+            port_input.timer.cancel()
+            self.coalesced += 1
+        port_input.pending = state
+        port_input.timer = self._loop.call_at(
+            min(now + port_input.debounce,
+                port_input.first + port_input.debounce_max),
+            self._settle, device, port, port_input)
+        return True
+
+    def discard(self, device):
+        """Drop the states of ``device`` still held back; a full status
+        snapshot of the device supersedes them."""
+        for (ip, port), port_input in self._inputs.items():
+            if ip == device and port_input.timer is not None:
+                port_input.timer.cancel()
+                port_input.timer = None
+
+    def _settle(self, device, port, port_input):
+        port_input.timer = None
+        self._registry.set_state(device, port, port_input.pending)
+
+    def on_transition(self, device, port, old, new):
+        """Registry listener classifying settled presses into clicks."""
+        port_input = self._inputs.get((device, port))
+        if port_input is None or not port_input.clicks:
+            return
+        if new is None:
+            # The device went offline: drop the press in progress.
+            port_input.pressed_at = None
+            return
+        now = self._loop.time()
+        if new:
+            port_input.pressed_at = now
+            if port_input.click_timer is not None:
+                port_input.click_timer.cancel()
+                port_input.click_timer = None
+            return
+        if port_input.pressed_at is None:
+            return
+        held = now - port_input.pressed_at
+        port_input.pressed_at = None
+        if held >= port_input.long_press:
+            count, port_input.count = port_input.count + 1, 0
+            self._emit(device, port, CLICK_LONG, count)
+            return
+        port_input.count += 1
+        port_input.click_timer = self._loop.call_later(
+            port_input.click_window, self._finish_clicks, device, port,
+            port_input)
+
+    def _finish_clicks(self, device, port, port_input):
+        count, port_input.count = port_input.count, 0
+        port_input.click_timer = None
+        if count == 1:
+            kind = CLICK_SINGLE
+        elif count == 2:
+            kind = CLICK_DOUBLE
+        else:
+            kind = CLICK_MULTI
+        self._emit(device, port, kind, count)
+
+    def _emit(self, device, port, kind, count):
+        _LOGGER.debug('Device %s port %s %s click', device, port, kind)
+        for callback in self._listeners:
+            callback(device, port, kind, count)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Event loop selection.
+
+``event_loop: uvloop`` in the server options runs the server on uvloop
+when it is installed (the ``uvloop`` extra); otherwise, and by default,
+the standard asyncio loop is used.
+"""
+
+import asyncio
+import logging
+import sys
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+_LOGGER = logging.getLogger(__name__)
+
+LOOP_ASYNCIO = 'asyncio'
+LOOP_UVLOOP = 'uvloop'
+LOOPS = (LOOP_ASYNCIO, LOOP_UVLOOP)
+
+
+def available_loops():
+    return [kind for kind in LOOPS if kind != LOOP_UVLOOP or uvloop is not None]
+
+
+def loop_policy(kind=LOOP_ASYNCIO):
+    """Return the event loop policy for ``kind``, falling back to the
+    asyncio one when it is not available."""
+    if kind == LOOP_UVLOOP:
+        if uvloop is not None:
+            return uvloop.EventLoopPolicy()
+        _LOGGER.warning('uvloop is not installed, using the asyncio event loop')
+    elif kind != LOOP_ASYNCIO:
+        _LOGGER.error('Unknown event loop %s, using asyncio', kind)
+    return asyncio.DefaultEventLoopPolicy()
+
+
+def install_policy(kind=LOOP_ASYNCIO):
+    """Make ``kind`` the loop created by ``asyncio.new_event_loop()``."""
+    asyncio.set_event_loop_policy(loop_policy(kind))
+
+
+def new_event_loop(kind=LOOP_ASYNCIO):
+    return loop_policy(kind).new_event_loop()
+
+
+def loop_kwargs(loop):
+    """Keyword arguments binding an asyncio queue, event or semaphore to
+    ``loop``.
+
+    Before Python 3.10 these bind to ``get_event_loop()`` when created,
+    which is not ``loop`` unless it is the current one; later versions
+    bind to the running loop on first use and take no ``loop`` argument.
+    """
+    if loop is None or sys.version_info >= (3, 10):
+        return {}
+    return {'loop': loop}
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Port change event bus.
+
+The bus is fed by :class:`pymegad.ports.PortRegistry` listeners and only
+sees real transitions. Every subscriber gets its own bounded
+``asyncio.Queue``; what happens when a slow subscriber's queue is full
+is decided by its overflow policy.
+"""
+
+import asyncio
+from collections import OrderedDict, namedtuple
+
+from pymegad.eventloop import loop_kwargs
+
+PortEvent = namedtuple('PortEvent', 'device port old new')
+
+POLICY_DROP = 'drop'
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_COALESCE = 'coalesce'
+POLICIES = (POLICY_DROP, POLICY_DROP_OLDEST, POLICY_COALESCE)
+
+
+class _CoalescingQueue(asyncio.Queue):
+    """Queue holding at most one event per port, in arrival order of the
+    first one; later events of a queued port are merged into it, even
+    when the queue is full."""
+
+    def _init(self, maxsize):
+        self._queue = OrderedDict()
+
+    def _put(self, event):
+        self._queue[(event.device, event.port)] = event
+
+    def _get(self):
+        return self._queue.popitem(last=False)[1]
+
+    def put_nowait(self, event):
+        if not self.merge(event):
+            super().put_nowait(event)
+
+    def merge(self, event):
+        """Merge ``event`` into the queued event of its port; returns False
+        when none is queued."""
+        key = (event.device, event.port)
+        queued = self._queue.get(key)
+        if queued is None:
+            return False
+        event = event._replace(old=queued.old)
+        if event.old == event.new:
+            # The transitions cancelled out: the queued event is done.
+            del self._queue[key]
+            self.task_done()
+        else:
+            self._queue[key] = event
+        return True
+
+
+class Subscription:
+    """A filtered, bounded view of the event stream.
+
+    Consume events with ``await subscription.queue.get()``.
+    """
+
+    def __init__(self, bus, device=None, port=None, maxsize=100,
+                 policy=POLICY_DROP):
+        if policy not in POLICIES:
+            raise ValueError('Unknown overflow policy: {}'.format(policy))
+        self.device = device
+        self.port = port
+        self.policy = policy
+        if policy == POLICY_COALESCE:
+            self.queue = _CoalescingQueue(maxsize=maxsize, **loop_kwargs(bus.loop))
+        else:
+            self.queue = asyncio.Queue(maxsize=maxsize, **loop_kwargs(bus.loop))
+        self.dropped = 0
+        self._bus = bus
+
+    def matches(self, event):
+        return self.port is None or self.port == event.port
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.policy == POLICY_DROP:
+            self.dropped += 1
+            return
+        # Both other policies make room by dropping the oldest event; with
+        # coalescing that is the oldest port still pending.
+        self.queue.get_nowait()
+        self.queue.task_done()
+        self.dropped += 1
+        self.queue.put_nowait(event)
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+
+class EventBus:
+    """Fan-out of port transitions to per-subscriber queues.
+
+    Subscriber queues are bound to ``loop`` when it is set, and otherwise
+    to the current loop when subscribing.
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self._subscribers = {}
+
+    def subscribe(self, device=None, port=None, maxsize=100,
+                  policy=POLICY_DROP):
+        """Subscribe to transitions of one device and/or port.
+
+        ``None`` filters match everything. ``policy`` is one of
+        ``'drop'`` (discard new events), ``'drop_oldest'`` or
+        ``'coalesce'`` (keep one queued event per port, merged into the
+        net transition).
+        """
+        subscription = Subscription(self, device, port, maxsize, policy)
+        self._subscribers.setdefault(device, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscribers = self._subscribers.get(subscription.device, [])
+        if subscription in subscribers:
+            subscribers.remove(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.device]
+
+    def publish(self, device, port, old, new):
+        event = PortEvent(device, port, old, new)
+        for key in ((device, None) if device is not None else (None,)):
+            for subscription in self._subscribers.get(key, ()):
+                if subscription.matches(event):
+                    subscription.put(event)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""Device liveness on a hashed timer wheel.
+
+Every request or successful poll marks its device as seen, which only
+stores a timestamp. Deadlines live in a single :class:`TimerWheel`
+advanced by one periodic tick, so thousands of devices cost one timer
+handle instead of one ``call_later`` each. When a device's slot comes
+round and it has been seen since, it is simply put back on the wheel for
+the remaining time; otherwise it goes offline.
+
+Heartbeat deadlines come from the ``heartbeat_timeout`` server option
+and can be set per device with ``heartbeat`` in its ``switch`` entry.
+
+In worker mode a device talks to whichever worker the kernel picks, so
+the last-seen times live in the shared segment (``allocate``) and every
+worker judges a device by the contacts made through all of them.
+Offline devices then stay on the wheel and are checked every tick, to
+notice when another worker heard from them again.
+"""
+
+import logging
+import math
+import struct
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TICK = 1.0
+DEFAULT_SLOTS = 512
+
+
+class TimerWheel:
+    """Hashed timer wheel of ``slots`` buckets, ``tick`` seconds apart.
+
+    A key due in ``n`` ticks is put into bucket ``(cursor + n) % slots``
+    with the number of full turns to wait; scheduling, cancelling and
+    expiring are O(1) per key.
+    """
+
+    def __init__(self, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]
+        self._cursor = 0
+        self._where = {}
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def __len__(self):
+        return len(self._where)
+
+    def schedule(self, key, delay):
+        """(Re)schedule ``key`` to expire after at least ``delay`` seconds."""
+        self.cancel(key)
+        ticks = max(1, int(math.ceil(delay / self.tick)))
+        slot = (self._cursor + ticks) % len(self._slots)
+        self._slots[slot][key] = (ticks - 1) // len(self._slots)
+        self._where[key] = slot
+
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self):
+        """Move one tick forward, returning the keys that expired."""
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        bucket = self._slots[self._cursor]
+        expired = []
+        for key, rounds in list(bucket.items()):
+            if rounds:
+                bucket[key] = rounds - 1
+            else:
+                del bucket[key]
+                del self._where[key]
+                expired.append(key)
+        return expired
+
+
+_STAMP = struct.Struct('d')
+
+
+class LivenessTracker:
+    def __init__(self, loop, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS, allocate=None):
+        """``allocate(size)`` returns the zeroed buffer keeping the
+        last-seen time of a device; pass a shared memory allocator to share
+        them between processes, which must configure the same devices in
+        the same order."""
+        self._loop = loop
+        self._wheel = TimerWheel(tick, slots)
+        self._deadlines = {}
+        self.shared = allocate is not None
+        self._allocate = allocate or bytearray
+        # ip -> buffer holding the loop time of the last contact, 0: never
+        self._last_seen = {}
+        # offline ip -> its last-seen time when it went offline
+        self._offline = {}
+        self._listeners = []
+        self._timer = None
+        self._next_tick = None
+
+    def add_listener(self, callback):
+        """Call ``callback(device, online)`` when a device goes offline or
+        comes back."""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def configure(self, deadlines):
+        """Track the devices of ``{ip: deadline}``; a falsy deadline
+        disables tracking of that device."""
+        deadlines = {ip: deadline for ip, deadline in deadlines.items() if deadline}
+        for ip in list(self._deadlines):
+            if ip not in deadlines:
+                self._wheel.cancel(ip)
+                self._offline.pop(ip, None)
+                self._last_seen.pop(ip, None)
+        now = self._loop.time()
+        for ip, deadline in deadlines.items():
+            if ip not in self._last_seen:
+                self._last_seen[ip] = self._allocate(_STAMP.size)
+                if not self._get_seen(ip):
+                    self._set_seen(ip, now)
+            if self._deadlines.get(ip) != deadline and ip not in self._offline:
+                self._wheel.schedule(ip, self._get_seen(ip) + deadline - now)
+        self._deadlines = deadlines
+
+    def _get_seen(self, ip):
+        return _STAMP.unpack_from(self._last_seen[ip])[0]
+
+    def _set_seen(self, ip, when):
+        _STAMP.pack_into(self._last_seen[ip], 0, when)
+
+    def seen(self, ip):
+        """Record that ``ip`` talked to us."""
+        if ip not in self._last_seen:
+            return
+        self._set_seen(ip, self._loop.time())
+        if ip in self._offline:
+            self._online(ip)
+
+    def _online(self, ip):
+        del self._offline[ip]
+        self._wheel.schedule(ip, self._deadlines[ip])
+        _LOGGER.info('Device %s is online', ip, extra={'device': ip})
+        self._notify(ip, True)
+
+    def last_seen(self, ip):
+        """Loop time of the last contact with ``ip``, or None."""
+        return self._get_seen(ip) if ip in self._last_seen else None
+
+    def is_online(self, ip):
+        return ip not in self._offline
+
+    def offline(self):
+        return sorted(self._offline)
+
+    def start(self):
+        if self._timer is None:
+            self._next_tick = self._loop.time() + self._wheel.tick
+            self._timer = self._loop.call_at(self._next_tick, self._tick)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _tick(self):
+        now = self._loop.time()
+        # Catch up on ticks missed while the loop was busy.
+        while self._next_tick <= now:
+            self._next_tick += self._wheel.tick
+            for ip in self._wheel.advance():
+                self._expire(ip, now)
+        self._timer = self._loop.call_at(self._next_tick, self._tick)
+
+    def _expire(self, ip, now):
+        deadline = self._deadlines.get(ip)
+        if deadline is None:
+            return
+        seen = self._get_seen(ip)
+        if ip in self._offline:
+            if seen > self._offline[ip]:
+                # Another process heard from the device.
+                self._online(ip)
+            else:
+                self._wheel.schedule(ip, self._wheel.tick)
+            return
+        remaining = seen + deadline - now
+        if remaining > 0:
+            self._wheel.schedule(ip, remaining)
+            return
+        self._offline[ip] = seen
+        if self.shared:
+            self._wheel.schedule(ip, self._wheel.tick)
+        _LOGGER.warning('Device %s is offline, last seen %.0f s ago', ip,
+                        now - seen, extra={'device': ip})
+        self._notify(ip, False)
+
+    def _notify(self, ip, online):
+        for callback in self._listeners:
+            callback(ip, online)
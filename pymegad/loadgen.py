@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Synthetic MegaD load generator.
+
+Simulates many controllers pushing ``GET /?pt=N`` events at a
+:class:`pymegad.main.MegadServer` and reports throughput, latency
+percentiles and the server's peak memory. Every simulated controller
+binds its own loopback address (127.1.x.y) so the server sees one peer
+IP per controller, just like in production.
+
+Run ``python -m pymegad.loadgen --help`` for the options.
+"""
+
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import random
+import time
+
+from pymegad.eventloop import LOOP_ASYNCIO, LOOPS
+
+PORTS_PER_DEVICE = 38
+
+
+def device_ips(count):
+    """Loopback addresses used as controller IPs."""
+    return ['127.1.{}.{}'.format(index // 250, index % 250 + 1)
+            for index in range(count)]
+
+
+def synthetic_config(ips, ports=PORTS_PER_DEVICE):
+    return {
+        'switch': [{
+            'platform': 'megad',
+            'ip': ip,
+            'name': 'loadgen {}'.format(ip),
+            'ports': {port: {} for port in range(ports)},
+        } for ip in ips],
+        'server': {'keep_alive_timeout': 60},
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def peak_rss_kib(pid):
+    """Peak resident set size of a process in KiB (Linux only)."""
+    try:
+        with open('/proc/{}/status'.format(pid)) as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def event_requests(ports=PORTS_PER_DEVICE, keep_alive=False):
+    """Endless stream of encoded MegaD event requests."""
+    connection = b'keep-alive' if keep_alive else b'close'
+    for port in itertools.cycle(range(ports)):
+        release = b'&m=1' if random.random() < 0.5 else b''
+        yield (b'GET /?pt=' + str(port).encode() + release +
+               b' HTTP/1.1\r\nConnection: ' + connection + b'\r\n\r\n')
+
+
+class LoadResult:
+    def __init__(self, latencies, errors, elapsed, server_rss=None):
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+        self.server_rss = server_rss
+
+    @property
+    def throughput(self):
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        lines = [
+            'events:      {}'.format(len(self.latencies)),
+            'errors:      {}'.format(self.errors),
+            'elapsed:     {:.3f} s'.format(self.elapsed),
+            'throughput:  {:.0f} events/s'.format(self.throughput),
+            'latency p50: {:.3f} ms'.format(
+                percentile(self.latencies, 0.5) * 1000),
+            'latency p99: {:.3f} ms'.format(
+                percentile(self.latencies, 0.99) * 1000),
+        ]
+        if self.server_rss is not None:
+            lines.append('server peak RSS: {} KiB'.format(self.server_rss))
+        return '\n'.join(lines)
+
+
+async def _controller(host, port, ip, events, keep_alive, latencies, errors):
+    requests = event_requests(keep_alive=keep_alive)
+    reader = writer = None
+    for _ in range(events):
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(
+                    host, port, local_addr=(ip, 0))
+            started = time.perf_counter()
+            writer.write(next(requests))
+            await reader.readuntil(b'\r\n\r\n')
+            latencies.append(time.perf_counter() - started)
+        except (OSError, asyncio.IncompleteReadError):
+            errors[0] += 1
+            keep_alive = False
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def generate_load(host, port, ips, events_per_device, concurrency,
+                        keep_alive=False):
+    """Push events from every controller in ``ips``; at most
+    ``concurrency`` controllers are connected at the same time."""
+    latencies = []
+    errors = [0]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(ip):
+        await semaphore.acquire()
+        try:
+            await _controller(host, port, ip, events_per_device,
+                              keep_alive, latencies, errors)
+        finally:
+            semaphore.release()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[limited(ip) for ip in ips])
+    return LoadResult(latencies, errors[0], time.perf_counter() - started)
+
+
+def _serve(host, port, config, ready):
+    from pymegad.main import MegadServer
+
+    server = MegadServer(host, port, config=config)
+    server.start(and_loop=False)
+    ready.set()
+    try:
+        server.loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def run(devices, events_per_device, concurrency, keep_alive=False,
+        host='127.0.0.1', port=16099, target=None, event_loop=LOOP_ASYNCIO):
+    """Run a load test, spawning a local server on the ``event_loop`` kind
+    of loop unless ``target`` is given as ``(host, port)``."""
+    ips = device_ips(devices)
+    process = None
+    if target is None:
+        config = synthetic_config(ips)
+        config['server']['event_loop'] = event_loop
+        ready = multiprocessing.Event()
+        process = multiprocessing.Process(
+            target=_serve, args=(host, port, config, ready))
+        process.start()
+        ready.wait(30)
+        target = (host, port)
+    loop = asyncio.new_event_loop()
+    try:
+        result = loop.run_until_complete(generate_load(
+            target[0], target[1], ips, events_per_device, concurrency,
+            keep_alive))
+        if process is not None:
+            result.server_rss = peak_rss_kib(process.pid)
+    finally:
+        loop.close()
+        if process is not None:
+            process.terminate()
+            process.join()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='MegaD load generator')
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=20,
+                        help='events sent by every device')
+    parser.add_argument('--concurrency', type=int, default=200,
+                        help='devices connected at the same time')
+    parser.add_argument('--keep-alive', action='store_true',
+                        help='reuse one connection per device')
+    parser.add_argument('--port', type=int, default=16099)
+    parser.add_argument('--loop', choices=LOOPS, default=LOOP_ASYNCIO,
+                        help='event loop of the spawned server')
+    parser.add_argument('--target', metavar='HOST:PORT',
+                        help='load an already running server instead')
+    args = parser.parse_args(argv)
+    target = None
+    if args.target:
+        host, _, port = args.target.rpartition(':')
+        target = (host, int(port))
+    result = run(args.devices, args.events, args.concurrency,
+                 keep_alive=args.keep_alive, port=args.port, target=target,
+                 event_loop=args.loop)
+    print(result.report())
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
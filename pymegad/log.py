@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Logging setup keeping I/O off the event loop.
+
+Records are put on an in-memory queue by a ``QueueHandler`` and written
+by a ``QueueListener`` thread, so a slow disk or syslog never blocks the
+loop. Per-request and per-transition records go to dedicated loggers
+that can be sampled.
+"""
+
+import itertools
+import logging
+import logging.handlers
+import queue
+
+REQUESTS_LOGGER = 'pymegad.requests'
+TRANSITIONS_LOGGER = 'pymegad.transitions'
+
+STRUCTURED_FIELDS = ('device', 'port', 'old', 'new')
+
+DEFAULT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+class SamplingFilter(logging.Filter):
+    """Let one of every ``every`` INFO and lower records through; warnings
+    and errors always pass and are not counted."""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, int(every))
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        return next(self._counter) % self.every == 0
+
+
+class StructuredFormatter(logging.Formatter):
+    """Append the structured ``extra`` fields as ``key=value`` pairs."""
+
+    def format(self, record):
+        message = super().format(record)
+        fields = ['{}={}'.format(name, getattr(record, name))
+                  for name in STRUCTURED_FIELDS if hasattr(record, name)]
+        return ' '.join([message] + fields) if fields else message
+
+
+def setup_logging(level=logging.INFO, handlers=None, sample_every=1,
+                  fmt=DEFAULT_FORMAT):
+    """Route root logging through a background listener.
+
+    ``handlers`` default to a stderr stream handler. Request and
+    transition records are sampled one in ``sample_every``. Returns the
+    started listener; call ``stop()`` on it to flush at exit.
+    """
+    if not handlers:
+        handlers = [logging.StreamHandler()]
+    formatter = StructuredFormatter(fmt)
+    for handler in handlers:
+        if handler.formatter is None:
+            handler.setFormatter(formatter)
+
+    records = queue.Queue(-1)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+
+    for name in (REQUESTS_LOGGER, TRANSITIONS_LOGGER):
+        logger = logging.getLogger(name)
+        for log_filter in list(logger.filters):
+            if isinstance(log_filter, SamplingFilter):
+                logger.removeFilter(log_filter)
+        if sample_every > 1:
+            logger.addFilter(SamplingFilter(sample_every))
+
+    listener = logging.handlers.QueueListener(
+        records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -1,48 +1,326 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import argparse
 import asyncio
 import logging
-import concurrent.futures
-import yaml
-from urllib.parse import urlsplit
+import signal
+import sys
+import time
+
+from pymegad import metadata
+from pymegad.log import REQUESTS_LOGGER, TRANSITIONS_LOGGER, setup_logging
+
+from pymegad.api import SensorApi, StateApi, is_sensors_request, is_state_request
+from pymegad.capture import CaptureWriter
+from pymegad.client import DEFAULT_HTTP_PORT, DEFAULT_IDLE_TIMEOUT, CommandError, MegadClient
+from pymegad.config import DEFAULT_CONFIG_PATH, DEFAULT_MEGA_PATH, load_yaml
+from pymegad.debounce import Debouncer
+from pymegad.eventloop import LOOP_ASYNCIO, new_event_loop
+from pymegad.events import EventBus
+from pymegad.liveness import LivenessTracker
+from pymegad.metrics import ServerMetrics, serve_metrics
+from pymegad.parser import CRLF, REQUEST_END, Request, parse_query, parse_request
+from pymegad.persistence import StateStore
+from pymegad.poller import Poller
+from pymegad.ports import PortRegistry, SwitchPort  # noqa: F401
+from pymegad.rules import RuleEngine
+from pymegad.sensors import SensorStore
+from pymegad.stream import EventStream, is_events_request
+
+_LOGGER = logging.getLogger(__name__)
+_REQUESTS = logging.getLogger(REQUESTS_LOGGER)
+_TRANSITIONS = logging.getLogger(TRANSITIONS_LOGGER)
 
 CONF_ON_STATE = 'ON'
 CONF_OFF_STATE = 'OFF'
+CONF_UNKNOWN_STATE = 'UNKNOWN'
+
+# Precomputed response heads; only Content-Length and the body vary.
+OK_HEAD = {
+    keep_alive: ('HTTP/1.1 200 OK\r\n'
+                 'Content-Type: text/plain; set=iso-8859-1\r\n'
+                 'Connection: {}\r\nContent-Length: ').format(
+        'keep-alive' if keep_alive else 'close').encode()
+    for keep_alive in (True, False)
+}
+OK_EMPTY = {keep_alive: head + b'0\r\n\r\n' for keep_alive, head in OK_HEAD.items()}
+BAD_REQUEST = {
+    keep_alive: ('HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n'
+                 'Connection: {}\r\n\r\n').format(
+        'keep-alive' if keep_alive else 'close').encode()
+    for keep_alive in (True, False)
+}
+ACTION_SEPARATOR = ';'
+
+SERVICE_UNAVAILABLE = b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+HEADER_TOO_LARGE = (b'HTTP/1.1 431 Request Header Fields Too Large\r\n'
+                    b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+
+DEFAULT_SERVER_OPTIONS = {
+    'keep_alive': True,
+    'keep_alive_timeout': 30.0,
+    'request_timeout': 10.0,
+    'command_port': DEFAULT_HTTP_PORT,
+    'command_timeout': 5.0,
+    'command_max_in_flight': 2,
+    'command_idle_timeout': DEFAULT_IDLE_TIMEOUT,
+    'poll': False,
+    'poll_concurrency': 10,
+    'poll_min_interval': 5.0,
+    'poll_max_interval': 60.0,
+    'metrics_host': '127.0.0.1',
+    'metrics_port': None,
+    'state_dir': None,
+    'snapshot_interval': 60.0,
+    'journal_flush_interval': 1.0,
+    'max_header_size': 8192,
+    'max_connections': 1024,
+    'overflow': 'reject',
+    'allowlist': True,
+    'allow': [],
+    'allow_loopback': True,
+    'inline_replies': True,
+    'sensor_history': 8640,
+    'state_api': True,
+    'event_stream': True,
+    'stream_buffer': 65536,
+    'stream_overflow': 'resync',
+    'stream_ping': 15.0,
+    'event_loop': LOOP_ASYNCIO,
+    'capture_path': None,
+    'capture_flush_interval': 1.0,
+    'heartbeat_timeout': None,
+    'liveness_tick': 1.0,
+}
+
+OVERFLOW_POLICIES = ('reject', 'drop', 'wait')
+
+# Local clients of the JSON and event stream endpoints.
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1', '::ffff:127.0.0.1')
+
+
+def switch_ports(ports):
+    """The configured ports holding on/off states; sensor ports are left out."""
+    if not isinstance(ports, dict):
+        return ports
+    return [port for port, settings in ports.items()
+            if not (isinstance(settings, dict) and settings.get('sensor'))]
 
 
 class MegadServer:
-    def __init__(self, host, port, loop=None, config=None):
-
+    def __init__(self, host, port, loop=None, config=None, registry=None, reuse_port=False,
+                 config_path=None, mega_path=None, config_cache=True, persist=True,
+                 reloadable=True, poll=True, expose_metrics=True):
+        """``persist=False`` ignores ``state_dir``; in worker mode only one
+        process owns the state store. ``reloadable=False`` refuses config
+        reloads; in worker mode devices sit at fixed offsets of the shared
+        arena, which a reload in one worker would move under the others.
+        ``poll=False`` ignores the ``poll`` option, leaving device polling
+        to the process that owns it. ``expose_metrics=False`` ignores
+        ``metrics_port``, which only one process can listen on."""
+
+        self._host = host
+        self._port = port
+        self._reuse_port = reuse_port
         self._device_list = {}
         self._config = {}
-        self.ports = {}
+        self._config_path = config_path or DEFAULT_CONFIG_PATH
+        self._mega_path = mega_path or DEFAULT_MEGA_PATH
+        self._config_cache = config_cache
+        self._reloadable = reloadable
+        self._poll = poll
+        self._expose_metrics = expose_metrics
+        self._options = dict(DEFAULT_SERVER_OPTIONS)
+        self.ports = registry if registry is not None else PortRegistry()
+        self.events = EventBus()
+        self.stats = ServerMetrics()
+        self.metrics = self.stats.registry
+        self._metrics_server = None
+        self.store = None
+        self._persistence_timers = {}
+        self._snapshot_task = None
+        self.ports.add_listener(self.log_transition)
+        self.ports.add_listener(self.events.publish)
+        self._handlers = {
+            'all': self.handle_all,
+            'port_update': self.handle_port_update,
+        }
+        self._commands = {}
 
         self.mega_conf_load()
         self.set_config(config)
         self.config_parser()
+        self.server_options_parser()
+        if self._options['state_dir'] and persist:
+            self.store = StateStore(self._options['state_dir'])
+        self.capture = None
+        if self._options['capture_path']:
+            self.capture = CaptureWriter(self._options['capture_path'])
         self.generate_ports()
+        self.update_allowlist()
+        self.sensors = SensorStore(self._options['sensor_history'])
+        self.update_sensor_ports()
         self.get_port_status()
 
-        self._loop = loop or asyncio.get_event_loop()
-        self._server = asyncio.start_server(self.async_handle_connection, host=host, port=port)
+        if loop is None:
+            loop = new_event_loop(self._options['event_loop'])
+            asyncio.set_event_loop(loop)
+        self._loop = loop
+        self.events.loop = loop
+        self._server = None
+        self._connections = None
+        self.client = MegadClient(
+            self._loop,
+            port=self._options['command_port'],
+            max_in_flight=self._options['command_max_in_flight'],
+            timeout=self._options['command_timeout'],
+            idle_timeout=self._options['command_idle_timeout'])
+        self.ports.commander = self.send_command
+        self.rules = RuleEngine(self._loop, self.ports, self.send_command)
+        self.rules.load(self._config.get('rules') if self._config else None)
+        self.ports.add_listener(self.rules.on_transition)
+        self.state_api = None
+        self.sensor_api = None
+        if self._options['state_api']:
+            self.state_api = StateApi(self.ports)
+            self.ports.add_listener(self.state_api.on_transition)
+            self.sensor_api = SensorApi(self.sensors)
+        self.event_stream = None
+        if self._options['event_stream']:
+            self.event_stream = EventStream(
+                self._loop, self.ports,
+                buffer_size=self._options['stream_buffer'],
+                overflow=self._options['stream_overflow'],
+                ping_interval=self._options['stream_ping'])
+            self.ports.add_listener(self.event_stream.on_transition)
+        self.liveness = LivenessTracker(
+            self._loop, tick=self._options['liveness_tick'],
+            allocate=self.ports.allocate if self.ports.shared else None)
+        self.liveness.configure(self.heartbeats())
+        self.liveness.add_listener(self.device_liveness)
+        self.debouncer = Debouncer(self._loop, self.ports)
+        self.debouncer.configure(self._device_list)
+        self.debouncer.add_listener(self.rules.on_click)
+        self.ports.add_listener(self.debouncer.on_transition)
+        self.poller = Poller(
+            self._loop, self.poll_device,
+            concurrency=self._options['poll_concurrency'],
+            min_interval=self._options['poll_min_interval'],
+            max_interval=self._options['poll_max_interval'])
+        for ip in self._device_list:
+            self.poller.add_device(ip)
 
     def set_config(self, config=None):
         if config:
             self._config = config
         else:
-            with open('config.yaml', 'r') as cfg:
-                self._config = yaml.load(cfg)
-                logging.info('Config loaded: {}'.format(self._config))
+            self._config = load_yaml(self._config_path, use_cache=self._config_cache)
+            _LOGGER.info('Config loaded from %s: %s', self._config_path, self._config)
 
     def generate_ports(self):
         for ip, params in self._device_list.items():
-            self.ports = {port: SwitchPort(port) for port in params.get('ports')}
+            self.ports.add_device(ip, switch_ports(params.get('ports')))
+        if self.store is not None:
+            started = time.perf_counter()
+            applied = self.store.restore(self.ports)
+            _LOGGER.info('Port states restored from %s in %.1f ms (%d journal records)',
+                         self.store.directory, (time.perf_counter() - started) * 1000, applied)
+            self.store.open()
+            self.ports.add_listener(self.store.record)
+
+    def reload_config(self, config=None):
+        """Re-read the config and apply only the device differences.
+
+        Devices that are unchanged keep their state, connections and poll
+        schedule. Returns the added, removed and changed device addresses.
+        A config that cannot be read or has no valid ``switch`` section
+        raises and leaves everything as it was.
+        """
+        if not self._reloadable:
+            raise RuntimeError('Config reload is disabled for this server')
+        old_devices = self._load_devices(config)
+        self._options = dict(DEFAULT_SERVER_OPTIONS)
+        self.server_options_parser()
+
+        added = [ip for ip in self._device_list if ip not in old_devices]
+        removed = [ip for ip in old_devices if ip not in self._device_list]
+        changed = [ip for ip, params in self._device_list.items()
+                   if ip in old_devices and params != old_devices[ip]]
+        self._apply_device_changes(old_devices, added, removed, changed)
+        self._rewire()
+        _LOGGER.info('Config reloaded: added %s, removed %s, changed %s', added, removed, changed)
+        return {'added': added, 'removed': removed, 'changed': changed}
+
+    def _load_devices(self, config=None):
+        """Parse the new device list; returns the old one. Restores the old
+        config and devices if the new config is unusable."""
+        old_devices = self._device_list
+        old_config = self._config
+        self._device_list = {}
+        try:
+            self.set_config(config)
+            self.config_parser()
+            if not self._device_list:
+                raise ValueError('No MegaD devices in the new config, keeping the current ones')
+        except Exception:
+            self._device_list = old_devices
+            self._config = old_config
+            raise
+        return old_devices
+
+    def _apply_device_changes(self, old_devices, added, removed, changed):
+        for ip in added:
+            self.ports.add_device(ip, switch_ports(self._device_list[ip].get('ports')))
+            self.poller.add_device(ip)
+        for ip in removed:
+            self.ports.remove_device(ip)
+            self.poller.remove_device(ip)
+            self.sensors.forget(ip)
+        for ip in changed:
+            if self._device_list[ip].get('ports') != old_devices[ip].get('ports'):
+                self.ports.reconfigure_device(ip, switch_ports(self._device_list[ip].get('ports')))
+
+    def _rewire(self):
+        """Point the per-device helpers at the reloaded device list"""
+        self.update_allowlist()
+        self.update_sensor_ports()
+        self.liveness.configure(self.heartbeats())
+        if self.state_api is not None:
+            self.state_api.forget()
+        self.debouncer.configure(self._device_list)
+        self.rules.load(self._config.get('rules'))
+
+    def _reload_on_signal(self):
+        try:
+            self.reload_config()
+        except Exception:
+            _LOGGER.exception('Config reload failed')
 
     def mega_conf_load(self):
-        with open('mega.yaml') as mega_conf:
-            self._mega_def = yaml.load(mega_conf)
-            logging.info('Mega definition loaded: {}'.format(self._mega_def))
+        self._mega_def = load_yaml(self._mega_path, use_cache=self._config_cache)
+        _LOGGER.info('Mega definition loaded: %s', self._mega_def)
+        self.compile_commands()
+
+    def compile_commands(self):
+        """Build the query key -> handler dispatch table from mega.yaml"""
+        self._commands = {
+            self._mega_def.get(name, name): handler
+            for name, handler in self._handlers.items()
+        }
+        self._port_off_key = self._mega_def.get('port_off')
+        self._value_key = self._mega_def.get('value')
+
+    def register_command(self, name, handler):
+        """Register handler(device, value, command) for a mega.yaml message type.
+
+        ``name`` is looked up in the MegaD definition; unknown names are used
+        as the query key itself. A handler may return an action string such
+        as ``'7:1'``, which is sent back in the response body for the device
+        to execute.
+        """
+        self._handlers[name] = handler
+        self._commands[self._mega_def.get(name, name)] = handler
 
     def config_parser(self):
         if self._config:
@@ -53,7 +331,9 @@ class MegadServer:
                     self._device_list.update({
                         switch.get('ip'): {
                             "name": switch.get('name'),
-                            "ports": switch.get('ports')
+                            "password": switch.get('pass'),
+                            "ports": switch.get('ports'),
+                            "heartbeat": switch.get('heartbeat')
                         }
                     })
             elif isinstance(switch, list):
@@ -63,132 +343,480 @@ class MegadServer:
                         self._device_list.update({
                             device.get('ip'): {
                                 "name": device.get('name'),
-                                "ports": device.get('ports')
+                                "password": device.get('pass'),
+                                "ports": device.get('ports'),
+                                "heartbeat": device.get('heartbeat')
                             }
                         })
             else:
-                logging.error('Config not valid. No swich section')
+                _LOGGER.error('Config not valid. No swich section')
         else:
-            logging.error('No config found.')
-        logging.info('Device list: {}'.format(self._device_list))
+            _LOGGER.error('No config found.')
+        _LOGGER.info('Device list: %s', self._device_list)
+
+    def server_options_parser(self):
+        options = self._config.get('server') if self._config else None
+        if isinstance(options, dict):
+            self._options.update(options)
+        if self._options['overflow'] not in OVERFLOW_POLICIES:
+            _LOGGER.error('Unknown overflow policy %s, using reject', self._options['overflow'])
+            self._options['overflow'] = 'reject'
+        _LOGGER.info('Server options: %s', self._options)
+
+    def update_allowlist(self):
+        self._allowed = set(self._device_list) | set(self._options['allow'] or ())
+        if self._options['allow_loopback']:
+            self._allowed.update(LOOPBACK_ADDRESSES)
+
+    def heartbeats(self):
+        """Heartbeat deadline of every device, None where not tracked"""
+        default = self._options['heartbeat_timeout']
+        return {ip: params.get('heartbeat') or default
+                for ip, params in self._device_list.items()}
+
+    def update_sensor_ports(self):
+        """Collect the ports marked with ``sensor`` in the device config"""
+        self._sensor_ports = {}
+        for ip, params in self._device_list.items():
+            sensors = {int(port): settings['sensor']
+                       for port, settings in (params.get('ports') or {}).items()
+                       if isinstance(settings, dict) and settings.get('sensor')}
+            if sensors:
+                self._sensor_ports[ip] = sensors
+        self.sensors.configure({(ip, port): kind for ip, sensors in self._sensor_ports.items()
+                                for port, kind in sensors.items()})
+        if self._sensor_ports and not self.sensors.history:
+            _LOGGER.warning('numpy is not installed, keeping only the latest sensor values')
+
+    @property
+    def loop(self):
+        return self._loop
+
+    @property
+    def polling(self):
+        """Whether this server polls the devices"""
+        return self._poll and bool(self._options['poll'])
 
     def start(self, and_loop=True):
-        self._server = self._loop.run_until_complete(self._server)
-        logging.info('Listening established on {0}'.format(self._server.sockets[0].getsockname()))
+        self._loop.run_until_complete(self.start_serving())
         if and_loop:
             self._loop.run_forever()
 
+    async def start_serving(self):
+        """Open the listening socket and start the background work"""
+        self._connections = asyncio.Semaphore(self._options['max_connections'])
+        self._server = await asyncio.start_server(
+            self.async_handle_connection, host=self._host, port=self._port,
+            reuse_port=self._reuse_port or None, limit=self._options['max_header_size'])
+        _LOGGER.info('Listening established on %s', self._server.sockets[0].getsockname())
+        if self.polling:
+            self.poller.start()
+        self.liveness.start()
+        if self._options['metrics_port'] and self._expose_metrics:
+            self._metrics_server = await serve_metrics(
+                self.metrics, self._options['metrics_host'], self._options['metrics_port'])
+        if self._reloadable and hasattr(signal, 'SIGHUP'):
+            try:
+                self._loop.add_signal_handler(signal.SIGHUP, self._reload_on_signal)
+            except (RuntimeError, ValueError):
+                _LOGGER.warning('SIGHUP reload is only available in the main thread')
+        if self.capture is not None:
+            self.capture.open()
+            self._persist('capture_flush_interval', self.capture.flush)
+        if self.store is not None:
+            self._persist('journal_flush_interval', self.store.flush)
+            self._persist('snapshot_interval', self.snapshot_in_background)
+
     def stop(self, and_loop=True):
-        self._server.close()
+        self.close()
         if and_loop:
             self._loop.close()
 
-    @asyncio.coroutine
-    def async_handle_connection(self, reader, writer):
+    async def shutdown(self):
+        """Stop serving from within the running loop"""
+        self.close()
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+        self.poller.stop()
+        self.liveness.stop()
+        self.client.close()
+        self.rules.clear()
+        self.debouncer.close()
+        if self.event_stream is not None:
+            self.event_stream.close()
+        if hasattr(signal, 'SIGHUP'):
+            self._loop.remove_signal_handler(signal.SIGHUP)
+        for timer in self._persistence_timers.values():
+            timer.cancel()
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+        if self.capture is not None:
+            self.capture.close()
+        if self.store is not None:
+            self.snapshot()
+            self.store.close()
+
+    def _persist(self, interval, action):
+        def run():
+            action()
+            self._persist(interval, action)
+        self._persistence_timers[interval] = self._loop.call_later(self._options[interval], run)
+
+    def snapshot(self):
+        started = time.perf_counter()
+        self.store.snapshot(self.ports)
+        _LOGGER.debug('State snapshot written in %.1f ms', (time.perf_counter() - started) * 1000)
+
+    def snapshot_in_background(self):
+        """Write a snapshot without blocking the loop on the disk"""
+        if self._snapshot_task is None or self._snapshot_task.done():
+            self._snapshot_task = self._loop.create_task(self._write_snapshot())
+
+    async def _write_snapshot(self):
+        started = time.perf_counter()
+        sequence, data = self.store.begin_snapshot(self.ports)
+        try:
+            await self._loop.run_in_executor(None, self.store.write_snapshot, sequence, data)
+        except OSError as exc:
+            _LOGGER.error('Writing the state snapshot failed: %s', exc)
+            return
+        self.store.end_snapshot(sequence)
+        _LOGGER.debug('State snapshot written in %.1f ms', (time.perf_counter() - started) * 1000)
+
+    async def async_handle_connection(self, reader, writer):
         peername = writer.get_extra_info('peername')
-        logging.info('Accepted connection from {}'.format(peername))
-        get_params = False
-        while not reader.at_eof():
-            try:
-                response = yield from asyncio.wait_for(reader.readline(), timeout=10.0)
-                line = response.decode().strip()
-                split_line = line.split()
-                if split_line:
-                    if split_line[0].lower() == 'get':
-                        get_params = split_line[1]
-                if not line:
+        if self._options['allowlist'] and peername and peername[0] not in self._allowed:
+            self.stats.rejected.labels('allowlist').inc()
+            _REQUESTS.warning('Rejected connection from unknown address %s', peername[0],
+                              extra={'device': peername[0]})
+            writer.close()
+            return
+        if not await self._admit():
+            self.stats.rejected.labels('overflow').inc()
+            _REQUESTS.warning('Too many connections, rejected %s', peername)
+            if self._options['overflow'] != 'drop':
+                writer.write(SERVICE_UNAVAILABLE)
+            writer.close()
+            return
+        try:
+            await self.serve_connection(reader, writer, peername)
+        finally:
+            self._connections.release()
+
+    async def _admit(self):
+        """Take a connection slot, applying the overflow policy when none is free"""
+        if not self._connections.locked():
+            await self._connections.acquire()
+            return True
+        if self._options['overflow'] != 'wait':
+            return False
+        try:
+            await asyncio.wait_for(self._connections.acquire(), self._options['request_timeout'])
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def serve_connection(self, reader, writer, peername):
+        stats = self.stats
+        now = self._loop.time
+        opened = now()
+        stats.connections.inc()
+        stats.active.inc()
+        _REQUESTS.debug('Accepted connection from %s', peername)
+        timeout = self._options['request_timeout']
+        request = Request()
+        keep_alive = True
+        try:
+            while keep_alive and not reader.at_eof():
+                started = now()
+                try:
+                    if (await self.read_request(reader, timeout, request)) is None:
+                        break
+                except asyncio.LimitOverrunError:
+                    stats.rejected.labels('header_size').inc()
+                    _REQUESTS.warning('Request head from %s too long', peername)
+                    writer.write(HEADER_TOO_LARGE)
                     break
-            except concurrent.futures.TimeoutError:
-                logging.error('Conection Timeout')
-                break
-        logging.info('Accepted command from {}: {}'.format(peername[0], get_params))
-        self.ok_answer(writer)
-        yield from writer.drain()
-
-        self.parse_cmd(peername[0], get_params)
+                read = now()
+                stats.header_read.observe(read - started)
+                if self.capture is not None:
+                    self.capture.record(time.time(), peername[0], request.head)
+                stats.requests.inc()
+                keep_alive = request.keep_alive and self._options['keep_alive']
+                _REQUESTS.info('Accepted command from %s: %s', peername[0], request.target,
+                               extra={'device': peername[0]})
+                written = await self._dispatch(reader, writer, keep_alive, peername[0], request)
+                if written is None:
+                    break
+                stats.bytes_out.inc(written)
+                dispatched = now()
+                stats.dispatch.observe(dispatched - read)
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    break
+                stats.drain.observe(now() - dispatched)
+                timeout = self._options['keep_alive_timeout']
+        finally:
+            _REQUESTS.debug('Closing connection from %s', peername)
+            closing = now()
+            writer.close()
+            stats.close.observe(now() - closing)
+            stats.active.dec()
+            stats.connection.observe(now() - opened)
+
+    async def _dispatch(self, reader, writer, keep_alive, device, request):
+        """Answer one request; returns the bytes written, or None when the
+        event stream took the connection over."""
+        target = request.target
+        if self.event_stream is not None and is_events_request(target):
+            await self.event_stream.serve(reader, writer, request)
+            return None
+        if self.state_api is not None and is_state_request(target):
+            status, etag, body = await self.state_api.respond(request)
+        elif self.sensor_api is not None and is_sensors_request(target):
+            status, etag, body = self.sensor_api.respond(request)
+        else:
+            return self.command_answer(writer, keep_alive, device, request)
+        return self.json_answer(writer, keep_alive, status, etag, body)
+
+    async def read_request(self, reader, timeout, request=None):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(REQUEST_END), timeout=timeout)
+        except asyncio.TimeoutError:
+            _REQUESTS.debug('Connection idle timeout')
+            self.stats.timeouts.inc()
+            return None
+        except asyncio.IncompleteReadError:
+            return None
+        self.stats.bytes_in.inc(len(head))
+        return parse_request(head, request)
+
+    def command_answer(self, writer, keep_alive, device, request):
+        """Dispatch a device request and answer it.
+
+        A request its handlers cannot process is answered with 400; the
+        connection stays open for the requests pipelined behind it.
+        """
+        actions = None
+        if request.method == b'GET':
+            try:
+                actions = self.handle_command(device, request.params)
+            except ValueError as exc:
+                _REQUESTS.warning('Bad request from %s: %s (%s)', device, request.target, exc,
+                                  extra={'device': device})
+                return self.bad_request(writer, keep_alive)
+            except Exception:
+                _LOGGER.exception('Handling %s from %s failed', request.target, device,
+                                  extra={'device': device})
+                return self.bad_request(writer, keep_alive)
+        return self.ok_answer(writer, keep_alive, actions)
+
+    def bad_request(self, writer, keep_alive=False):
+        answer = BAD_REQUEST[bool(keep_alive)]
+        writer.write(answer)
+        return len(answer)
+
+    def ok_answer(self, writer, keep_alive=False, actions=None):
+        """Answer a device request; ``actions`` become the body the firmware executes"""
+        if not actions:
+            answer = OK_EMPTY[bool(keep_alive)]
+            writer.write(answer)
+            return len(answer)
+        body = actions.encode('latin-1')
+        length = str(len(body)).encode()
+        head = OK_HEAD[bool(keep_alive)]
+        writer.writelines((head, length, CRLF + CRLF, body))
+        return len(head) + len(length) + 4 + len(body)
+
+    def json_answer(self, writer, keep_alive, status, etag, body):
+        head = [b'HTTP/1.1 ', status, b'\r\nContent-Type: application/json\r\n'
+                b'Cache-Control: no-cache\r\n']
+        if etag:
+            head.extend((b'ETag: ', etag, CRLF))
+        head.extend((b'Connection: ', b'keep-alive' if keep_alive else b'close',
+                     b'\r\nContent-Length: ', str(len(body)).encode(), CRLF + CRLF, body))
+        writer.writelines(head)
+        return sum(len(chunk) for chunk in head)
+
+    def send_command(self, device, port, state):
+        """Switch a device output, returning a future with the device answer.
+
+        The local port state is updated once the device accepted the command.
+        """
+        params = self._device_list.get(device) or {}
+        future = self.client.queue_command(device, params.get('password'), port, state)
+
+        def on_done(done):
+            if not done.cancelled() and done.exception() is None:
+                self.ports.set_state(device, port, state)
+            elif not done.cancelled():
+                _LOGGER.error('Device %s port %s command failed: %s', device, port, done.exception(),
+                              extra={'device': device, 'port': port})
+        future.add_done_callback(on_done)
+        return future
+
+    async def poll_device(self, device):
+        params = self._device_list.get(device) or {}
+        statuses = await self.client.request(device, params.get('password'), 'cmd=all')
+        self.liveness.seen(device)
+        return self.update_all(device, statuses.strip())
+
+    async def refresh_device(self, device):
+        try:
+            await self.poll_device(device)
+        except CommandError as exc:
+            _LOGGER.error('Refreshing %s failed: %s', device, exc, extra={'device': device})
+
+    def device_liveness(self, device, online):
+        """Liveness listener: unknown port states while a device is offline"""
+        self.stats.offline.set(len(self.liveness.offline()))
+        if online:
+            if self.polling:
+                self._loop.create_task(self.refresh_device(device))
+        else:
+            self.ports.mark_unknown(device)
+        if self.event_stream is not None:
+            self.event_stream.publish_device(device, online)
 
-        logging.info('Closing connection')
-        writer.close()
-        self.get_port_status()
+    def turn_on(self, device, port):
+        return self.send_command(device, port, True)
 
-    def ok_answer(self, writer):
-        writer.write('HTTP/1.1 200 OK\r\n'.encode())
-        writer.write('Content-Type: text/plain; set=iso-8859-1\r\n\r\n'.encode())
+    def turn_off(self, device, port):
+        return self.send_command(device, port, False)
 
     def get_port_status(self):
-        for id, p in self.ports.items():
-            logging.info('Port {} state {}'.format(p._port_id, 'ON' if p.is_on() else 'OFF'))
+        for (ip, port), p in self.ports.items():
+            _LOGGER.info('Device %s port %s state %s', ip, port, 'ON' if p.is_on() else 'OFF')
+
+    def log_transition(self, device, port, old, new):
+        if _TRANSITIONS.isEnabledFor(logging.INFO):
+            _TRANSITIONS.info('Device %s port %s state %s', device, port,
+                              CONF_UNKNOWN_STATE if new is None else
+                              CONF_ON_STATE if new else CONF_OFF_STATE,
+                              extra={'device': device, 'port': port, 'old': old, 'new': new})
 
     def cmd_decode(self, url):
-        """Need to manual spliting, cause parse_qsl dont work with semicolons properly"""
-        query_param = urlsplit(url).query
-        decoded_params = {}
-        if '&' in query_param:
-            for param in query_param.split('&'):
-                if '=' in param:
-                    decoded_params.update({param.split('=')[0]: param.split('=')[1]})
-                else:
-                    decoded_params.update({param: ''})
-        elif '=' in query_param:
-            decoded_params.update({query_param.split('=')[0]: query_param.split('=')[1]})
-
-        return decoded_params
+        return parse_query(url.encode('latin-1'))
 
     def update_all(self, device, statuses):
-        for id, status in enumerate(statuses.split(';')):
-            portid = id + 1
-            if status:
-                if 'on' in status.lower() or 'off' in status.lower():
-                    if '/' in status:
-                        status = status.split('/')[0]
-            if portid in self.ports:
-                self.port_state_update(portid, status)
-
-    def port_state_update(self, port, status):
-        port_instance = self.ports.get(port)
-        if port_instance:
-            port_instance.set_state(True if status.lower() == 'on' else False)
+        sensors = self._sensor_ports.get(device)
+        if sensors:
+            tokens = statuses.split(';')
+            now = time.time()
+            for port in sensors:
+                if 0 <= port - 1 < len(tokens):
+                    self.sensors.record_reading(device, port, tokens[port - 1], now)
+        self.debouncer.discard(device)
+        return self.ports.ingest_statuses(device, statuses)
+
+    def port_state_update(self, device, port, status):
+        self.debouncer.feed(device, port, status.lower() == 'on')
 
     def parse_cmd(self, device, cmd):
-        command = self.cmd_decode(cmd)
-
-        all_statuses = command.get(self._mega_def.get('all'))
-        port_update = command.get(self._mega_def.get('port_update'))
-        if all_statuses:
-            self.update_all(device, all_statuses)
-        if port_update:
+        return self.handle_command(device, self.cmd_decode(cmd))
+
+    def handle_command(self, device, command):
+        """Dispatch a decoded device request.
+
+        Returns the actions for the device to execute, joined into one reply
+        body, or None.
+        """
+        self.stats.device_events.labels(device).inc()
+        if device in self._device_list:
+            self.liveness.seen(device)
+        commands = self._commands
+        actions = None
+        inline = self._options['inline_replies'] and bool(self.rules)
+        if inline:
+            self.rules.begin_reply(device)
+        try:
+            for key, value in command.items():
+                handler = commands.get(key)
+                if handler is not None:
+                    action = handler(device, value, command)
+                    if action:
+                        if actions is None:
+                            actions = []
+                        actions.append(action)
+        finally:
+            if inline:
+                action = self.rules.end_reply()
+                if action:
+                    actions = (actions or []) + [action]
+
+        _REQUESTS.debug('Device %s cmd: %s', device, command, extra={'device': device})
+        if actions:
+            return ACTION_SEPARATOR.join(actions)
+        return None
+
+    def handle_all(self, device, value, command):
+        if value:
+            self.update_all(device, value)
+
+    def handle_port_update(self, device, value, command):
+        if value:
+            sensors = self._sensor_ports.get(device)
+            if sensors and int(value) in sensors:
+                reading = command.get(self._value_key)
+                if reading:
+                    self.sensors.record_reading(device, int(value), reading)
+                return
             port_state = CONF_ON_STATE
-            if command.get(self._mega_def.get('port_off')):
+            if command.get(self._port_off_key):
                 port_state = CONF_OFF_STATE
-            self.port_state_update(int(port_update), port_state)
-
-        logging.info('Device {} cmd: {}'.format(self._device_list.get(device), command))
-
-
-class SwitchPort:
-    def __init__(self, id):
-        self._port_id = id
-        self.state = False
-
-    def set_state(self, state):
-        self.state = bool(state)
-
-    def is_on(self):
-        return self.state
+            self.port_state_update(device, int(value), port_state)
+
+
+class _VersionAction(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser.exit(message='{0} {1}\n'.format(metadata.project, metadata.version))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description=metadata.description)
+    parser.add_argument('-V', '--version', action=_VersionAction, nargs=0,
+                        help='print version and exit')
+    parser.add_argument('--host', default='0.0.0.0', help='address to listen on')
+    parser.add_argument('--port', type=int, default=16030, help='port to listen on')
+    parser.add_argument('--config', help='path to config.yaml (default: config.yaml in the working directory)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of SO_REUSEPORT worker processes')
+    parser.add_argument('--debug', action='store_true', help='enable debug logging')
+    parser.add_argument('--log-sample', type=int, default=1, metavar='N',
+                        help='log only one of every N request and state change records')
+    args = parser.parse_args(argv[1:])
+
+    listener = setup_logging(logging.DEBUG if args.debug else logging.INFO,
+                             sample_every=args.log_sample)
+    try:
+        if args.workers > 1:
+            from pymegad.workers import run_workers
+            run_workers(args.host, args.port, args.workers, config_path=args.config,
+                        log_handlers=listener.handlers, log_sample=args.log_sample)
+            return 0
+
+        server = MegadServer(args.host, args.port, config_path=args.config)
+        try:
+            server.start()
+        except KeyboardInterrupt:
+            pass  # Press Ctrl+C to stop
+        finally:
+            server.stop()
+        return 0
+    finally:
+        listener.stop()
 
-    def turn_on(self):
-        self.state = True
 
-    def turn_off(self):
-        self.state = False
+def entry_point():
+    raise SystemExit(main(sys.argv))
 
 
 if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
-    server = MegadServer('0.0.0.0', 16030)
-    try:
-        server.start()
-    except KeyboardInterrupt:
-        pass  # Press Ctrl+C to stop
-    finally:
-        server.stop()
+    entry_point()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""In-process metrics with Prometheus text exposition.
+
+Metrics hand out per-label-set children once (``metric.labels(...)``),
+so recording a sample on the hot path is an attribute update, plus a
+``bisect`` for histograms.
+"""
+
+import asyncio
+import bisect
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                              .replace('"', '\\"'))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def _new_child(self):
+        return _Value()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError('{} expects labels {}'.format(
+                    self.name, self.labelnames))
+            child = self._children[values] = self._new_child()
+        return child
+
+    def exposition(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._sample_lines(values, child))
+        return lines
+
+    def _sample_lines(self, values, child):
+        yield '{}{} {}'.format(self.name,
+                               _format_labels(self.labelnames, values),
+                               _format_value(child.value))
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _sample_lines(self, values, child):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+            cumulative += count
+            yield '{}_bucket{} {}'.format(
+                self.name,
+                _format_labels(self.labelnames, values,
+                               'le="{}"'.format(_format_value(bound))),
+                cumulative)
+        labels = _format_labels(self.labelnames, values)
+        yield '{}_sum{} {}'.format(self.name, labels, repr(child.sum))
+        yield '{}_count{} {}'.format(self.name, labels, child.count)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames,
+                                       buckets))
+
+    def exposition(self):
+        """Render all metrics in the Prometheus text format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.exposition())
+        return '\n'.join(lines) + '\n'
+
+
+async def serve_metrics(registry, host, port):
+    """Start a minimal HTTP endpoint answering every request with the
+    registry exposition."""
+
+    async def handle(reader, writer):
+        try:
+            await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5.0)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        body = registry.exposition().encode('utf-8')
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/plain; version=0.0.4\r\n'
+                     b'Content-Length: ' + str(len(body)).encode() +
+                     b'\r\nConnection: close\r\n\r\n' + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    server = await asyncio.start_server(handle, host=host, port=port)
+    _LOGGER.info('Metrics available on %s', server.sockets[0].getsockname())
+    return server
+
+
+class ServerMetrics:
+    """The metrics recorded by :class:`pymegad.main.MegadServer`."""
+
+    def __init__(self, registry=None):
+        self.registry = registry = registry or MetricsRegistry()
+        self.connections = registry.counter(
+            'megad_connections_total', 'Accepted connections').labels()
+        self.active = registry.gauge(
+            'megad_connections_active', 'Open connections').labels()
+        self.requests = registry.counter(
+            'megad_requests_total', 'Handled requests').labels()
+        self.timeouts = registry.counter(
+            'megad_timeouts_total',
+            'Connections closed by request or keep-alive timeout').labels()
+        self.bytes_in = registry.counter(
+            'megad_received_bytes_total', 'Request head bytes read').labels()
+        self.bytes_out = registry.counter(
+            'megad_sent_bytes_total', 'Response bytes written').labels()
+        self.rejected = registry.counter(
+            'megad_rejected_total', 'Connections refused by admission control',
+            ('reason',))
+        self.offline = registry.gauge(
+            'megad_devices_offline', 'Devices past their heartbeat deadline').labels()
+        self.device_events = registry.counter(
+            'megad_device_events_total', 'Requests handled per device',
+            ('device',))
+        stages = registry.histogram(
+            'megad_stage_seconds',
+            'Time spent per connection stage; header_read includes the '
+            'wait for the request', ('stage',))
+        self.header_read = stages.labels('header_read')
+        self.dispatch = stages.labels('dispatch')
+        self.drain = stages.labels('drain')
+        self.close = stages.labels('close')
+        self.connection = registry.histogram(
+            'megad_connection_seconds', 'Connection lifetime',
+            buckets=DEFAULT_BUCKETS + (30.0, 60.0, 300.0)).labels()
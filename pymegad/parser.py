@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Bytes-level parser for the HTTP requests sent by MegaD devices.
+
+MegaD pushes events as ``GET /path?pt=5&m=1 HTTP/1.1`` requests. The
+functions here work on the raw request head returned by
+``StreamReader.readuntil(REQUEST_END)`` and never build per-line strings.
+"""
+
+REQUEST_END = b'\r\n\r\n'
+CRLF = b'\r\n'
+HTTP_11 = b'HTTP/1.1'
+CONNECTION_HEADER = b'\r\nconnection:'
+
+
+class Request:
+    """Parsed request head. Instances can be reused between requests."""
+
+    __slots__ = ('head', 'method', 'target', 'version', 'keep_alive', 'params')
+
+    def __init__(self):
+        self.head = b''
+        self.method = b''
+        self.target = b''
+        self.version = b''
+        self.keep_alive = False
+        self.params = {}
+
+
+def parse_query(target, params=None):
+    """Decode the query string of a request target into ``params``.
+
+    Need to manual spliting, cause parse_qsl dont work with semicolons
+    properly. Keys without a value map to an empty string.
+    """
+    if params is None:
+        params = {}
+    else:
+        params.clear()
+    start = target.find(b'?') + 1
+    if not start:
+        return params
+    end = len(target)
+    while start < end:
+        amp = target.find(b'&', start)
+        if amp < 0:
+            amp = end
+        eq = target.find(b'=', start, amp)
+        if eq < 0:
+            if amp > start:
+                params[target[start:amp].decode('latin-1')] = ''
+        else:
+            params[target[start:eq].decode('latin-1')] = \
+                target[eq + 1:amp].decode('latin-1')
+        start = amp + 1
+    return params
+
+
+def is_keep_alive(head, version):
+    """HTTP/1.1 stays open unless closed, HTTP/1.0 only when asked to."""
+    pos = head.lower().find(CONNECTION_HEADER)
+    if pos < 0:
+        return version == HTTP_11
+    pos += len(CONNECTION_HEADER)
+    end = head.find(CRLF, pos)
+    value = head[pos:end if end >= 0 else len(head)].lower()
+    if version == HTTP_11:
+        return b'close' not in value
+    return b'keep-alive' in value
+
+
+def header_value(head, name):
+    """Return the value of header ``name`` (lowercase bytes) or None."""
+    marker = CRLF + name + b':'
+    pos = head.lower().find(marker)
+    if pos < 0:
+        return None
+    pos += len(marker)
+    end = head.find(CRLF, pos)
+    return head[pos:end if end >= 0 else len(head)].strip()
+
+
+def parse_request(head, request=None):
+    """Parse a request head, returning a :class:`Request` or None.
+
+    ``head`` is everything up to and including the blank line ending
+    the headers. Pass a previous ``request`` to reuse it.
+    """
+    head = head.lstrip(CRLF)
+    line_end = head.find(CRLF)
+    if line_end < 0:
+        line_end = len(head)
+    first_space = head.find(b' ', 0, line_end)
+    last_space = head.rfind(b' ', 0, line_end)
+    if first_space < 0 or last_space <= first_space:
+        return None
+    if request is None:
+        request = Request()
+    request.head = head
+    request.method = head[:first_space]
+    request.target = head[first_space + 1:last_space]
+    request.version = head[last_space + 1:line_end]
+    request.keep_alive = is_keep_alive(head, request.version)
+    parse_query(request.target, request.params)
+    return request
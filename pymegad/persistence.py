@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Persistent port state: binary snapshots plus an append-only journal.
+
+Every transition is appended to ``ports.journal``. Periodically the whole
+registry is written to ``ports.snapshot`` (atomically, through a
+temporary file) and the journal is truncated. On startup the snapshot is
+memory-mapped and the journal replayed on top of it, so the last known
+state is back without waiting for every controller to report.
+
+Only one process should write a given state directory. Snapshots are
+encoded on the caller's thread and can be written and synced on another
+(:meth:`StateStore.begin_snapshot`, :meth:`StateStore.write_snapshot`,
+:meth:`StateStore.end_snapshot`); transitions journaled meanwhile are
+carried over into the new journal.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from pymegad.ports import STATE_OFF, STATE_ON, STATE_UNKNOWN
+
+_LOGGER = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = 'ports.snapshot'
+JOURNAL_FILE = 'ports.journal'
+
+SNAPSHOT_MAGIC = b'MGDS'
+SNAPSHOT_VERSION = 1
+# magic, version, device count
+SNAPSHOT_HEADER = struct.Struct('<4sHI')
+# ip length, state vector length; followed by the ip and the states
+SNAPSHOT_DEVICE = struct.Struct('<BH')
+# timestamp, ip length, port, state; followed by the ip
+JOURNAL_RECORD = struct.Struct('<dBHB')
+
+
+class StateStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self._journal = None
+        # Journal records made while a snapshot is being written.
+        self._carried = None
+        self._sequence = 0
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._journal = open(self.journal_path, 'ab')
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def record(self, ip, port, old, new):
+        """Registry listener appending a transition to the journal."""
+        if self._journal is None:
+            return
+        encoded = ip.encode('utf-8')
+        entry = JOURNAL_RECORD.pack(
+            time.time(), len(encoded), port,
+            STATE_UNKNOWN if new is None else STATE_ON if new else STATE_OFF) + encoded
+        self._journal.write(entry)
+        if self._carried is not None:
+            self._carried.append(entry)
+
+    def flush(self):
+        if self._journal is not None:
+            self._journal.flush()
+
+    def snapshot(self, registry):
+        """Write all device states and start a new, empty journal."""
+        sequence, data = self.begin_snapshot(registry)
+        self.write_snapshot(sequence, data)
+        self.end_snapshot(sequence)
+
+    def begin_snapshot(self, registry):
+        """Encode all device states, returning ``(sequence, data)`` for
+        :meth:`write_snapshot`."""
+        devices = [registry.device(ip) for ip in registry.devices()]
+        chunks = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                                       len(devices))]
+        for device in devices:
+            encoded = device.ip.encode('utf-8')
+            chunks.append(SNAPSHOT_DEVICE.pack(len(encoded),
+                                               len(device.states)))
+            chunks.append(encoded)
+            chunks.append(bytes(device.states))
+        self._sequence += 1
+        self._carried = []
+        return self._sequence, b''.join(chunks)
+
+    def write_snapshot(self, sequence, data):
+        """Atomically replace the snapshot file; safe to call from another
+        thread. An older snapshot never replaces a newer one."""
+        with self._lock:
+            if sequence <= self._written:
+                return False
+            temporary = self.snapshot_path + '.tmp'
+            with open(temporary, 'wb') as snapshot:
+                snapshot.write(data)
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            os.replace(temporary, self.snapshot_path)
+            self._written = sequence
+        return True
+
+    def end_snapshot(self, sequence):
+        """Start a new journal holding only what the written snapshot
+        ``sequence`` does not contain."""
+        if sequence != self._sequence or sequence != self._written:
+            return
+        carried, self._carried = self._carried, None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = open(self.journal_path, 'wb')
+            if carried:
+                self._journal.write(b''.join(carried))
+
+    def restore(self, registry):
+        """Load the snapshot and replay the journal into ``registry``.
+
+        Returns the number of journal records applied.
+        """
+        for ip, states in self._read_snapshot():
+            registry.restore_states(ip, states)
+        applied = 0
+        for ip, port, state in self._read_journal():
+            if registry.restore_state(ip, port, state):
+                applied += 1
+        return applied
+
+    def _read_snapshot(self):
+        data = _map(self.snapshot_path)
+        if data is None:
+            return
+        try:
+            magic, version, count = SNAPSHOT_HEADER.unpack_from(data)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                _LOGGER.error('Unknown snapshot format in %s',
+                              self.snapshot_path)
+                return
+            offset = SNAPSHOT_HEADER.size
+            for _ in range(count):
+                ip_length, size = SNAPSHOT_DEVICE.unpack_from(data, offset)
+                offset += SNAPSHOT_DEVICE.size
+                ip = data[offset:offset + ip_length].decode('utf-8')
+                offset += ip_length
+                yield ip, data[offset:offset + size]
+                offset += size
+        except struct.error:
+            _LOGGER.error('Truncated snapshot %s', self.snapshot_path)
+        finally:
+            data.close()
+
+    def _read_journal(self):
+        data = _map(self.journal_path)
+        if data is None:
+            return
+        try:
+            offset = 0
+            end = len(data) - JOURNAL_RECORD.size
+            while offset <= end:
+                _, ip_length, port, state = JOURNAL_RECORD.unpack_from(
+                    data, offset)
+                offset += JOURNAL_RECORD.size
+                if offset + ip_length > len(data):
+                    break
+                ip = data[offset:offset + ip_length].decode('utf-8')
+                offset += ip_length
+                yield ip, port, None if state == STATE_UNKNOWN else bool(state)
+        finally:
+            data.close()
+
+
+def _map(path):
+    try:
+        with open(path, 'rb') as source:
+            if os.fstat(source.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
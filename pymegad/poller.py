@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Periodic full-status polling of MegaD devices.
+
+One scheduler task keeps a heap of due times and hands due devices to a
+fixed pool of workers, so the number of tasks does not grow with the
+number of devices. Intervals adapt per device: quiet devices back off
+towards ``max_interval``, devices that changed are polled again after
+``min_interval``. A device that fails is retried after ``min_interval``
+and then backs off with every further consecutive failure, so an
+unreachable controller does not take a worker every few seconds.
+"""
+
+import asyncio
+import heapq
+import logging
+import random
+
+from pymegad.eventloop import loop_kwargs
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _DeviceSchedule:
+    __slots__ = ('device', 'interval', 'due', 'errors', 'active')
+
+    def __init__(self, device, interval):
+        self.device = device
+        self.interval = interval
+        self.due = 0.0
+        self.errors = 0
+        self.active = True
+
+
+class Poller:
+    def __init__(self, loop, fetch, concurrency=10, min_interval=5.0,
+                 max_interval=60.0, backoff=1.5, jitter=0.1):
+        """``fetch(device)`` is a coroutine polling one device and returning
+        the list of changed ports."""
+        self._loop = loop
+        self._fetch = fetch
+        self._concurrency = concurrency
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self._schedules = {}
+        self._heap = []
+        self._due = asyncio.Queue(**loop_kwargs(loop))
+        self._wakeup = asyncio.Event(**loop_kwargs(loop))
+        self._tasks = []
+
+    def add_device(self, device):
+        if device in self._schedules:
+            return
+        schedule = _DeviceSchedule(device, self.min_interval)
+        self._schedules[device] = schedule
+        # Spread the first round over one interval instead of a burst.
+        self._push(schedule, self._loop.time() +
+                   random.uniform(0, self.min_interval))
+
+    def remove_device(self, device):
+        schedule = self._schedules.pop(device, None)
+        if schedule is not None:
+            schedule.active = False
+
+    def interval(self, device):
+        schedule = self._schedules.get(device)
+        return schedule.interval if schedule is not None else None
+
+    def errors(self, device):
+        """Number of consecutive failed polls of ``device``."""
+        schedule = self._schedules.get(device)
+        return schedule.errors if schedule is not None else None
+
+    def _push(self, schedule, due):
+        schedule.due = due
+        heapq.heappush(self._heap, (due, id(schedule), schedule))
+        self._wakeup.set()
+
+    def _reschedule(self, schedule, changed, failed):
+        if failed:
+            schedule.errors += 1
+            schedule.interval = min(
+                self.min_interval * self.backoff ** (schedule.errors - 1),
+                self.max_interval)
+        elif changed:
+            schedule.errors = 0
+            schedule.interval = self.min_interval
+        else:
+            schedule.errors = 0
+            schedule.interval = min(schedule.interval * self.backoff,
+                                    self.max_interval)
+        spread = schedule.interval * self.jitter
+        self._push(schedule, self._loop.time() + schedule.interval +
+                   random.uniform(-spread, spread))
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks.append(self._loop.create_task(self._schedule()))
+        for _ in range(self._concurrency):
+            self._tasks.append(self._loop.create_task(self._work()))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _schedule(self):
+        heap = self._heap
+        while True:
+            self._wakeup.clear()
+            now = self._loop.time()
+            while heap and heap[0][0] <= now:
+                _, _, schedule = heapq.heappop(heap)
+                if schedule.active and \
+                        self._schedules.get(schedule.device) is schedule:
+                    self._due.put_nowait(schedule)
+            timeout = heap[0][0] - now if heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self):
+        while True:
+            schedule = await self._due.get()
+            changed = failed = False
+            try:
+                changed = bool(await self._fetch(schedule.device))
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                failed = True
+                _LOGGER.error('Polling %s failed: %s', schedule.device, exc)
+            if schedule.active:
+                self._reschedule(schedule, changed, failed)
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""Port state storage for MegaD devices.
+
+States are kept per device in a compact ``bytearray`` indexed by port id,
+so a controller with 38 ports costs 76 bytes instead of 38 objects.
+"""
+
+STATE_OFF = 0
+STATE_ON = 1
+# The device stopped reporting; read back as None.
+STATE_UNKNOWN = 2
+
+# Status tokens of `cmd=all` look like "ON", "off" or "ON/3" (with a click
+# counter); only the first three characters decide the state.
+_ON_PREFIXES = ('on', 'on/')
+
+
+def parse_statuses(statuses):
+    """Parse a `;`-separated `all` status string into a state vector."""
+    return bytearray(
+        STATE_ON if token[:3].lower() in _ON_PREFIXES else STATE_OFF
+        for token in statuses.split(';'))
+
+
+class DevicePorts:
+    """State of all configured ports of a single device."""
+
+    __slots__ = ('ip', 'ports', 'states', 'configured', 'last_statuses')
+
+    def __init__(self, ip, ports, allocate=bytearray):
+        self.ip = ip
+        self.ports = tuple(sorted(int(port) for port in ports or ()))
+        size = self.ports[-1] + 1 if self.ports else 0
+        self.states = allocate(size)
+        self.configured = bytearray(size)
+        for port in self.ports:
+            self.configured[port] = 1
+        self.last_statuses = None
+
+    def __contains__(self, port):
+        return 0 <= port < len(self.configured) and bool(self.configured[port])
+
+    def __len__(self):
+        return len(self.ports)
+
+    def as_dict(self):
+        states = self.states
+        return {port: _decode(states[port]) for port in self.ports}
+
+
+def _decode(state):
+    return None if state == STATE_UNKNOWN else state == STATE_ON
+
+
+class VersionCounter:
+    """Change counter made of one slot per writer process.
+
+    ``slots`` is a mutable sequence of integers, e.g. a memoryview cast to
+    ``'Q'`` over shared memory. Every process only bumps its own slot, so
+    no lock is needed, and the version is the sum of all slots.
+    """
+
+    __slots__ = ('_slots', '_index')
+
+    def __init__(self, slots=None, index=0):
+        self._slots = slots if slots is not None else [0]
+        self._index = index
+
+    @property
+    def value(self):
+        return sum(self._slots)
+
+    def bump(self):
+        self._slots[self._index] += 1
+
+
+class PortRegistry:
+    """Port states of all devices, keyed by ``(device ip, port id)``.
+
+    ``allocate(size)`` returns the zeroed state buffer of a device. Passing
+    an allocator over shared memory lets several processes share states,
+    together with a :class:`VersionCounter` over the same memory so that
+    ``version`` counts the changes of every process. The `all` status
+    cache is then disabled since other processes can change states behind
+    it.
+    """
+
+    def __init__(self, allocate=None, counter=None):
+        self._devices = {}
+        self.allocate = allocate or bytearray
+        self.shared = allocate is not None
+        self.cache_statuses = not self.shared
+        self._listeners = []
+        # Bumped on every change to the stored states or the device set.
+        self._counter = counter if counter is not None else VersionCounter()
+        # Optional ``commander(ip, port, state)`` driving the real device,
+        # used by SwitchPort.turn_on/turn_off.
+        self.commander = None
+
+    @property
+    def version(self):
+        return self._counter.value
+
+    def add_listener(self, callback):
+        """Call ``callback(ip, port, old, new)`` on every state transition."""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def _notify(self, ip, port, old, new):
+        for callback in self._listeners:
+            callback(ip, port, old, new)
+
+    def add_device(self, ip, ports):
+        device = DevicePorts(ip, ports, self.allocate)
+        self._devices[ip] = device
+        self._counter.bump()
+        return device
+
+    def reconfigure_device(self, ip, ports):
+        """Replace the port set of a device, keeping states of kept ports."""
+        old = self._devices.get(ip)
+        device = self.add_device(ip, ports)
+        if old is not None:
+            for port in device.ports:
+                if port in old:
+                    device.states[port] = old.states[port]
+        return device
+
+    def remove_device(self, ip):
+        self._counter.bump()
+        return self._devices.pop(ip, None)
+
+    def device(self, ip):
+        return self._devices.get(ip)
+
+    def devices(self):
+        return list(self._devices)
+
+    def device_states(self, ip):
+        """Bulk read of a whole device as ``{port: is_on}``."""
+        device = self._devices.get(ip)
+        return device.as_dict() if device is not None else {}
+
+    def get_state(self, ip, port, default=None):
+        device = self._devices.get(ip)
+        if device is None or port not in device:
+            return default
+        return _decode(device.states[port])
+
+    def set_state(self, ip, port, state):
+        """Store a new state, returning True if the stored value changed."""
+        device = self._devices.get(ip)
+        if device is None or port not in device:
+            return False
+        new = STATE_ON if state else STATE_OFF
+        old = device.states[port]
+        if old == new:
+            return False
+        device.states[port] = new
+        device.last_statuses = None
+        self._counter.bump()
+        if self._listeners:
+            self._notify(ip, port, _decode(old), bool(state))
+        return True
+
+    def mark_unknown(self, ip):
+        """Mark every port of a device unknown; listeners get ``new=None``
+        for each port that was known."""
+        device = self._devices.get(ip)
+        if device is None:
+            return
+        states = device.states
+        changes = []
+        for port in device.ports:
+            if states[port] != STATE_UNKNOWN:
+                changes.append((port, _decode(states[port])))
+                states[port] = STATE_UNKNOWN
+        device.last_statuses = None
+        if changes:
+            self._counter.bump()
+        if self._listeners:
+            for port, old in changes:
+                self._notify(ip, port, old, None)
+
+    def restore_states(self, ip, states):
+        """Load a saved state vector without notifying listeners."""
+        device = self._devices.get(ip)
+        if device is None:
+            return
+        for port in device.ports:
+            if port < len(states):
+                device.states[port] = states[port]
+        self._counter.bump()
+
+    def restore_state(self, ip, port, state):
+        """Load a saved port state (None: unknown) without notifying
+        listeners."""
+        device = self._devices.get(ip)
+        if device is None or port not in device:
+            return False
+        device.states[port] = STATE_UNKNOWN if state is None else \
+            STATE_ON if state else STATE_OFF
+        device.last_statuses = None
+        self._counter.bump()
+        return True
+
+    def ingest_statuses(self, ip, statuses, offset=1):
+        """Apply a full `all` status string, returning the changed ports.
+
+        Status number ``i`` describes port ``i + offset``. Only ports whose
+        state differs are written; the result is a list of
+        ``(port, old, new)`` tuples.
+        """
+        device = self._devices.get(ip)
+        if device is None or statuses == device.last_statuses:
+            return []
+        vector = parse_statuses(statuses)
+        states = device.states
+        changes = []
+        for port in device.ports:
+            index = port - offset
+            if 0 <= index < len(vector) and states[port] != vector[index]:
+                changes.append((port, _decode(states[port]),
+                                vector[index] == STATE_ON))
+                states[port] = vector[index]
+        if self.cache_statuses:
+            device.last_statuses = statuses
+        if changes:
+            self._counter.bump()
+        if self._listeners:
+            for port, old, new in changes:
+                self._notify(ip, port, old, new)
+        return changes
+
+    def port(self, ip, port):
+        device = self._devices.get(ip)
+        if device is None or port not in device:
+            return None
+        return SwitchPort(port, ip, self)
+
+    def get(self, key, default=None):
+        return self.port(*key) or default
+
+    def items(self):
+        for ip, device in self._devices.items():
+            for port in device.ports:
+                yield (ip, port), SwitchPort(port, ip, self)
+
+    def __getitem__(self, key):
+        view = self.port(*key)
+        if view is None:
+            raise KeyError(key)
+        return view
+
+    def __contains__(self, key):
+        ip, port = key
+        device = self._devices.get(ip)
+        return device is not None and port in device
+
+    def __iter__(self):
+        for ip, device in self._devices.items():
+            for port in device.ports:
+                yield ip, port
+
+    def __len__(self):
+        return sum(len(device) for device in self._devices.values())
+
+
+class SwitchPort:
+    """Thin view of a single port stored in a :class:`PortRegistry`."""
+
+    __slots__ = ('_port_id', '_device', '_registry')
+
+    def __init__(self, id, device=None, registry=None):
+        if registry is None:
+            registry = PortRegistry()
+            registry.add_device(device, (id,))
+        self._port_id = id
+        self._device = device
+        self._registry = registry
+
+    @property
+    def state(self):
+        return bool(self._registry.get_state(self._device, self._port_id))
+
+    @state.setter
+    def state(self, state):
+        self._registry.set_state(self._device, self._port_id, state)
+
+    def set_state(self, state):
+        self.state = bool(state)
+
+    def is_on(self):
+        return self.state
+
+    def turn_on(self):
+        return self._switch(True)
+
+    def turn_off(self):
+        return self._switch(False)
+
+    def _switch(self, state):
+        commander = self._registry.commander
+        if commander is None:
+            self.state = state
+            return None
+        return commander(self._device, self._port_id, state)
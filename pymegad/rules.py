@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""Automation rules triggered by port transitions.
+
+A rule reads "when ``device`` port ``port`` goes ``edge``, switch
+``target`` port ``target_port`` to ``state``", optionally after a delay,
+only while some other ports have given states, and at most once per
+``min_interval`` seconds. Rules are indexed by ``(device, port, edge)``
+so a transition only looks at the rules it can trigger.
+
+Rules are declared in the ``rules`` section of the config::
+
+    rules:
+      - device: 192.168.88.14
+        port: 3
+        edge: on
+        target: 192.168.88.15
+        target_port: 7
+        state: off
+        delay: 2
+        when:
+          - {port: 5, state: on}
+        min_interval: 1
+
+``edge`` is ``on``, ``off`` or ``any``, or one of the click kinds of
+:mod:`pymegad.debounce` (``single``, ``double``, ``multi``, ``long``) for
+ports with ``clicks`` enabled. ``target`` and the device of a ``when``
+condition default to the triggering device.
+
+A rule switching a port can trigger further rules, whether the switch is
+applied inline, after a delay or once the device confirmed a command;
+every step counts towards ``MAX_CHAIN_DEPTH``.
+"""
+
+import functools
+import logging
+
+from pymegad.debounce import CLICKS
+
+_LOGGER = logging.getLogger(__name__)
+
+EDGE_ON = 'on'
+EDGE_OFF = 'off'
+EDGE_ANY = 'any'
+EDGES = (EDGE_ON, EDGE_OFF, EDGE_ANY) + CLICKS
+
+# Rules switching ports can trigger further rules; stop runaway chains.
+MAX_CHAIN_DEPTH = 8
+
+
+def _edge(value):
+    # YAML reads bare on/off as booleans.
+    if value is True:
+        return EDGE_ON
+    if value is False:
+        return EDGE_OFF
+    value = str(value).lower()
+    if value not in EDGES:
+        raise ValueError('unknown edge {!r}'.format(value))
+    return value
+
+
+def _state(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).lower()
+    if value not in (EDGE_ON, EDGE_OFF):
+        raise ValueError('unknown state {!r}'.format(value))
+    return value == EDGE_ON
+
+
+class Rule:
+    __slots__ = ('device', 'port', 'edge', 'target', 'target_port', 'state',
+                 'delay', 'conditions', 'min_interval', 'last_fired')
+
+    def __init__(self, device, port, edge, target_port, state, target=None,
+                 delay=0, conditions=(), min_interval=0):
+        self.device = device
+        self.port = port
+        self.edge = edge
+        self.target = target or device
+        self.target_port = target_port
+        self.state = state
+        self.delay = delay
+        # (device, port, state) tuples that must all hold when triggered
+        self.conditions = tuple(conditions)
+        self.min_interval = min_interval
+        self.last_fired = None
+
+    @classmethod
+    def from_config(cls, spec):
+        device = spec['device']
+        conditions = [(condition.get('device', device), int(condition['port']),
+                       _state(condition['state']))
+                      for condition in spec.get('when') or ()]
+        return cls(device, int(spec['port']), _edge(spec.get('edge', EDGE_ON)),
+                   int(spec['target_port']), _state(spec['state']),
+                   target=spec.get('target'),
+                   delay=float(spec.get('delay') or 0),
+                   conditions=conditions,
+                   min_interval=float(spec.get('min_interval') or 0))
+
+    def key(self):
+        """Everything that defines the rule, to recognize it across reloads."""
+        return (self.device, self.port, self.edge, self.target, self.target_port,
+                self.state, self.delay, self.conditions, self.min_interval)
+
+    def __repr__(self):
+        return '<Rule {}:{} {} -> {}:{} {}>'.format(
+            self.device, self.port, self.edge, self.target, self.target_port,
+            EDGE_ON if self.state else EDGE_OFF)
+
+
+class RuleEngine:
+    def __init__(self, loop, registry, send):
+        """``send(device, port, state)`` switches an output; it is usually
+        :meth:`pymegad.main.MegadServer.send_command`."""
+        self._loop = loop
+        self._registry = registry
+        self._send = send
+        self._index = {}
+        # pending delayed action -> its rule
+        self._timers = {}
+        # (device, port, state) -> {command future in flight: chain depth}
+        self._sent = {}
+        self._depth = 0
+        self._reply_device = None
+        self._replies = None
+        self.fired = 0
+
+    def __bool__(self):
+        return bool(self._index)
+
+    def __len__(self):
+        return sum(len(rules) for rules in self._index.values())
+
+    def add_rule(self, rule):
+        self._index.setdefault((rule.device, rule.port, rule.edge), []).append(rule)
+        return rule
+
+    def rules(self):
+        return [rule for rules in self._index.values() for rule in rules]
+
+    def clear(self):
+        """Drop all rules and cancel the delayed actions still pending."""
+        self._index = {}
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+
+    def load(self, specs):
+        """Replace the rules with the ``rules`` config section.
+
+        Rules that are unchanged keep their rate limit and their pending
+        delayed actions; those of removed rules are cancelled.
+        """
+        previous = {}
+        for rule in self.rules():
+            previous.setdefault(rule.key(), []).append(rule)
+        self._index = {}
+        for spec in specs or ():
+            try:
+                rule = Rule.from_config(spec)
+            except (KeyError, TypeError, ValueError) as exc:
+                _LOGGER.error('Invalid rule %s: %s', spec, exc)
+                continue
+            kept = previous.get(rule.key())
+            self.add_rule(kept.pop() if kept else rule)
+        kept = set(self.rules())
+        for timer, rule in list(self._timers.items()):
+            if rule not in kept:
+                timer.cancel()
+                del self._timers[timer]
+        _LOGGER.info('Loaded %s rules', len(self))
+
+    def begin_reply(self, device):
+        """Collect immediate actions for ``device`` as inline reply actions
+        until :meth:`end_reply` instead of sending them."""
+        self._reply_device = device
+        self._replies = []
+
+    def end_reply(self):
+        replies = self._replies
+        self._reply_device = self._replies = None
+        return ';'.join(replies) if replies else None
+
+    def on_transition(self, device, port, old, new):
+        """Registry listener.
+
+        Ports going unknown (``new`` is None) or back from unknown (``old``
+        is None) are not edges: the device went offline, or was refreshed
+        after it came back.
+        """
+        index = self._index
+        if not index or old is None or new is None:
+            return
+        pending = self._sent.pop((device, port, new), None) if self._sent else None
+        depth = max(pending.values()) if pending else 0
+        if depth > self._depth:
+            # The device confirmed a command sent by a rule: continue its chain.
+            outer, self._depth = self._depth, depth
+            try:
+                self._dispatch(index, device, port, new)
+            finally:
+                self._depth = outer
+        else:
+            self._dispatch(index, device, port, new)
+
+    def _dispatch(self, index, device, port, new):
+        rules = index.get((device, port, EDGE_ON if new else EDGE_OFF))
+        if rules:
+            self._trigger(rules)
+        rules = index.get((device, port, EDGE_ANY))
+        if rules:
+            self._trigger(rules)
+
+    def on_click(self, device, port, kind, count):
+        """Debouncer click listener."""
+        rules = self._index.get((device, port, kind))
+        if rules:
+            self._trigger(rules)
+
+    def _trigger(self, rules):
+        now = self._loop.time()
+        get_state = self._registry.get_state
+        for rule in rules:
+            if rule.last_fired is not None and \
+                    now - rule.last_fired < rule.min_interval:
+                continue
+            if not all(get_state(device, port) is state
+                       for device, port, state in rule.conditions):
+                continue
+            rule.last_fired = now
+            self.fired += 1
+            if rule.delay > 0:
+                self._schedule(rule)
+            else:
+                self._execute(rule)
+
+    def _schedule(self, rule):
+        depth = self._depth
+
+        def run():
+            del self._timers[timer]
+            outer, self._depth = self._depth, depth
+            try:
+                self._execute(rule)
+            finally:
+                self._depth = outer
+        timer = self._loop.call_later(rule.delay, run)
+        self._timers[timer] = rule
+
+    def _execute(self, rule):
+        if self._depth >= MAX_CHAIN_DEPTH:
+            _LOGGER.error('Rule chain too deep, not running %s', rule)
+            return
+        _LOGGER.debug('Running %s', rule)
+        if rule.target == self._reply_device:
+            # The triggering device executes this from our response.
+            self._replies.append('{}:{}'.format(rule.target_port, 1 if rule.state else 0))
+            self._depth += 1
+            try:
+                self._registry.set_state(rule.target, rule.target_port, rule.state)
+            finally:
+                self._depth -= 1
+            return
+        future = self._send(rule.target, rule.target_port, rule.state)
+        if future is not None:
+            # The state changes when the device accepted the command; the
+            # transitions it causes belong to this chain.
+            key = (rule.target, rule.target_port, rule.state)
+            self._sent.setdefault(key, {})[future] = self._depth + 1
+            future.add_done_callback(functools.partial(self._command_done, key))
+
+    def _command_done(self, key, future):
+        pending = self._sent.get(key)
+        if pending is not None:
+            pending.pop(future, None)
+            if not pending:
+                del self._sent[key]
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Sensor readings with fixed-size time series history.
+
+MegaD reports ADC values, 1-Wire temperatures and DHT-style
+``temp:24.5/hum:40`` readings for ports marked as sensors in the
+config (``sensor: temperature``); the configured type is reported along
+with the values. The latest value of every series is always kept; with NumPy installed each series also gets a ring buffer
+of ``(timestamp, value)`` pairs in two preallocated float64 arrays, and
+history queries are answered with vectorized per-window min/max/mean.
+"""
+
+import logging
+import math
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 8640
+DEFAULT_NAME = 'value'
+
+
+def parse_reading(text):
+    """Parse a sensor reading into ``(name, value)`` pairs.
+
+    ``'24.5'`` gives ``[('value', 24.5)]`` and ``'temp:24.5/hum:40'``
+    gives ``[('temp', 24.5), ('hum', 40.0)]``; unparsable parts and
+    values that are not finite are skipped.
+    """
+    readings = []
+    for part in text.split('/'):
+        name, separator, value = part.partition(':')
+        if not separator:
+            name, value = DEFAULT_NAME, name
+        try:
+            number = float(value)
+        except ValueError:
+            continue
+        if math.isfinite(number):
+            readings.append((name.strip() or DEFAULT_NAME, number))
+    return readings
+
+
+class RingBuffer:
+    """The last ``capacity`` samples of one series, oldest overwritten."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if numpy is None:
+            raise RuntimeError('Sensor history requires numpy')
+        self.capacity = capacity
+        self._times = numpy.zeros(capacity, dtype=numpy.float64)
+        self._values = numpy.zeros(capacity, dtype=numpy.float64)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        index = self._next
+        self._times[index] = timestamp
+        self._values[index] = value
+        self._next = (index + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def window(self, start=None, end=None):
+        """Return the ``(times, values)`` arrays between ``start`` and
+        ``end`` (inclusive), oldest first."""
+        if self._count < self.capacity:
+            times = self._times[:self._count]
+            values = self._values[:self._count]
+        else:
+            times = numpy.concatenate((self._times[self._next:],
+                                       self._times[:self._next]))
+            values = numpy.concatenate((self._values[self._next:],
+                                        self._values[:self._next]))
+        low = 0 if start is None else numpy.searchsorted(times, start, 'left')
+        high = len(times) if end is None else \
+            numpy.searchsorted(times, end, 'right')
+        return times[low:high], values[low:high]
+
+    def downsample(self, step, start=None, end=None):
+        """Aggregate the samples into windows of ``step`` seconds.
+
+        Returns a dict of arrays: ``time`` (window start), ``min``,
+        ``max``, ``mean`` and ``count``; empty windows are left out.
+        """
+        times, values = self.window(start, end)
+        if not len(times):
+            empty = numpy.zeros(0)
+            return {'time': empty, 'min': empty, 'max': empty, 'mean': empty,
+                    'count': numpy.zeros(0, dtype=numpy.int64)}
+        origin = times[0] if start is None else start
+        buckets = ((times - origin) // step).astype(numpy.int64)
+        first = numpy.concatenate(
+            ([0], numpy.flatnonzero(numpy.diff(buckets)) + 1))
+        counts = numpy.diff(numpy.append(first, len(values)))
+        return {
+            'time': origin + buckets[first] * step,
+            'min': numpy.minimum.reduceat(values, first),
+            'max': numpy.maximum.reduceat(values, first),
+            'mean': numpy.add.reduceat(values, first) / counts,
+            'count': counts,
+        }
+
+
+class SensorStore:
+    def __init__(self, capacity=DEFAULT_CAPACITY, clock=time.time):
+        self.capacity = capacity
+        self.history = numpy is not None and capacity > 0
+        self._clock = clock
+        self._latest = {}
+        self._series = {}
+        self._types = {}
+
+    def configure(self, types):
+        """Take the configured ``{(device, port): type}`` of the sensor ports."""
+        self._types = dict(types)
+
+    def type(self, device, port):
+        return self._types.get((device, port))
+
+    def record(self, device, port, name, value, timestamp=None):
+        if timestamp is None:
+            timestamp = self._clock()
+        latest = self._latest.get((device, port))
+        if latest is None:
+            latest = self._latest[(device, port)] = {}
+        latest[name] = (timestamp, value)
+        if self.history:
+            key = (device, port, name)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = RingBuffer(self.capacity)
+            series.append(timestamp, value)
+
+    def record_reading(self, device, port, text, timestamp=None):
+        """Record every value of a raw reading; returns how many."""
+        if timestamp is None:
+            timestamp = self._clock()
+        readings = parse_reading(text)
+        for name, value in readings:
+            self.record(device, port, name, value, timestamp)
+        return len(readings)
+
+    def latest(self, device, port):
+        """Return ``{name: (timestamp, value)}`` for a port."""
+        return dict(self._latest.get((device, port), ()))
+
+    def series(self, device, port, name=DEFAULT_NAME):
+        return self._series.get((device, port, name))
+
+    def ports(self):
+        """Return the ``(device, port)`` pairs with readings."""
+        return list(self._latest)
+
+    def keys(self):
+        return [(device, port, name) for (device, port), latest in self._latest.items()
+                for name in latest]
+
+    def forget(self, device):
+        for key in [key for key in self._latest if key[0] == device]:
+            for name in self._latest.pop(key):
+                self._series.pop(key + (name,), None)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Server-Sent Events fan-out of port transitions.
+
+``GET /events`` (optionally ``?device=<ip>``) turns the connection into
+an ``text/event-stream``. A client first gets a ``snapshot`` event with
+the full state, then one ``state`` event per transition and a ``device``
+event whenever a device goes offline or comes back. Every
+transition is serialized once and the same bytes are written to all
+subscribers without waiting for them to drain, so a slow client never
+stalls ingestion.
+
+Each client may have at most ``buffer_size`` bytes queued in its
+transport. A client over the limit stops receiving events; with the
+``resync`` policy it gets a fresh snapshot once its buffer has drained,
+with ``drop`` it is disconnected.
+
+Event ids are registry versions. With a registry shared between worker
+processes, transitions made by other workers are not seen here; when the
+version moved past the last event sent, clients get a fresh snapshot
+instead of the next ping.
+"""
+
+import asyncio
+import json
+import logging
+
+from pymegad.parser import parse_query
+
+_LOGGER = logging.getLogger(__name__)
+
+EVENTS_PATH = b'/events'
+
+OVERFLOW_RESYNC = 'resync'
+OVERFLOW_DROP = 'drop'
+
+STREAM_HEAD = (b'HTTP/1.1 200 OK\r\n'
+               b'Content-Type: text/event-stream\r\n'
+               b'Cache-Control: no-cache\r\n'
+               b'Connection: close\r\n\r\n')
+PING = b': ping\n\n'
+
+
+def is_events_request(target):
+    return target.split(b'?', 1)[0].rstrip(b'/') == EVENTS_PATH
+
+
+def encode_event(kind, event_id, payload):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+        event_id, kind, json.dumps(payload, separators=(',', ':'), sort_keys=True)
+    ).encode()
+
+
+class _Client:
+    __slots__ = ('writer', 'device', 'stale', 'closed')
+
+    def __init__(self, writer, device, loop):
+        self.writer = writer
+        self.device = device
+        self.stale = False
+        self.closed = loop.create_future()
+
+    def close(self):
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+
+class EventStream:
+    def __init__(self, loop, registry, buffer_size=65536,
+                 overflow=OVERFLOW_RESYNC, ping_interval=15.0):
+        self._loop = loop
+        self._registry = registry
+        self.buffer_size = buffer_size
+        self.overflow = overflow
+        self.ping_interval = ping_interval
+        self._clients = set()
+        self._ping = None
+        # Registry version the subscribers have last been told about.
+        self._version = registry.version
+        self.dropped = 0
+        self.resynced = 0
+
+    def __len__(self):
+        return len(self._clients)
+
+    def snapshot(self, device=None):
+        registry = self._registry
+        devices = [device] if device is not None else registry.devices()
+        return encode_event('snapshot', registry.version, {
+            'version': registry.version,
+            'devices': {ip: {str(port): state for port, state
+                             in registry.device_states(ip).items()}
+                        for ip in devices if registry.device(ip) is not None}})
+
+    def on_transition(self, device, port, old, new):
+        """Registry listener writing the transition to every subscriber."""
+        if not self._clients:
+            return
+        self._version = self._registry.version
+        data = None
+        for client in list(self._clients):
+            if client.device is not None and client.device != device:
+                continue
+            if data is None:
+                data = encode_event('state', self._registry.version, {
+                    'device': device, 'port': port, 'state': new,
+                    'version': self._registry.version})
+            self._send(client, data)
+
+    def publish_device(self, device, online):
+        """Tell the subscribers that a device went offline or came back."""
+        data = None
+        for client in list(self._clients):
+            if client.device is not None and client.device != device:
+                continue
+            if data is None:
+                data = encode_event('device', self._registry.version, {
+                    'device': device, 'online': online,
+                    'version': self._registry.version})
+            self._send(client, data)
+
+    def _send(self, client, data):
+        transport = client.writer.transport
+        if transport.is_closing():
+            self._remove(client)
+            return
+        if client.stale:
+            if transport.get_write_buffer_size() > 0:
+                return
+            client.stale = False
+            self.resynced += 1
+            data = self.snapshot(client.device)
+        elif transport.get_write_buffer_size() + len(data) > self.buffer_size:
+            self.dropped += 1
+            if self.overflow == OVERFLOW_DROP:
+                _LOGGER.warning('Disconnecting slow event stream client')
+                self._remove(client)
+                transport.abort()
+                return
+            client.stale = True
+            return
+        client.writer.write(data)
+
+    def _remove(self, client):
+        self._clients.discard(client)
+        client.close()
+        if not self._clients and self._ping is not None:
+            self._ping.cancel()
+            self._ping = None
+
+    def _send_pings(self):
+        self._ping = self._loop.call_later(self.ping_interval, self._send_pings)
+        if self._registry.shared and self._registry.version != self._version:
+            self._version = self._registry.version
+            snapshots = {}
+            for client in list(self._clients):
+                data = snapshots.get(client.device)
+                if data is None:
+                    data = snapshots[client.device] = self.snapshot(client.device)
+                self._send(client, data)
+            return
+        for client in list(self._clients):
+            self._send(client, PING)
+
+    async def serve(self, reader, writer, request):
+        """Stream events to one client until it disconnects."""
+        device = parse_query(request.target).get('device')
+        client = _Client(writer, device, self._loop)
+        writer.write(STREAM_HEAD + self.snapshot(device))
+        self._clients.add(client)
+        if self._ping is None and self.ping_interval:
+            self._ping = self._loop.call_later(self.ping_interval, self._send_pings)
+        eof = self._loop.create_task(_wait_eof(reader))
+        try:
+            await asyncio.wait((eof, client.closed),
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            eof.cancel()
+            self._remove(client)
+
+    def close(self):
+        for client in list(self._clients):
+            self._remove(client)
+            client.writer.close()
+
+
+async def _wait_eof(reader):
+    # Whatever the client sends after the request is ignored.
+    while await reader.read(1024):
+        pass
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Multi-process worker mode.
+
+The parent maps an anonymous shared memory segment and forks workers.
+Every worker builds its own :class:`pymegad.main.MegadServer` listening
+on the same address with ``SO_REUSEPORT``, so the kernel spreads incoming
+connections over the workers. Port states live in the shared segment:
+workers lay out devices in configuration order, so the same device gets
+the same slice in every process and any worker can serve any device.
+With ``poll`` enabled only the first worker polls the devices; the states
+it reads land in the shared segment for every worker. Only the first
+worker serves ``metrics_port`` as well, and its counters cover the
+requests that worker handled.
+
+The registry version sits in the segment as well, one counter per
+worker summed on read, so ETags, cached payloads and event ids agree
+across workers. Event bus subscribers and the outbound client stay
+local to each worker. Only the first worker owns the ``state_dir`` store: it
+restores the saved states into the shared segment before the other
+workers are started, and its snapshots cover the changes made through
+every worker. Its journal only records its own transitions in between.
+
+Config reload is not available in this mode: device state buffers sit at
+fixed offsets of the shared segment, and a reload would have to move them
+in every worker at once. SIGHUP is logged and otherwise ignored; restart
+the server to apply a new config.
+"""
+
+import functools
+import logging
+import mmap
+import os
+import signal
+import traceback
+
+from pymegad.log import setup_logging
+from pymegad.ports import PortRegistry, VersionCounter
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_ARENA_SIZE = 1 << 20
+
+
+class SharedArena:
+    """Anonymous shared memory handed out as per-device state buffers,
+    after one registry version counter per writer process."""
+
+    def __init__(self, size=DEFAULT_ARENA_SIZE, writers=1):
+        self.size = size
+        self.writers = writers
+        header = 8 * writers
+        self._mmap = mmap.mmap(-1, header + size)
+        view = memoryview(self._mmap)
+        self._counters = view[:header].cast('Q')
+        self._view = view[header:]
+
+    def allocator(self):
+        """Return a fresh bump allocator over the whole segment.
+
+        Allocators created in different processes return the same slices
+        for the same sequence of sizes.
+        """
+        offset = [0]
+
+        def allocate(size):
+            start = offset[0]
+            if start + size > self.size:
+                raise MemoryError('Shared port state arena is full ({} bytes)'.format(self.size))
+            offset[0] = start + size
+            return self._view[start:start + size]
+        return allocate
+
+    def registry(self, writer=0):
+        """Return a registry over the segment; ``writer`` picks the version
+        counter this process bumps."""
+        return PortRegistry(allocate=self.allocator(),
+                            counter=VersionCounter(self._counters, writer))
+
+
+def _serve_worker(host, port, arena, config, config_path, log_handlers, log_sample,
+                  index=0, ready=None):
+    """Run one worker process; returns its exit status."""
+    # The parent's log listener thread does not survive the fork; start one
+    # over the same handlers and sampling.
+    listener = setup_logging(logging.getLogger().level, handlers=log_handlers,
+                             sample_every=log_sample)
+    # A hangup of the parent's terminal reaches the workers too.
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    try:
+        _run_server(host, port, arena, config, config_path, index, ready)
+    except Exception:
+        # Logged while the listener runs; stopping it flushes the record.
+        _LOGGER.exception('Worker %s failed', os.getpid())
+        return 1
+    finally:
+        listener.stop()
+    return 0
+
+
+def _run_server(host, port, arena, config, config_path, index, ready):
+    from pymegad.main import MegadServer
+
+    owner = index == 0
+    server = MegadServer(host, port, config=config, config_path=config_path,
+                         registry=arena.registry(index), reuse_port=True, persist=owner,
+                         reloadable=False, poll=owner, expose_metrics=owner)
+    if ready is not None:
+        # The saved states are in the arena now.
+        os.write(ready, b'1')
+        os.close(ready)
+    server.loop.add_signal_handler(signal.SIGTERM, server.loop.stop)
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+def _fork_worker(serve, owner=False):
+    """Fork a process running ``serve(ready=fd)``; returns its pid.
+
+    An ``owner`` gets a pipe to report that it restored the saved states,
+    and the parent waits for that before forking the next worker.
+    """
+    ready = os.pipe() if owner else (None, None)
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            if owner:
+                os.close(ready[0])
+            code = serve(ready=ready[1])
+        except Exception:
+            # Raised before the worker's log listener started, or after it
+            # stopped; stderr is all that is left.
+            traceback.print_exc()
+        finally:
+            os._exit(code)
+    if owner:
+        os.close(ready[1])
+        # Returns early, with b'', if the worker died before restoring.
+        os.read(ready[0], 1)
+        os.close(ready[0])
+    return pid
+
+
+def _terminate(children):
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def _forward_signals(children):
+    """Install the parent's signal handlers; returns the previous ones."""
+    def terminate(signum, frame):
+        _terminate(children)
+
+    def refuse_reload(signum, frame):
+        _LOGGER.warning('Config reload is not supported with several workers, '
+                        'restart the server to apply config changes')
+
+    return {signal.SIGTERM: signal.signal(signal.SIGTERM, terminate),
+            signal.SIGHUP: signal.signal(signal.SIGHUP, refuse_reload)}
+
+
+def _wait_workers(children):
+    try:
+        for pid in children:
+            while True:
+                try:
+                    os.waitpid(pid, 0)
+                    break
+                except InterruptedError:
+                    continue
+    except KeyboardInterrupt:
+        _terminate(children)
+        for pid in children:
+            os.waitpid(pid, 0)
+
+
+def run_workers(host, port, workers, config=None, config_path=None,
+                arena_size=DEFAULT_ARENA_SIZE, log_handlers=None, log_sample=1):
+    """Fork ``workers`` server processes sharing port states; blocks until
+    they all exit.
+
+    Workers log through ``log_handlers`` (usually the ``handlers`` of the
+    parent's listener) with the parent's ``log_sample`` rate.
+    """
+    arena = SharedArena(arena_size, writers=workers)
+    children = []
+    for index in range(workers):
+        serve = functools.partial(_serve_worker, host, port, arena, config, config_path,
+                                  log_handlers, log_sample, index)
+        children.append(_fork_worker(serve, owner=index == 0))
+    _LOGGER.info('Started workers: %s', children)
+
+    previous = _forward_signals(children)
+    try:
+        _wait_workers(children)
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+    return arena
@@ -231,9 +231,12 @@ setup_dict = dict(
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
         'Operating System :: OS Independent',
-        'Programming Language :: Python :: 2.6',
-        'Programming Language :: Python :: 2.7',
-        'Programming Language :: Python :: 3.3',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
         'Programming Language :: Python :: Implementation :: PyPy',
         'Topic :: Documentation',
         'Topic :: Software Development :: Libraries :: Python Modules',
@@ -241,9 +244,19 @@ setup_dict = dict(
         'Topic :: System :: Software Distribution',
     ],
     packages=find_packages(exclude=(TESTS_DIRECTORY,)),
+    # mega.yaml is the protocol definition, config.yaml an example
+    package_data={CODE_DIRECTORY: ['*.yaml']},
+    include_package_data=True,
+    python_requires='>=3.8',
     install_requires=[
         # your module dependencies
     ] + python_version_specific_requires,
+    extras_require={
+        # ring-buffer history of sensor readings
+        'sensors': ['numpy'],
+        # optional faster event loop, see pymegad.eventloop
+        'uvloop': ['uvloop'],
+    },
     # Allow tests to be run with `python setup.py test'.
     tests_require=[
         'pytest==2.5.1',
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def loop():
+    """A fresh event loop, also set as the current one."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
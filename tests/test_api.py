@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from pymegad.api import (BAD_REQUEST, NOT_FOUND, NOT_MODIFIED, OK, SensorApi, StateApi,
+                         is_sensors_request, is_state_request)
+from pymegad.parser import parse_request
+from pymegad.ports import PortRegistry
+from pymegad.sensors import SensorStore
+from pymegad.workers import SharedArena
+
+
+def get(loop, api, target, headers=b''):
+    request = parse_request(b'GET ' + target + b' HTTP/1.1\r\n' + headers + b'\r\n')
+    return loop.run_until_complete(api.respond(request))
+
+
+class TestStateApi(object):
+    def setup_method(self, method):
+        self.registry = PortRegistry()
+        self.registry.add_device('10.0.0.1', [1, 2])
+        self.api = StateApi(self.registry)
+        self.registry.add_listener(self.api.on_transition)
+
+    def test_is_state_request(self):
+        assert is_state_request(b'/state')
+        assert is_state_request(b'/state/10.0.0.1?wait=1')
+        assert not is_state_request(b'/?pt=1')
+        assert not is_state_request(b'/statement')
+
+    def test_views(self, loop):
+        self.registry.set_state('10.0.0.1', 2, True)
+        status, etag, body = get(loop, self.api, b'/state')
+        assert status == OK
+        assert json.loads(body.decode()) == {
+            'version': self.registry.version,
+            'devices': {'10.0.0.1': {'1': False, '2': True}}}
+        _, _, body = get(loop, self.api, b'/state/10.0.0.1/2')
+        assert json.loads(body.decode())['state'] is True
+        assert get(loop, self.api, b'/state/10.0.0.9')[0] == NOT_FOUND
+        assert get(loop, self.api, b'/state/10.0.0.1/7')[0] == NOT_FOUND
+
+    def test_cached_until_changed(self, loop):
+        first = get(loop, self.api, b'/state/10.0.0.1')
+        assert get(loop, self.api, b'/state/10.0.0.1/')[2] is first[2]
+        assert self.api.hits == 1
+        self.registry.set_state('10.0.0.1', 1, True)
+        assert get(loop, self.api, b'/state/10.0.0.1')[1] != first[1]
+
+    def test_etag(self, loop):
+        _, etag, _ = get(loop, self.api, b'/state')
+        status, _, body = get(loop, self.api, b'/state', b'If-None-Match: ' + etag + b'\r\n')
+        assert (status, body) == (NOT_MODIFIED, b'')
+
+    def test_long_poll(self, loop):
+        version = self.registry.version
+        loop.call_later(0.01, self.registry.set_state, '10.0.0.1', 1, True)
+        target = '/state/10.0.0.1/1?version={}&wait=5'.format(version).encode()
+        _, _, body = get(loop, self.api, target)
+        assert json.loads(body.decode())['state'] is True
+
+    def test_long_poll_timeout(self, loop):
+        target = '/state?version={}&wait=0.01'.format(self.registry.version).encode()
+        assert get(loop, self.api, target)[0] == OK
+
+    def test_long_poll_sees_other_workers(self, loop):
+        arena = SharedArena(64, writers=2)
+        registry, other = arena.registry(0), arena.registry(1)
+        for each in (registry, other):
+            each.add_device('10.0.0.1', [1])
+        api = StateApi(registry)
+        loop.call_later(0.01, other.set_state, '10.0.0.1', 1, True)
+        target = '/state/10.0.0.1/1?version={}&wait=5'.format(registry.version).encode()
+        started = loop.time()
+        _, etag, body = get(loop, api, target)
+        assert json.loads(body.decode())['state'] is True
+        assert etag == '"{}"'.format(other.version).encode()
+        assert loop.time() - started < 2
+
+
+class TestSensorApi(object):
+    def setup_method(self, method):
+        self.sensors = SensorStore(capacity=16)
+        for second in range(4):
+            self.sensors.record_reading('10.0.0.1', 3, 'temp:{}/hum:40'.format(20 + second),
+                                        timestamp=float(second))
+        self.sensors.configure({('10.0.0.1', 3): 'dht22'})
+        self.api = SensorApi(self.sensors)
+
+    def respond(self, target):
+        status, _, body = self.api.respond(
+            parse_request(b'GET ' + target + b' HTTP/1.1\r\n\r\n'))
+        return status, json.loads(body.decode())
+
+    def test_is_sensors_request(self):
+        assert is_sensors_request(b'/sensors/10.0.0.1/3?step=60')
+        assert not is_sensors_request(b'/state')
+
+    def test_latest(self):
+        status, payload = self.respond(b'/sensors')
+        assert status == OK
+        assert payload['devices']['10.0.0.1']['3']['temp'] == {'time': 3.0, 'value': 23.0}
+        status, payload = self.respond(b'/sensors/10.0.0.1/3')
+        assert payload['type'] == 'dht22'
+        assert payload['values']['hum']['value'] == 40.0
+        assert self.respond(b'/sensors/10.0.0.1/4')[0] == NOT_FOUND
+        assert self.respond(b'/sensors/10.0.0.1')[0] == NOT_FOUND
+
+    def test_history(self):
+        pytest.importorskip('numpy')
+        status, payload = self.respond(b'/sensors/10.0.0.1/3?step=2&name=temp')
+        assert status == OK
+        assert payload['history']['mean'] == [20.5, 22.5]
+        assert payload['history']['count'] == [2, 2]
+        assert self.respond(b'/sensors/10.0.0.1/3?step=2')[0] == NOT_FOUND
+        assert self.respond(b'/sensors/10.0.0.1/3?step=x')[0] == BAD_REQUEST
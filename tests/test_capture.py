@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import pytest
+
+from pymegad.capture import CaptureWriter, read_capture, replay_into, replay_server
+
+HEAD = b'GET /?pt=3&m=1 HTTP/1.1\r\n\r\n'
+
+
+class FakeServer(object):
+    def __init__(self):
+        self.commands = []
+
+    def handle_command(self, device, command):
+        self.commands.append((device, dict(command)))
+
+
+def write_capture(path, records):
+    writer = CaptureWriter(path)
+    writer.open()
+    for record in records:
+        writer.record(*record)
+    writer.close()
+
+
+class TestCapture(object):
+    def test_roundtrip(self, tmpdir):
+        path = str(tmpdir.join('events.capture'))
+        write_capture(path, [(1.5, '10.0.0.1', HEAD)])
+        write_capture(path, [(2.5, '10.0.0.2', b'GET /?all=ON HTTP/1.1\r\n\r\n')])
+        records = list(read_capture(path))
+        assert records[0] == (1.5, '10.0.0.1', HEAD)
+        assert [ip for _, ip, _ in records] == ['10.0.0.1', '10.0.0.2']
+
+    def test_truncated_tail(self, tmpdir):
+        path = str(tmpdir.join('events.capture'))
+        write_capture(path, [(1.0, '10.0.0.1', HEAD)])
+        with open(path, 'ab') as capture:
+            capture.write(b'\x00' * 7)
+        assert len(list(read_capture(path))) == 1
+
+    def test_shared_by_several_writers(self, tmpdir):
+        path = str(tmpdir.join('events.capture'))
+        writers = [CaptureWriter(path), CaptureWriter(path)]
+        for writer in writers:
+            writer.open()
+        for index in range(6):
+            writer = writers[index % 2]
+            writer.record(float(index), '10.0.0.{}'.format(index % 2), HEAD)
+            writer.flush()
+        for writer in writers:
+            writer.close()
+        records = list(read_capture(path))
+        assert [timestamp for timestamp, _, _ in records] == [0, 1, 2, 3, 4, 5]
+
+    def test_not_a_capture(self, tmpdir):
+        path = tmpdir.join('other')
+        path.write(b'garbage file')
+        with pytest.raises(ValueError):
+            list(read_capture(str(path)))
+
+    def test_replay_max_speed(self, loop):
+        server = FakeServer()
+        records = [(1000.0, '10.0.0.1', HEAD), (2000.0, '10.0.0.1', b'POST / HTTP/1.1\r\n\r\n')]
+        started = time.perf_counter()
+        assert loop.run_until_complete(replay_into(server, records, speed=0)) == 1
+        assert time.perf_counter() - started < 1
+        assert server.commands == [('10.0.0.1', {'pt': '3', 'm': '1'})]
+
+    def test_replay_skips_api_requests(self, loop):
+        server = FakeServer()
+        records = [(1.0, '10.0.0.1', b'GET /state?wait=5 HTTP/1.1\r\n\r\n'),
+                   (2.0, '10.0.0.1', b'GET /events HTTP/1.1\r\n\r\n'),
+                   (3.0, '10.0.0.1', b'GET /sensors HTTP/1.1\r\n\r\n')]
+        assert loop.run_until_complete(replay_into(server, records, speed=0)) == 0
+
+    def test_replay_server_is_isolated(self, loop, tmpdir):
+        config = tmpdir.join('config.yaml')
+        config.write('switch:\n'
+                     '  - {platform: megad, ip: 10.0.0.1, ports: {3: {}}}\n'
+                     'server:\n'
+                     '  state_dir: ' + str(tmpdir.join('state')) + '\n'
+                     '  capture_path: ' + str(tmpdir.join('events.capture')) + '\n'
+                     'rules:\n'
+                     '  - {device: 10.0.0.1, port: 3, target: 10.0.0.2, '
+                     'target_port: 1, state: on}\n')
+        server = replay_server(loop, str(config))
+        try:
+            records = [(1.0, '10.0.0.1', b'GET /?pt=3 HTTP/1.1\r\n\r\n')]
+            assert loop.run_until_complete(replay_into(server, records, speed=0)) == 1
+            loop.run_until_complete(asyncio.sleep(0.05))
+            assert server.ports.get_state('10.0.0.1', 3) is True
+            assert server.rules.fired == 1
+        finally:
+            server.close()
+        assert not tmpdir.join('state').exists()
+        assert not tmpdir.join('events.capture').exists()
+
+    def test_replay_paced(self, loop):
+        server = FakeServer()
+        records = [(10.0, 'a', HEAD), (10.5, 'b', HEAD)]
+        started = time.perf_counter()
+        loop.run_until_complete(replay_into(server, records, speed=10))
+        assert 0.04 <= time.perf_counter() - started < 0.5
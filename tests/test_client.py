@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from pymegad.client import CommandError, MegadClient
+
+
+class FakeMegad(object):
+    """Minimal MegaD HTTP endpoint recording the request targets."""
+
+    def __init__(self, loop, keep_alive=True, status=b'200 OK', reply=None):
+        self.loop = loop
+        self.keep_alive = keep_alive
+        self.status = status
+        self.reply = reply
+        self.targets = []
+        self.connections = 0
+        self.server = loop.run_until_complete(
+            asyncio.start_server(self.handle, '127.0.0.1', 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except asyncio.IncompleteReadError:
+                break
+            self.targets.append(head.split()[1].decode())
+            if self.reply is not None:
+                writer.write(self.reply)
+                break
+            body = b'Done'
+            headers = b'HTTP/1.1 ' + self.status + b'\r\n'
+            if self.keep_alive:
+                headers += b'Content-Length: 4\r\n'
+            writer.write(headers + b'\r\n' + body)
+            await writer.drain()
+            if not self.keep_alive:
+                break
+        writer.close()
+
+    def close(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+
+
+class TestMegadClient(object):
+    def test_commands_are_coalesced(self, loop):
+        megad = FakeMegad(loop)
+        client = MegadClient(loop, port=megad.port)
+        superseded = client.queue_command('127.0.0.1', 'sec', 7, True)
+        futures = [
+            client.queue_command('127.0.0.1', 'sec', 8, False),
+            client.queue_command('127.0.0.1', 'sec', 7, False),
+            client.queue_command('127.0.0.1', 'sec', 7, False),
+        ]
+        results = loop.run_until_complete(asyncio.gather(*futures))
+        assert results == ['Done'] * 3
+        assert superseded.cancelled()
+        assert megad.targets == ['/sec/?cmd=8:0;7:0']
+        client.close()
+        megad.close()
+
+    def test_idle_connection_expires(self, loop):
+        megad = FakeMegad(loop)
+        client = MegadClient(loop, port=megad.port, idle_timeout=0.02)
+        loop.run_until_complete(client.request('127.0.0.1', None, 'cmd=all'))
+        assert len(client._channels['127.0.0.1'].idle) == 1
+        loop.run_until_complete(asyncio.sleep(0.05))
+        assert client._channels['127.0.0.1'].idle == []
+        loop.run_until_complete(client.request('127.0.0.1', None, 'cmd=all'))
+        assert megad.connections == 2
+        client.close()
+        megad.close()
+
+    def test_connection_reuse(self, loop):
+        megad = FakeMegad(loop)
+        client = MegadClient(loop, port=megad.port)
+        for query in ('cmd=all', 'cmd=1:1', 'cmd=all'):
+            loop.run_until_complete(client.request('127.0.0.1', None, query))
+        assert megad.targets == ['/?cmd=all', '/?cmd=1:1', '/?cmd=all']
+        assert megad.connections == 1
+        client.close()
+        megad.close()
+
+    def test_connection_close(self, loop):
+        megad = FakeMegad(loop, keep_alive=False)
+        client = MegadClient(loop, port=megad.port)
+        for _ in range(2):
+            assert loop.run_until_complete(
+                client.request('127.0.0.1', 'sec', 'cmd=all')) == 'Done'
+        assert megad.connections == 2
+        megad.close()
+
+    def test_empty_reply(self, loop):
+        megad = FakeMegad(loop, reply=b'\r\n\r\n')
+        client = MegadClient(loop, port=megad.port)
+        futures = [client.queue_command('127.0.0.1', 'sec', port, True) for port in (1, 2)]
+        for future in futures:
+            with pytest.raises(CommandError):
+                loop.run_until_complete(future)
+        client.close()
+        megad.close()
+
+    def test_error_status(self, loop):
+        megad = FakeMegad(loop, status=b'404 Not Found')
+        client = MegadClient(loop, port=megad.port)
+        future = client.queue_command('127.0.0.1', 'sec', 1, True)
+        with pytest.raises(CommandError):
+            loop.run_until_complete(future)
+        client.close()
+        megad.close()
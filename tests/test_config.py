@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import datetime
+import os
+
+import pytest
+
+from pymegad import config
+
+
+class TestLoadYaml(object):
+    @pytest.fixture(autouse=True)
+    def count_parses(self, monkeypatch):
+        self.parsed = 0
+        load = config.yaml.load
+
+        def counting_load(*args, **kwargs):
+            self.parsed += 1
+            return load(*args, **kwargs)
+        monkeypatch.setattr(config.yaml, 'load', counting_load)
+
+    def test_cached_until_changed(self, tmpdir):
+        source = tmpdir.join('config.yaml')
+        source.write('switch:\n  ip: 10.0.0.1\n')
+        cache_dir = str(tmpdir.join('cache'))
+
+        for _ in range(3):
+            data = config.load_yaml(str(source), cache_dir=cache_dir)
+            assert data == {'switch': {'ip': '10.0.0.1'}}
+        assert self.parsed == 1
+
+        source.write('switch:\n  ip: 10.0.0.2\n')
+        os.utime(str(source), ns=(0, 1))
+        assert config.load_yaml(str(source), cache_dir=cache_dir) == {
+            'switch': {'ip': '10.0.0.2'}}
+        assert self.parsed == 2
+
+    def test_touched_file_is_not_parsed_again(self, tmpdir):
+        source = tmpdir.join('mega.yaml')
+        source.write('all: all\n')
+        cache_dir = str(tmpdir.join('cache'))
+        config.load_yaml(str(source), cache_dir=cache_dir)
+        os.utime(str(source), ns=(0, 1))
+        assert config.load_yaml(str(source), cache_dir=cache_dir) == {
+            'all': 'all'}
+        assert self.parsed == 1
+
+    def test_corrupt_cache_and_no_cache(self, tmpdir):
+        source = tmpdir.join('mega.yaml')
+        source.write('pt: 1\n')
+        cache_dir = tmpdir.join('cache')
+        cache_dir.ensure(dir=True)
+        path = config._cache_path(str(source), str(cache_dir))
+        with open(path, 'wb') as broken:
+            broken.write(b'not marshal data')
+        assert config.load_yaml(str(source), cache_dir=str(cache_dir)) == {
+            'pt': 1}
+        assert config.load_yaml(str(source), use_cache=False) == {'pt': 1}
+        assert self.parsed == 2
+
+    def test_untrusted_cache_is_ignored(self, tmpdir):
+        source = tmpdir.join('config.yaml')
+        source.write('switch: []\n')
+        cache_dir = str(tmpdir.join('cache'))
+        config.load_yaml(str(source), cache_dir=cache_dir)
+        path = config._cache_path(str(source), cache_dir)
+        assert os.stat(path).st_mode & 0o077 == 0
+
+        os.chmod(path, 0o666)
+        assert config.load_yaml(str(source), cache_dir=cache_dir) == {'switch': []}
+        assert self.parsed == 2
+
+    def test_unmarshallable_data_is_not_cached(self, tmpdir):
+        source = tmpdir.join('config.yaml')
+        source.write('since: 2020-01-01\n')
+        cache_dir = str(tmpdir.join('cache'))
+        for _ in range(2):
+            assert config.load_yaml(str(source), cache_dir=cache_dir) == {
+                'since': datetime.date(2020, 1, 1)}
+        assert self.parsed == 2
+        assert not os.path.exists(config._cache_path(str(source), cache_dir))
+
+    def test_shipped_files(self):
+        assert config.load_yaml(config.DEFAULT_MEGA_PATH,
+                                use_cache=False)['port_update'] == 'pt'
+        assert 'switch' in config.load_yaml(config.EXAMPLE_CONFIG_PATH,
+                                            use_cache=False)
+        assert not os.path.isabs(config.DEFAULT_CONFIG_PATH)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from pymegad.debounce import CLICK_DOUBLE, CLICK_LONG, CLICK_SINGLE, Debouncer
+from pymegad.ports import PortRegistry
+
+
+def sleep(loop, seconds):
+    loop.run_until_complete(asyncio.sleep(seconds))
+
+
+class TestDebouncer(object):
+    def setup_method(self, method):
+        self.registry = PortRegistry()
+        self.registry.add_device('a', [1, 3])
+        self.transitions = []
+        self.registry.add_listener(
+            lambda *transition: self.transitions.append(transition))
+        self.clicks = []
+
+    def debouncer(self, loop, **settings):
+        debouncer = Debouncer(loop, self.registry)
+        debouncer.configure({'a': {'ports': {1: {}, 3: settings}}})
+        debouncer.add_listener(lambda *click: self.clicks.append(click[2:]))
+        self.registry.add_listener(debouncer.on_transition)
+        return debouncer
+
+    def test_plain_port_is_applied_directly(self, loop):
+        debouncer = self.debouncer(loop, debounce=0.02)
+        assert debouncer.feed('a', 1, True) is False
+        assert self.transitions == [('a', 1, False, True)]
+
+    def test_burst_settles_once(self, loop):
+        debouncer = self.debouncer(loop, debounce=0.02)
+        for state in (True, False, True, False, True):
+            debouncer.feed('a', 3, state)
+        assert self.transitions == []
+        sleep(loop, 0.05)
+        assert self.transitions == [('a', 3, False, True)]
+        assert debouncer.coalesced == 4
+
+    def test_burst_back_to_start_is_dropped(self, loop):
+        debouncer = self.debouncer(loop, debounce=0.02)
+        debouncer.feed('a', 3, True)
+        debouncer.feed('a', 3, False)
+        sleep(loop, 0.05)
+        assert self.transitions == []
+
+    def test_discard_held_back_states(self, loop):
+        debouncer = self.debouncer(loop, debounce=0.02)
+        debouncer.feed('a', 3, True)
+        debouncer.discard('a')
+        self.registry.ingest_statuses('a', 'OFF;OFF;OFF')
+        sleep(loop, 0.05)
+        assert self.transitions == []
+
+    def test_clicks(self, loop):
+        debouncer = self.debouncer(loop, clicks=True, long_press=0.05,
+                                   click_window=0.03)
+        debouncer.feed('a', 3, True)
+        debouncer.feed('a', 3, False)
+        sleep(loop, 0.05)
+        for state in (True, False, True, False):
+            debouncer.feed('a', 3, state)
+        sleep(loop, 0.05)
+        debouncer.feed('a', 3, True)
+        sleep(loop, 0.06)
+        debouncer.feed('a', 3, False)
+        assert self.clicks == [(CLICK_SINGLE, 1), (CLICK_DOUBLE, 2),
+                               (CLICK_LONG, 1)]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sys
+
+from pymegad import eventloop
+
+
+class TestEventLoop(object):
+    def test_asyncio_loop(self):
+        loop = eventloop.new_event_loop(eventloop.LOOP_ASYNCIO)
+        assert isinstance(loop, asyncio.AbstractEventLoop)
+        loop.close()
+
+    def test_unknown_loop_falls_back(self):
+        loop = eventloop.new_event_loop('twisted')
+        assert isinstance(loop, asyncio.AbstractEventLoop)
+        loop.close()
+
+    def test_available_loops(self):
+        assert eventloop.available_loops()[0] == eventloop.LOOP_ASYNCIO
+        if eventloop.uvloop is None:
+            assert eventloop.LOOP_UVLOOP not in eventloop.available_loops()
+
+    def test_loop_kwargs(self, monkeypatch):
+        loop = object()
+        assert eventloop.loop_kwargs(None) == {}
+        monkeypatch.setattr(sys, 'version_info', (3, 9, 18))
+        assert eventloop.loop_kwargs(loop) == {'loop': loop}
+        monkeypatch.setattr(sys, 'version_info', (3, 10, 0))
+        assert eventloop.loop_kwargs(loop) == {}
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from pymegad.events import EventBus, PortEvent
+from pymegad.ports import PortRegistry
+
+
+def drain(subscription):
+    events = []
+    while not subscription.queue.empty():
+        events.append(subscription.queue.get_nowait())
+        subscription.queue.task_done()
+    return events
+
+
+class TestEventBus(object):
+    def setup_method(self, method):
+        self.bus = EventBus()
+        self.registry = PortRegistry()
+        self.registry.add_device('10.0.0.1', [1, 2])
+        self.registry.add_device('10.0.0.2', [1])
+        self.registry.add_listener(self.bus.publish)
+
+    def test_only_transitions_are_published(self):
+        subscription = self.bus.subscribe()
+        self.registry.set_state('10.0.0.1', 1, True)
+        self.registry.set_state('10.0.0.1', 1, True)
+        self.registry.ingest_statuses('10.0.0.1', 'ON;ON')
+        assert drain(subscription) == [
+            PortEvent('10.0.0.1', 1, False, True),
+            PortEvent('10.0.0.1', 2, False, True),
+        ]
+
+    def test_filters(self):
+        by_device = self.bus.subscribe(device='10.0.0.2')
+        by_port = self.bus.subscribe(device='10.0.0.1', port=2)
+        self.registry.set_state('10.0.0.1', 1, True)
+        self.registry.set_state('10.0.0.1', 2, True)
+        self.registry.set_state('10.0.0.2', 1, True)
+        assert drain(by_device) == [PortEvent('10.0.0.2', 1, False, True)]
+        assert drain(by_port) == [PortEvent('10.0.0.1', 2, False, True)]
+
+    def test_unsubscribe(self):
+        subscription = self.bus.subscribe()
+        subscription.close()
+        self.registry.set_state('10.0.0.1', 1, True)
+        assert drain(subscription) == []
+
+    def test_drop_policy(self):
+        subscription = self.bus.subscribe(maxsize=1)
+        self.registry.set_state('10.0.0.1', 1, True)
+        self.registry.set_state('10.0.0.1', 2, True)
+        assert drain(subscription) == [PortEvent('10.0.0.1', 1, False, True)]
+        assert subscription.dropped == 1
+
+    def test_drop_oldest_policy(self):
+        subscription = self.bus.subscribe(maxsize=1, policy='drop_oldest')
+        self.registry.set_state('10.0.0.1', 1, True)
+        self.registry.set_state('10.0.0.1', 2, True)
+        assert drain(subscription) == [PortEvent('10.0.0.1', 2, False, True)]
+
+    def test_coalesce_policy(self):
+        subscription = self.bus.subscribe(maxsize=2, policy='coalesce')
+        self.registry.set_state('10.0.0.1', 1, True)
+        self.registry.set_state('10.0.0.1', 1, False)
+        self.registry.set_state('10.0.0.1', 2, True)
+        assert drain(subscription) == [PortEvent('10.0.0.1', 2, False, True)]
+        assert subscription.dropped == 0
+
+    def test_coalesce_replaces_queued_event(self):
+        subscription = self.bus.subscribe(maxsize=10, policy='coalesce')
+        self.registry.set_state('10.0.0.1', 1, True)
+        self.registry.set_state('10.0.0.1', 2, True)
+        self.registry.set_state('10.0.0.1', 1, False)
+        self.registry.set_state('10.0.0.1', 2, False)
+        self.registry.set_state('10.0.0.1', 2, True)
+        assert subscription.queue.qsize() == 1
+        assert drain(subscription) == [PortEvent('10.0.0.1', 2, False, True)]
+
+    def test_coalesce_full_drops_oldest_port(self):
+        subscription = self.bus.subscribe(maxsize=2, policy='coalesce')
+        self.registry.set_state('10.0.0.1', 1, True)
+        self.registry.set_state('10.0.0.1', 2, True)
+        self.registry.set_state('10.0.0.2', 1, True)
+        self.registry.set_state('10.0.0.1', 2, False)
+        assert drain(subscription) == [PortEvent('10.0.0.2', 1, False, True)]
+        assert subscription.dropped == 1
+
+    @pytest.mark.parametrize('policy', ['coalesce', 'drop_oldest'])
+    def test_join_after_dropped_events(self, loop, policy):
+        subscription = self.bus.subscribe(maxsize=1, policy=policy)
+        self.registry.set_state('10.0.0.1', 1, True)
+        self.registry.set_state('10.0.0.1', 1, False)
+        self.registry.set_state('10.0.0.1', 2, True)
+        drain(subscription)
+        loop.run_until_complete(asyncio.wait_for(subscription.queue.join(), 1.0))
+
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            self.bus.subscribe(policy='block')
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from pymegad.liveness import LivenessTracker, TimerWheel
+from pymegad.workers import SharedArena
+
+
+class TestTimerWheel(object):
+    def expiry_tick(self, wheel, key, limit=100):
+        for tick in range(1, limit):
+            if key in wheel.advance():
+                return tick
+        return None
+
+    def test_expires_after_delay(self):
+        wheel = TimerWheel(tick=1.0, slots=8)
+        wheel.schedule('a', 3)
+        assert self.expiry_tick(wheel, 'a') == 3
+        assert len(wheel) == 0
+
+    def test_multiple_rounds(self):
+        wheel = TimerWheel(tick=1.0, slots=8)
+        wheel.schedule('a', 20)
+        wheel.schedule('b', 8)
+        assert self.expiry_tick(wheel, 'b') == 8
+        assert self.expiry_tick(wheel, 'a') == 12
+
+    def test_reschedule_and_cancel(self):
+        wheel = TimerWheel(tick=0.5, slots=8)
+        wheel.schedule('a', 1)
+        wheel.schedule('a', 2)
+        assert self.expiry_tick(wheel, 'a') == 4
+        wheel.schedule('b', 1)
+        wheel.cancel('b')
+        assert 'b' not in wheel
+        assert self.expiry_tick(wheel, 'b', limit=20) is None
+
+
+class TestLivenessTracker(object):
+    def test_offline_and_back(self, loop):
+        tracker = LivenessTracker(loop, tick=0.01, slots=16)
+        changes = []
+        tracker.add_listener(lambda ip, online: changes.append((ip, online)))
+        tracker.configure({'a': 0.05, 'b': 0.05, 'c': None})
+        tracker.start()
+        for _ in range(8):
+            loop.run_until_complete(asyncio.sleep(0.01))
+            tracker.seen('b')
+        loop.run_until_complete(asyncio.sleep(0.05))
+        assert ('a', False) in changes
+        assert tracker.is_online('c')
+        tracker.seen('a')
+        assert changes[-1] == ('a', True)
+        assert tracker.is_online('a')
+        tracker.stop()
+
+    def test_untracked_after_reconfigure(self, loop):
+        tracker = LivenessTracker(loop, tick=0.01, slots=16)
+        tracker.configure({'a': 0.02})
+        tracker.configure({})
+        tracker.start()
+        loop.run_until_complete(asyncio.sleep(0.05))
+        assert tracker.offline() == []
+        tracker.stop()
+
+    def test_shared_last_seen(self, loop):
+        arena = SharedArena(64)
+        trackers = [LivenessTracker(loop, tick=0.01, slots=16, allocate=arena.allocator())
+                    for _ in range(2)]
+        for tracker in trackers:
+            tracker.configure({'a': 0.05})
+            tracker.start()
+        first, second = trackers
+        for _ in range(8):
+            loop.run_until_complete(asyncio.sleep(0.01))
+            second.seen('a')
+        assert first.is_online('a')
+        assert first.last_seen('a') == second.last_seen('a')
+        loop.run_until_complete(asyncio.sleep(0.1))
+        assert first.offline() == second.offline() == ['a']
+        second.seen('a')
+        loop.run_until_complete(asyncio.sleep(0.03))
+        assert first.is_online('a')
+        for tracker in trackers:
+            tracker.stop()
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import itertools
+
+from pymegad import loadgen
+from pymegad.parser import parse_request
+
+
+class TestLoadgen(object):
+    def test_device_ips_are_unique(self):
+        ips = loadgen.device_ips(1000)
+        assert len(set(ips)) == 1000
+        assert all(ip.startswith('127.1.') for ip in ips)
+
+    def test_synthetic_config(self):
+        config = loadgen.synthetic_config(['127.1.0.1'], ports=3)
+        assert config['switch'][0]['ports'] == {0: {}, 1: {}, 2: {}}
+
+    def test_event_requests_are_valid(self):
+        for head in itertools.islice(loadgen.event_requests(ports=4), 8):
+            request = parse_request(head)
+            assert int(request.params['pt']) in range(4)
+            assert not request.keep_alive
+
+    def test_report(self):
+        result = loadgen.LoadResult([0.002, 0.001, 0.003], 0, 1.5, 1024)
+        assert loadgen.percentile(result.latencies, 0.5) == 0.002
+        assert result.throughput == 2.0
+        assert 'server peak RSS: 1024 KiB' in result.report()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from pymegad.log import (REQUESTS_LOGGER, SamplingFilter, StructuredFormatter,
+                         setup_logging)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+class TestLogging(object):
+    def teardown_method(self, method):
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for log_filter in list(logging.getLogger(REQUESTS_LOGGER).filters):
+            logging.getLogger(REQUESTS_LOGGER).removeFilter(log_filter)
+
+    def test_sampling_filter(self):
+        sampler = SamplingFilter(3)
+        record = logging.makeLogRecord({'levelno': logging.INFO})
+        assert [sampler.filter(record) for _ in range(6)] == [
+            True, False, False, True, False, False]
+
+    def test_warnings_are_not_sampled(self):
+        sampler = SamplingFilter(3)
+        info = logging.makeLogRecord({'levelno': logging.INFO})
+        warning = logging.makeLogRecord({'levelno': logging.WARNING})
+        assert [sampler.filter(warning) for _ in range(3)] == [True] * 3
+        assert [sampler.filter(info) for _ in range(3)] == [True, False, False]
+
+    def test_structured_formatter(self):
+        record = logging.makeLogRecord({
+            'msg': 'Device %s changed', 'args': ('10.0.0.1',),
+            'device': '10.0.0.1', 'port': 3})
+        assert StructuredFormatter('%(message)s').format(record) == \
+            'Device 10.0.0.1 changed device=10.0.0.1 port=3'
+
+    def test_records_go_through_listener(self):
+        handler = ListHandler()
+        listener = setup_logging(logging.INFO, handlers=[handler],
+                                 sample_every=2)
+        logger = logging.getLogger(REQUESTS_LOGGER)
+        for number in range(4):
+            logger.info('request %d', number, extra={'device': 'a'})
+        logger.debug('hidden')
+        listener.stop()
+        assert [message.split(': ', 1)[1] for message in handler.messages] \
+            == ['request 0 device=a', 'request 2 device=a']
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from pymegad.metrics import MetricsRegistry, ServerMetrics
+
+
+class TestMetrics(object):
+    def setup_method(self, method):
+        self.registry = MetricsRegistry()
+
+    def test_counter_exposition(self):
+        counter = self.registry.counter('events_total', 'Events', ('device',))
+        counter.labels('10.0.0.1').inc()
+        counter.labels('10.0.0.1').inc(2)
+        counter.labels('10.0.0.2').inc()
+        assert self.registry.exposition() == (
+            '# HELP events_total Events\n'
+            '# TYPE events_total counter\n'
+            'events_total{device="10.0.0.1"} 3\n'
+            'events_total{device="10.0.0.2"} 1\n')
+
+    def test_gauge(self):
+        gauge = self.registry.gauge('active', 'Active')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        assert 'active 1\n' in self.registry.exposition()
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('latency', 'Latency',
+                                            buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        lines = self.registry.exposition().splitlines()
+        assert lines[2:] == [
+            'latency_bucket{le="0.1"} 2',
+            'latency_bucket{le="1.0"} 3',
+            'latency_bucket{le="+Inf"} 4',
+            'latency_sum 3.65',
+            'latency_count 4',
+        ]
+
+    def test_label_mismatch(self):
+        counter = self.registry.counter('x', 'X', ('device',))
+        with pytest.raises(ValueError):
+            counter.labels()
+
+    def test_server_metrics(self):
+        stats = ServerMetrics()
+        stats.dispatch.observe(0.0002)
+        text = stats.registry.exposition()
+        assert 'megad_stage_seconds_count{stage="dispatch"} 1' in text
+        assert 'megad_connections_active 0' in text
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import pytest
+parametrize = pytest.mark.parametrize
+
+from pymegad.parser import Request, header_value, parse_query, parse_request
+
+
+class TestParseQuery(object):
+    @parametrize('target,expected', [
+        (b'/', {}),
+        (b'/?', {}),
+        (b'/?pt=5', {'pt': '5'}),
+        (b'/megad?pt=5&m=1', {'pt': '5', 'm': '1'}),
+        (b'/?all=ON;OFF/1;;OFF&mdid=x', {'all': 'ON;OFF/1;;OFF', 'mdid': 'x'}),
+        (b'/?st&pt=2', {'st': '', 'pt': '2'}),
+        (b'/?pt=&&m', {'pt': '', 'm': ''}),
+    ])
+    def test_decode(self, target, expected):
+        assert parse_query(target) == expected
+
+    def test_reuses_params(self):
+        params = parse_query(b'/?pt=1&m=1')
+        assert parse_query(b'/?pt=2', params) is params
+        assert params == {'pt': '2'}
+
+
+class TestParseRequest(object):
+    def test_request_line(self):
+        request = parse_request(b'GET /?pt=7 HTTP/1.1\r\nHost: x\r\n\r\n')
+        assert request.method == b'GET'
+        assert request.target == b'/?pt=7'
+        assert request.version == b'HTTP/1.1'
+        assert request.params == {'pt': '7'}
+
+    @parametrize('head,keep_alive', [
+        (b'GET / HTTP/1.1\r\n\r\n', True),
+        (b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n', False),
+        (b'GET / HTTP/1.0\r\n\r\n', False),
+        (b'GET / HTTP/1.0\r\nCONNECTION: Keep-Alive\r\n\r\n', True),
+    ])
+    def test_keep_alive(self, head, keep_alive):
+        assert parse_request(head).keep_alive is keep_alive
+
+    def test_leading_blank_lines(self):
+        assert parse_request(b'\r\nGET /?m HTTP/1.1\r\n\r\n').params == {
+            'm': ''}
+
+    def test_malformed(self):
+        assert parse_request(b'garbage\r\n\r\n') is None
+
+    def test_reuses_request(self):
+        request = Request()
+        assert parse_request(b'GET /?pt=1 HTTP/1.1\r\n\r\n', request) \
+            is request
+
+    def test_header_value(self):
+        head = b'GET / HTTP/1.1\r\nHost: x\r\nIf-None-Match: "3"\r\n\r\n'
+        assert header_value(head, b'if-none-match') == b'"3"'
+        assert header_value(head, b'etag') is None
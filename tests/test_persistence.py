@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from pymegad.persistence import StateStore
+from pymegad.ports import PortRegistry
+
+
+def make_registry():
+    registry = PortRegistry()
+    registry.add_device('10.0.0.1', [1, 2, 5])
+    registry.add_device('10.0.0.2', [0])
+    return registry
+
+
+class TestStateStore(object):
+    def test_empty_directory(self, tmpdir):
+        store = StateStore(str(tmpdir.join('state')))
+        assert store.restore(make_registry()) == 0
+
+    def test_snapshot_and_journal(self, tmpdir):
+        store = StateStore(str(tmpdir))
+        registry = make_registry()
+        store.open()
+        registry.add_listener(store.record)
+        registry.set_state('10.0.0.1', 2, True)
+        store.snapshot(registry)
+        registry.set_state('10.0.0.1', 5, True)
+        registry.set_state('10.0.0.2', 0, True)
+        registry.set_state('10.0.0.2', 0, False)
+        store.close()
+
+        restored = make_registry()
+        assert StateStore(str(tmpdir)).restore(restored) == 3
+        assert restored.device_states('10.0.0.1') == {
+            1: False, 2: True, 5: True}
+        assert restored.device_states('10.0.0.2') == {0: False}
+
+    def test_unknown_states_are_journaled(self, tmpdir):
+        store = StateStore(str(tmpdir))
+        store.open()
+        registry = make_registry()
+        registry.add_listener(store.record)
+        registry.set_state('10.0.0.2', 0, True)
+        registry.mark_unknown('10.0.0.2')
+        store.close()
+        restored = make_registry()
+        assert StateStore(str(tmpdir)).restore(restored) == 2
+        assert restored.device_states('10.0.0.2') == {0: None}
+
+    def test_restore_into_changed_config(self, tmpdir):
+        store = StateStore(str(tmpdir))
+        store.open()
+        registry = make_registry()
+        registry.set_state('10.0.0.1', 5, True)
+        store.snapshot(registry)
+        store.close()
+
+        restored = PortRegistry()
+        restored.add_device('10.0.0.1', [5, 7])
+        StateStore(str(tmpdir)).restore(restored)
+        assert restored.device_states('10.0.0.1') == {5: True, 7: False}
+
+    def test_truncated_journal_tail(self, tmpdir):
+        store = StateStore(str(tmpdir))
+        store.open()
+        registry = make_registry()
+        registry.add_listener(store.record)
+        registry.set_state('10.0.0.1', 1, True)
+        store.close()
+        with open(store.journal_path, 'ab') as journal:
+            journal.write(b'\x00' * 5)
+        restored = make_registry()
+        assert StateStore(str(tmpdir)).restore(restored) == 1
+        assert restored.get_state('10.0.0.1', 1) is True
+
+    def test_snapshot_written_elsewhere_keeps_new_records(self, tmpdir):
+        store = StateStore(str(tmpdir))
+        store.open()
+        registry = make_registry()
+        registry.add_listener(store.record)
+        registry.set_state('10.0.0.1', 1, True)
+        sequence, data = store.begin_snapshot(registry)
+        registry.set_state('10.0.0.1', 2, True)
+        assert store.write_snapshot(sequence, data)
+        store.end_snapshot(sequence)
+        store.close()
+
+        restored = make_registry()
+        assert StateStore(str(tmpdir)).restore(restored) == 1
+        assert restored.device_states('10.0.0.1') == {
+            1: True, 2: True, 5: False}
+
+    def test_older_snapshot_is_not_written(self, tmpdir):
+        store = StateStore(str(tmpdir))
+        registry = make_registry()
+        old = store.begin_snapshot(registry)
+        registry.set_state('10.0.0.2', 0, True)
+        store.snapshot(registry)
+        assert not store.write_snapshot(*old)
+        restored = make_registry()
+        StateStore(str(tmpdir)).restore(restored)
+        assert restored.get_state('10.0.0.2', 0) is True
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from pymegad.poller import Poller
+
+
+class TestPoller(object):
+    def test_adaptive_intervals(self, loop):
+        polled = []
+        active = 0
+        peak = []
+
+        async def fetch(device):
+            nonlocal active
+            active += 1
+            peak.append(active)
+            polled.append(device)
+            await asyncio.sleep(0.001)
+            active -= 1
+            if device == 'broken':
+                raise OSError('unreachable')
+            return [(1, False, True)] if device == 'busy' else []
+
+        poller = Poller(loop, fetch, concurrency=2, min_interval=0.01,
+                        max_interval=0.04, backoff=2, jitter=0)
+        for device in ('quiet', 'busy', 'broken'):
+            poller.add_device(device)
+        poller.start()
+        loop.run_until_complete(asyncio.sleep(0.2))
+        poller.stop()
+        loop.run_until_complete(asyncio.sleep(0.01))
+
+        assert set(polled) == {'quiet', 'busy', 'broken'}
+        assert max(peak) <= 2
+        assert poller.interval('quiet') == 0.04
+        assert poller.interval('busy') == 0.01
+        assert poller.interval('broken') == 0.04
+        assert poller.errors('broken') > 3
+        assert poller.errors('busy') == 0
+        assert polled.count('busy') > polled.count('broken')
+        assert polled.count('busy') > polled.count('quiet')
+
+    def test_remove_device(self, loop):
+        polled = []
+
+        async def fetch(device):
+            polled.append(device)
+            return []
+
+        poller = Poller(loop, fetch, min_interval=0.01)
+        poller.add_device('a')
+        poller.remove_device('a')
+        poller.start()
+        loop.run_until_complete(asyncio.sleep(0.05))
+        poller.stop()
+        loop.run_until_complete(asyncio.sleep(0.01))
+        assert polled == []
+        assert poller.interval('a') is None
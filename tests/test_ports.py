@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from pymegad.ports import PortRegistry, SwitchPort, parse_statuses
+
+
+class TestPortRegistry(object):
+    def setup_method(self, method):
+        self.registry = PortRegistry()
+        self.registry.add_device('10.0.0.1', {0: {}, 5: {}, 6: {}})
+        self.registry.add_device('10.0.0.2', [5, 7])
+
+    def test_ports_are_namespaced_by_device(self):
+        assert self.registry.set_state('10.0.0.1', 5, True)
+        assert self.registry.get_state('10.0.0.1', 5) is True
+        assert self.registry.get_state('10.0.0.2', 5) is False
+
+    def test_unknown_port_is_ignored(self):
+        assert not self.registry.set_state('10.0.0.1', 3, True)
+        assert not self.registry.set_state('10.0.0.3', 5, True)
+        assert ('10.0.0.1', 3) not in self.registry
+        assert ('10.0.0.1', 6) in self.registry
+        assert len(self.registry) == 5
+
+    def test_set_state_reports_changes(self):
+        assert self.registry.set_state('10.0.0.2', 7, True)
+        assert not self.registry.set_state('10.0.0.2', 7, True)
+
+    def test_device_states(self):
+        self.registry.set_state('10.0.0.1', 6, True)
+        assert self.registry.device_states('10.0.0.1') == {
+            0: False, 5: False, 6: True}
+        assert self.registry.device_states('10.0.0.3') == {}
+
+    def test_switch_port_view(self):
+        port = self.registry[('10.0.0.2', 7)]
+        port.turn_on()
+        assert self.registry.get_state('10.0.0.2', 7) is True
+        self.registry.set_state('10.0.0.2', 7, False)
+        assert not port.is_on()
+
+
+class TestSwitchPort(object):
+    def test_standalone(self):
+        port = SwitchPort(3)
+        assert not port.is_on()
+        port.set_state(1)
+        assert port.is_on()
+        port.turn_off()
+        assert port.state is False
+
+
+class TestIngestStatuses(object):
+    def setup_method(self, method):
+        self.registry = PortRegistry()
+        self.registry.add_device('10.0.0.1', [1, 2, 4])
+
+    def test_parse_statuses(self):
+        assert parse_statuses('ON;off;ON/3;;temp:25;On') == \
+            bytearray([1, 0, 1, 0, 0, 1])
+
+    def test_returns_only_changes(self):
+        changes = self.registry.ingest_statuses('10.0.0.1', 'ON;OFF;ON;ON/2')
+        assert changes == [(1, False, True), (4, False, True)]
+        assert self.registry.device_states('10.0.0.1') == {
+            1: True, 2: False, 4: True}
+        assert self.registry.ingest_statuses(
+            '10.0.0.1', 'ON;OFF;ON;ON/2') == []
+        assert self.registry.ingest_statuses(
+            '10.0.0.1', 'ON;ON;OFF;ON/3') == [(2, False, True)]
+
+    def test_repeated_status_after_single_update(self):
+        self.registry.ingest_statuses('10.0.0.1', 'ON;OFF')
+        self.registry.set_state('10.0.0.1', 1, False)
+        assert self.registry.ingest_statuses('10.0.0.1', 'ON;OFF') == [
+            (1, False, True)]
+
+    def test_short_status_and_unknown_device(self):
+        assert self.registry.ingest_statuses('10.0.0.1', 'ON') == [
+            (1, False, True)]
+        assert self.registry.ingest_statuses('10.0.0.9', 'ON') == []
+
+
+class TestReconfigure(object):
+    def test_keeps_states_of_kept_ports(self):
+        registry = PortRegistry()
+        registry.add_device('10.0.0.1', [1, 2, 3])
+        registry.set_state('10.0.0.1', 2, True)
+        registry.set_state('10.0.0.1', 3, True)
+        registry.reconfigure_device('10.0.0.1', [2, 8])
+        assert registry.device_states('10.0.0.1') == {2: True, 8: False}
+
+
+class TestUnknownState(object):
+    def test_mark_unknown(self):
+        registry = PortRegistry()
+        registry.add_device('10.0.0.1', [1, 2])
+        registry.set_state('10.0.0.1', 2, True)
+        transitions = []
+        registry.add_listener(lambda *transition: transitions.append(transition))
+        registry.mark_unknown('10.0.0.1')
+        assert registry.device_states('10.0.0.1') == {1: None, 2: None}
+        assert transitions == [('10.0.0.1', 1, False, None), ('10.0.0.1', 2, True, None)]
+        version = registry.version
+        registry.mark_unknown('10.0.0.1')
+        assert (registry.version, len(transitions)) == (version, 2)
+        registry.set_state('10.0.0.1', 1, False)
+        registry.ingest_statuses('10.0.0.1', 'OFF;ON')
+        assert transitions[2:] == [('10.0.0.1', 1, None, False), ('10.0.0.1', 2, None, True)]
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from pymegad.ports import PortRegistry
+from pymegad.rules import (EDGE_ANY, EDGE_OFF, EDGE_ON, MAX_CHAIN_DEPTH, Rule,
+                           RuleEngine)
+
+
+class TestRuleEngine(object):
+    def setup_method(self, method):
+        self.registry = PortRegistry()
+        self.registry.add_device('a', [3, 5])
+        self.registry.add_device('b', [7])
+        self.sent = []
+
+    def engine(self, loop):
+        engine = RuleEngine(loop, self.registry,
+                            lambda *command: self.sent.append(command))
+        self.registry.add_listener(engine.on_transition)
+        return engine
+
+    def test_from_config(self):
+        rule = Rule.from_config({'device': 'a', 'port': '3', 'edge': True,
+                                 'target': 'b', 'target_port': 7, 'state': 'off',
+                                 'when': [{'port': 5, 'state': False}]})
+        assert (rule.edge, rule.target, rule.state) == (EDGE_ON, 'b', False)
+        assert rule.conditions == (('a', 5, False),)
+
+    def test_invalid_rules_are_skipped(self, loop):
+        engine = self.engine(loop)
+        engine.load([{'device': 'a', 'port': 3, 'edge': 'up', 'target_port': 7,
+                      'state': 'on'}, {'device': 'a'}])
+        assert len(engine) == 0
+
+    def test_edges(self, loop):
+        engine = self.engine(loop)
+        engine.add_rule(Rule('a', 3, EDGE_ON, 7, False, target='b'))
+        engine.add_rule(Rule('a', 3, EDGE_ANY, 7, True, target='b'))
+        self.registry.set_state('a', 3, True)
+        assert self.sent == [('b', 7, False), ('b', 7, True)]
+        self.registry.set_state('a', 3, False)
+        assert self.sent[2:] == [('b', 7, True)]
+
+    def test_condition_and_rate_limit(self, loop):
+        engine = self.engine(loop)
+        engine.add_rule(Rule('a', 3, EDGE_OFF, 7, True, target='b',
+                             conditions=[('a', 5, True)], min_interval=60))
+        self.registry.set_state('a', 3, True)
+        self.registry.set_state('a', 3, False)
+        assert self.sent == []
+        self.registry.set_state('a', 5, True)
+        for state in (True, False, True, False):
+            self.registry.set_state('a', 3, state)
+        assert self.sent == [('b', 7, True)]
+
+    def test_delay_and_clear(self, loop):
+        engine = self.engine(loop)
+        engine.add_rule(Rule('a', 3, EDGE_ON, 7, True, target='b', delay=0.01))
+        self.registry.set_state('a', 3, True)
+        assert self.sent == []
+        loop.run_until_complete(asyncio.sleep(0.05))
+        assert self.sent == [('b', 7, True)]
+        self.registry.set_state('a', 3, False)
+        self.registry.set_state('a', 3, True)
+        engine.clear()
+        loop.run_until_complete(asyncio.sleep(0.05))
+        assert len(self.sent) == 1
+
+    def test_inline_reply(self, loop):
+        engine = self.engine(loop)
+        engine.add_rule(Rule('a', 3, EDGE_ON, 5, True))
+        engine.add_rule(Rule('a', 5, EDGE_ON, 3, False))
+        engine.begin_reply('a')
+        self.registry.set_state('a', 3, True)
+        assert engine.end_reply() == '5:1;3:0'
+        assert self.sent == []
+        assert self.registry.get_state('a', 5) is True
+
+    def test_chain_through_device_commands(self, loop):
+        def send(device, port, state):
+            self.sent.append((device, port, state))
+            future = loop.create_future()
+            future.add_done_callback(
+                lambda _: self.registry.set_state(device, port, state))
+            loop.call_soon(future.set_result, None)
+            return future
+        engine = RuleEngine(loop, self.registry, send)
+        self.registry.add_listener(engine.on_transition)
+        # b:7 follows a:3 and a:3 follows b:7 inverted: an endless loop.
+        engine.add_rule(Rule('a', 3, EDGE_ON, 7, True, target='b'))
+        engine.add_rule(Rule('b', 7, EDGE_ON, 3, False, target='a'))
+        engine.add_rule(Rule('a', 3, EDGE_OFF, 7, False, target='b'))
+        engine.add_rule(Rule('b', 7, EDGE_OFF, 3, True, target='a'))
+        self.registry.set_state('a', 3, True)
+        loop.run_until_complete(asyncio.sleep(0.05))
+        assert len(self.sent) == MAX_CHAIN_DEPTH
+        assert not engine._sent
+
+    def test_reload_keeps_pending_actions_of_unchanged_rules(self, loop):
+        engine = self.engine(loop)
+        kept = {'device': 'a', 'port': 3, 'target': 'b', 'target_port': 7,
+                'state': 'on', 'delay': 0.01, 'min_interval': 60}
+        dropped = {'device': 'a', 'port': 3, 'target_port': 5, 'state': 'on',
+                   'delay': 0.01}
+        engine.load([kept, dropped])
+        self.registry.set_state('a', 3, True)
+        engine.load([kept, {'device': 'a', 'port': 5, 'target_port': 3,
+                            'state': 'off'}])
+        assert len(engine) == 2
+        loop.run_until_complete(asyncio.sleep(0.05))
+        assert self.sent == [('b', 7, True)]
+
+        # The rate limit of the kept rule survives the reload as well.
+        self.registry.set_state('a', 3, False)
+        engine.load([kept])
+        self.registry.set_state('a', 3, True)
+        loop.run_until_complete(asyncio.sleep(0.05))
+        assert self.sent == [('b', 7, True)]
+
+    def test_unknown_states_are_not_edges(self, loop):
+        engine = self.engine(loop)
+        engine.add_rule(Rule('a', 3, EDGE_ANY, 7, True, target='b'))
+        self.registry.set_state('a', 3, True)
+        self.registry.mark_unknown('a')
+        # Refreshed after coming back: not an edge either.
+        self.registry.ingest_statuses('a', 'OFF;OFF;ON')
+        assert self.registry.get_state('a', 3) is True
+        assert self.sent == [('b', 7, True)]
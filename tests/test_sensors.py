@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from pymegad.sensors import RingBuffer, SensorStore, parse_reading
+
+
+class TestParseReading(object):
+    def test_plain_value(self):
+        assert parse_reading('24.5') == [('value', 24.5)]
+
+    def test_named_values(self):
+        assert parse_reading('temp:24.5/hum:40') == [('temp', 24.5), ('hum', 40.0)]
+
+    def test_garbage_is_skipped(self):
+        assert parse_reading('NA') == []
+        assert parse_reading('temp:NA/hum:40') == [('hum', 40.0)]
+
+    def test_non_finite_values_are_skipped(self):
+        assert parse_reading('nan') == []
+        assert parse_reading('temp:inf/hum:-Infinity/co2:400') == [('co2', 400.0)]
+
+
+class TestRingBuffer(object):
+    def setup_method(self, method):
+        pytest.importorskip('numpy')
+
+    def test_wraps_around(self):
+        buffer = RingBuffer(4)
+        for second in range(6):
+            buffer.append(second, second * 10)
+        times, values = buffer.window()
+        assert len(buffer) == 4
+        assert list(times) == [2, 3, 4, 5]
+        assert list(values) == [20, 30, 40, 50]
+        assert list(buffer.window(3, 4)[1]) == [30, 40]
+
+    def test_downsample(self):
+        buffer = RingBuffer(16)
+        for second, value in enumerate([1, 5, 3, 8, 2, 2, 9]):
+            buffer.append(100 + second, value)
+        windows = buffer.downsample(3, start=100)
+        assert list(windows['time']) == [100, 103, 106]
+        assert list(windows['min']) == [1, 2, 9]
+        assert list(windows['max']) == [5, 8, 9]
+        assert list(windows['mean']) == [3, 4, 9]
+        assert list(windows['count']) == [3, 3, 1]
+
+    def test_downsample_empty(self):
+        assert len(RingBuffer(4).downsample(60)['time']) == 0
+
+
+class TestSensorStore(object):
+    def test_latest_and_history(self):
+        store = SensorStore(capacity=8)
+        assert store.record_reading('a', 3, 'temp:21/hum:40', timestamp=1.0) == 2
+        store.record_reading('a', 3, 'temp:22/hum:41', timestamp=2.0)
+        assert store.latest('a', 3) == {'temp': (2.0, 22.0), 'hum': (2.0, 41.0)}
+        if store.history:
+            assert list(store.series('a', 3, 'temp').window()[1]) == [21, 22]
+        assert store.ports() == [('a', 3)]
+        assert sorted(store.keys()) == [('a', 3, 'hum'), ('a', 3, 'temp')]
+        store.forget('a')
+        assert store.keys() == []
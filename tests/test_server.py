@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from pymegad.capture import read_capture
+from pymegad.main import MegadServer
+
+
+def new_server(loop, **options):
+    config = {
+        'switch': [{'platform': 'megad', 'ip': '127.0.0.1', 'pass': 'sec',
+                    'ports': {0: {}, 1: {}}}],
+        'server': options,
+    }
+    return MegadServer('127.0.0.1', 0, loop=loop, config=config)
+
+
+def make_server(loop, **options):
+    server = new_server(loop, **options)
+    server.start(and_loop=False)
+    return server
+
+
+def exchange(loop, server, head):
+    async def go():
+        port = server._server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(head)
+        try:
+            response = await asyncio.wait_for(reader.read(), 2.0)
+        except ConnectionResetError:
+            response = b''
+        writer.close()
+        return response
+    return loop.run_until_complete(go())
+
+
+class TestReload(object):
+    def config(self, *devices):
+        return {'switch': [dict({'platform': 'megad'}, **device) for device in devices],
+                'server': {'poll': False}}
+
+    def test_add_change_remove(self, loop):
+        server = MegadServer('127.0.0.1', 0, loop=loop, config=self.config(
+            {'ip': '127.0.0.1', 'ports': {1: {}, 2: {}}},
+            {'ip': '127.0.0.2', 'ports': {1: {}}},
+            {'ip': '127.0.0.3', 'ports': {1: {}}}))
+        server.ports.set_state('127.0.0.1', 2, True)
+        server.ports.set_state('127.0.0.2', 1, True)
+        result = server.reload_config(self.config(
+            {'ip': '127.0.0.1', 'ports': {2: {}, 3: {}}},
+            {'ip': '127.0.0.2', 'ports': {1: {}}},
+            {'ip': '127.0.0.4', 'ports': {5: {}}}))
+        assert result == {'added': ['127.0.0.4'], 'removed': ['127.0.0.3'],
+                          'changed': ['127.0.0.1']}
+        assert server.ports.device_states('127.0.0.1') == {2: True, 3: False}
+        assert server.ports.get_state('127.0.0.2', 1) is True
+        assert server.ports.device('127.0.0.3') is None
+        assert server.ports.device_states('127.0.0.4') == {5: False}
+        assert server.poller.interval('127.0.0.4') is not None
+        assert server.poller.interval('127.0.0.3') is None
+
+    @pytest.mark.parametrize('config', [{'switch': 'bad'}, {'switch': []}, {'server': {}}])
+    def test_invalid_config_keeps_devices(self, loop, config):
+        server = MegadServer('127.0.0.1', 0, loop=loop, config=self.config(
+            {'ip': '127.0.0.1', 'ports': {1: {}}},
+            {'ip': '127.0.0.2', 'ports': {1: {}}}))
+        server.ports.set_state('127.0.0.2', 1, True)
+        with pytest.raises(ValueError):
+            server.reload_config(config)
+        assert sorted(server._device_list) == ['127.0.0.1', '127.0.0.2']
+        assert sorted(server.ports.devices()) == ['127.0.0.1', '127.0.0.2']
+        assert server.ports.get_state('127.0.0.2', 1) is True
+        assert server.poller.interval('127.0.0.1') is not None
+        assert server._config['switch'][0]['ip'] == '127.0.0.1'
+
+    def test_not_reloadable(self, loop):
+        server = MegadServer('127.0.0.1', 0, loop=loop, reloadable=False, config=self.config(
+            {'ip': '127.0.0.1', 'ports': {1: {}}}))
+        with pytest.raises(RuntimeError):
+            server.reload_config(self.config({'ip': '127.0.0.2', 'ports': {1: {}}}))
+        assert server.ports.devices() == ['127.0.0.1']
+
+
+class TestCommandTable(object):
+    def test_registered_command(self, loop):
+        server = new_server(loop)
+        calls = []
+
+        def scene(device, value, command):
+            calls.append((device, value, command))
+            return value
+
+        server.register_command('scene', scene)
+        assert server.handle_command('127.0.0.1', {'scene': '7:1'}) == '7:1'
+        assert calls == [('127.0.0.1', '7:1', {'scene': '7:1'})]
+
+    def test_mega_name_maps_to_query_key(self, loop):
+        server = new_server(loop)
+        server.register_command('port_update', lambda device, value, command: 'x')
+        assert server.handle_command('127.0.0.1', {'pt': '1'}) == 'x'
+        assert server.handle_command('127.0.0.1', {'port_update': '1'}) is None
+
+    def test_unknown_command_is_ignored(self, loop):
+        server = new_server(loop)
+        version = server.ports.version
+        assert server.handle_command('127.0.0.1', {'zz': '1'}) is None
+        assert server.ports.version == version
+
+    def test_override_handler(self, loop):
+        server = new_server(loop)
+        seen = []
+        server.register_command('port_update', lambda device, value, command: seen.append(value))
+        server.parse_cmd('127.0.0.1', '/?pt=1')
+        assert seen == ['1']
+        assert server.ports.get_state('127.0.0.1', 1) is False
+
+
+class TestKeepAlive(object):
+    def converse(self, loop, server, heads, pipelined=False):
+        async def go():
+            port = server._server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            answers = []
+            if pipelined:
+                writer.write(b''.join(heads))
+            for head in heads:
+                if not pipelined:
+                    writer.write(head)
+                answers.append(await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 2.0))
+            rest = await asyncio.wait_for(reader.read(), 2.0)
+            writer.close()
+            return answers, rest
+        return loop.run_until_complete(go())
+
+    def test_sequential_requests(self, loop):
+        server = make_server(loop, keep_alive_timeout=0.1)
+        answers, _ = self.converse(loop, server, [
+            b'GET /?pt=1 HTTP/1.1\r\n\r\n',
+            b'GET /?pt=0 HTTP/1.1\r\nConnection: close\r\n\r\n',
+        ])
+        assert b'Connection: keep-alive' in answers[0]
+        assert b'Connection: close' in answers[1]
+        assert server.stats.connections.value == 1
+        assert server.stats.requests.value == 2
+        server.stop(and_loop=False)
+
+    def test_pipelined_requests(self, loop):
+        server = make_server(loop, keep_alive_timeout=0.1)
+        answers, rest = self.converse(loop, server, [
+            b'GET /?pt=1 HTTP/1.1\r\n\r\n',
+            b'GET /?pt=0 HTTP/1.1\r\n\r\n',
+            b'GET /state/127.0.0.1/1 HTTP/1.1\r\nConnection: close\r\n\r\n',
+        ], pipelined=True)
+        assert [answer.startswith(b'HTTP/1.1 200') for answer in answers] == [True] * 3
+        assert b'application/json' in answers[2]
+        assert rest.endswith(b'"state":true,"version":' + str(server.ports.version).encode() + b'}')
+        assert server.ports.get_state('127.0.0.1', 0) is True
+        assert server.stats.connections.value == 1
+        server.stop(and_loop=False)
+
+    def test_bad_request_keeps_connection(self, loop):
+        server = make_server(loop, keep_alive_timeout=0.1)
+        answers, _ = self.converse(loop, server, [
+            b'GET /?pt=abc HTTP/1.1\r\n\r\n',
+            b'GET /?pt=1 HTTP/1.1\r\nConnection: close\r\n\r\n',
+        ], pipelined=True)
+        assert answers[0].startswith(b'HTTP/1.1 400 Bad Request')
+        assert b'Connection: keep-alive' in answers[0]
+        assert answers[1].startswith(b'HTTP/1.1 200')
+        assert server.ports.get_state('127.0.0.1', 1) is True
+        assert server.stats.connections.value == 1
+        server.stop(and_loop=False)
+
+    def test_idle_connection_is_closed(self, loop):
+        server = make_server(loop, keep_alive_timeout=0.05)
+        answers, rest = self.converse(loop, server, [b'GET /?pt=1 HTTP/1.1\r\n\r\n'])
+        assert b'Connection: keep-alive' in answers[0]
+        assert rest == b''
+        assert server.stats.timeouts.value == 1
+        server.stop(and_loop=False)
+
+    def test_http10_closes(self, loop):
+        server = make_server(loop, keep_alive_timeout=5)
+        answers, rest = self.converse(loop, server, [b'GET /?pt=1 HTTP/1.0\r\n\r\n'])
+        assert b'Connection: close' in answers[0]
+        assert rest == b''
+        assert server.stats.timeouts.value == 0
+        server.stop(and_loop=False)
+
+
+class TestAdmission(object):
+    def test_device_request(self, loop):
+        server = make_server(loop)
+        response = exchange(loop, server, b'GET /?pt=1&cmd=1:1 HTTP/1.0\r\n\r\n')
+        assert response.startswith(b'HTTP/1.1 200')
+        server.stop(and_loop=False)
+
+    def test_unknown_address_is_closed(self, loop):
+        server = make_server(loop)
+        server._allowed = set()
+        assert exchange(loop, server, b'GET / HTTP/1.0\r\n\r\n') == b''
+        assert server.stats.rejected.labels('allowlist').value == 1
+        server.stop(and_loop=False)
+
+    @pytest.mark.parametrize('allow_loopback', [True, False])
+    def test_loopback(self, loop, allow_loopback):
+        config = {'switch': [{'platform': 'megad', 'ip': '10.0.0.1', 'ports': {1: {}}}],
+                  'server': {'allow_loopback': allow_loopback}}
+        server = MegadServer('127.0.0.1', 0, loop=loop, config=config)
+        server.start(and_loop=False)
+        response = exchange(loop, server, b'GET /state HTTP/1.0\r\n\r\n')
+        assert response.startswith(b'HTTP/1.1 200') is allow_loopback
+        server.stop(and_loop=False)
+
+    def test_header_too_large(self, loop):
+        server = make_server(loop, max_header_size=64)
+        response = exchange(loop, server, b'GET /' + b'a' * 200 + b' HTTP/1.0\r\n\r\n')
+        assert response.startswith(b'HTTP/1.1 431')
+        server.stop(and_loop=False)
+
+    def test_overflow_reject(self, loop):
+        server = make_server(loop, max_connections=1, keep_alive_timeout=5)
+
+        async def go():
+            port = server._server.sockets[0].getsockname()[1]
+            _, holder = await asyncio.open_connection('127.0.0.1', port)
+            await asyncio.sleep(0.05)
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            response = await asyncio.wait_for(reader.read(), 2.0)
+            holder.close()
+            writer.close()
+            await asyncio.sleep(0.05)
+            return response
+
+        assert loop.run_until_complete(go()).startswith(b'HTTP/1.1 503')
+        assert server.stats.rejected.labels('overflow').value == 1
+        server.stop(and_loop=False)
+
+
+class TestReplyActions(object):
+    def test_handler_actions_are_returned(self, loop):
+        server = make_server(loop)
+        server.register_command('port_update', lambda device, value, command: '7:1')
+        server.register_command('scene', lambda device, value, command: value)
+        response = exchange(loop, server, b'GET /?pt=1&scene=a:2 HTTP/1.0\r\n\r\n')
+        head, body = response.split(b'\r\n\r\n', 1)
+        assert b'Content-Length: 7' in head
+        assert body == b'7:1;a:2'
+        server.stop(and_loop=False)
+
+    def test_empty_reply(self, loop):
+        server = make_server(loop)
+        assert server.parse_cmd('127.0.0.1', '/?pt=1') is None
+        response = exchange(loop, server, b'GET /?pt=1 HTTP/1.0\r\n\r\n')
+        assert response.endswith(b'Content-Length: 0\r\n\r\n')
+        server.stop(and_loop=False)
+
+
+class TestStateEndpoint(object):
+    def test_state_request(self, loop):
+        server = make_server(loop)
+        response = exchange(loop, server, b'GET /state/127.0.0.1/1 HTTP/1.0\r\n\r\n')
+        head, body = response.split(b'\r\n\r\n', 1)
+        assert b'Content-Type: application/json' in head
+        assert b'ETag: "' in head
+        assert body.endswith(b'"state":false,"version":' + str(server.ports.version).encode() + b'}')
+        assert server.stats.device_events.labels('127.0.0.1').value == 0
+        server.stop(and_loop=False)
+
+    def test_sensor_ports(self, loop):
+        server = MegadServer('127.0.0.1', 0, loop=loop, config={'switch': [{
+            'platform': 'megad', 'ip': '127.0.0.1',
+            'ports': {1: {}, 2: {'sensor': 'temperature'}}}]})
+        server.start(and_loop=False)
+        server.handle_command('127.0.0.1', {'all': 'ON;24.5'})
+        assert server.ports.device_states('127.0.0.1') == {1: True}
+        response = exchange(loop, server, b'GET /state/127.0.0.1 HTTP/1.0\r\n\r\n')
+        assert response.endswith(b'"ports":{"1":true},"version":' +
+                                 str(server.ports.version).encode() + b'}')
+        response = exchange(loop, server, b'GET /sensors/127.0.0.1/2 HTTP/1.0\r\n\r\n')
+        assert b'"type":"temperature","values":{"value":{"time":' in response
+        assert response.endswith(b'"value":24.5}}}')
+        server.stop(and_loop=False)
+
+    def test_event_stream(self, loop):
+        server = make_server(loop)
+
+        async def go():
+            port = server._server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /events HTTP/1.1\r\n\r\n')
+            head = await reader.readuntil(b'\r\n\r\n')
+            snapshot = await reader.readuntil(b'\n\n')
+            server.ports.set_state('127.0.0.1', 1, True)
+            event = await asyncio.wait_for(reader.readuntil(b'\n\n'), 2.0)
+            writer.close()
+            await asyncio.sleep(0.05)
+            return head, snapshot, event
+
+        head, snapshot, event = loop.run_until_complete(go())
+        assert b'text/event-stream' in head
+        assert b'event: snapshot' in snapshot
+        assert b'"device":"127.0.0.1","port":1,"state":true' in event
+        assert len(server.event_stream) == 0
+        server.stop(and_loop=False)
+
+
+class TestCaptureOption(object):
+    def test_requests_are_captured(self, loop, tmpdir):
+        path = str(tmpdir.join('events.capture'))
+        server = make_server(loop, capture_path=path)
+        exchange(loop, server, b'GET /?pt=1 HTTP/1.0\r\n\r\n')
+        server.stop(and_loop=False)
+        (_, ip, head), = read_capture(path)
+        assert (ip, head) == ('127.0.0.1', b'GET /?pt=1 HTTP/1.0\r\n\r\n')
+
+
+class TestStateStore(object):
+    def test_background_snapshot(self, loop, tmpdir):
+        server = make_server(loop, state_dir=str(tmpdir))
+        server.ports.set_state('127.0.0.1', 1, True)
+        server.snapshot_in_background()
+        loop.run_until_complete(server._snapshot_task)
+        server.ports.set_state('127.0.0.1', 0, True)
+        server.stop(and_loop=False)
+        restored = new_server(loop, state_dir=str(tmpdir))
+        assert restored.ports.device_states('127.0.0.1') == {0: True, 1: True}
+        restored.store.close()
+
+    def test_without_persistence(self, loop, tmpdir):
+        config = {'switch': [{'platform': 'megad', 'ip': '127.0.0.1', 'ports': {1: {}}}],
+                  'server': {'state_dir': str(tmpdir)}}
+        server = MegadServer('127.0.0.1', 0, loop=loop, config=config, persist=False)
+        assert server.store is None
+
+
+class TestLiveness(object):
+    def test_offline_device(self, loop):
+        server = make_server(loop, heartbeat_timeout=0.03, liveness_tick=0.01)
+        server.ports.set_state('127.0.0.1', 1, True)
+        subscription = server.events.subscribe('127.0.0.1', 1)
+        loop.run_until_complete(asyncio.sleep(0.08))
+        assert server.liveness.offline() == ['127.0.0.1']
+        assert server.ports.get_state('127.0.0.1', 1) is None
+        assert subscription.queue.get_nowait() == ('127.0.0.1', 1, True, None)
+        assert server.stats.offline.value == 1
+        server.parse_cmd('127.0.0.1', '/?pt=1')
+        assert server.liveness.offline() == []
+        assert server.ports.get_state('127.0.0.1', 1) is True
+        server.stop(and_loop=False)
+
+
+class TestPolling(object):
+    @pytest.mark.parametrize('poll', [True, False])
+    def test_only_polling_server_polls(self, loop, poll):
+        config = {'switch': [{'platform': 'megad', 'ip': '127.0.0.1', 'ports': {1: {}}}],
+                  'server': {'poll': True}}
+        server = MegadServer('127.0.0.1', 0, loop=loop, config=config, poll=poll)
+        refreshed = []
+
+        async def refresh_device(device):
+            refreshed.append(device)
+        server.refresh_device = refresh_device
+        server.start(and_loop=False)
+        server.device_liveness('127.0.0.1', True)
+        loop.run_until_complete(asyncio.sleep(0))
+        assert server.polling is poll
+        assert bool(server.poller._tasks) is poll
+        assert refreshed == (['127.0.0.1'] if poll else [])
+        server.stop(and_loop=False)
+        loop.run_until_complete(asyncio.sleep(0))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from pymegad.ports import PortRegistry
+from pymegad.stream import (OVERFLOW_DROP, PING, EventStream, _Client, encode_event,
+                            is_events_request)
+from pymegad.workers import SharedArena
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.buffered = 0
+        self.aborted = False
+
+    def is_closing(self):
+        return self.aborted
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def abort(self):
+        self.aborted = True
+
+
+class FakeWriter(object):
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.transport.buffered += len(data)
+
+
+class TestEventStream(object):
+    def setup_method(self, method):
+        self.registry = PortRegistry()
+        self.registry.add_device('a', [1])
+        self.registry.add_device('b', [1])
+
+    def subscribe(self, stream, device=None):
+        client = _Client(FakeWriter(), device, stream._loop)
+        stream._clients.add(client)
+        return client
+
+    def test_is_events_request(self):
+        assert is_events_request(b'/events?device=a')
+        assert not is_events_request(b'/eventsource')
+
+    def test_encode_event(self):
+        assert encode_event('state', 3, {'a': 1}) == b'id: 3\nevent: state\ndata: {"a":1}\n\n'
+
+    def test_serialized_once_and_filtered(self, loop):
+        stream = EventStream(loop, self.registry, ping_interval=0)
+        self.registry.add_listener(stream.on_transition)
+        everything = self.subscribe(stream)
+        only_a = self.subscribe(stream, 'a')
+        only_b = self.subscribe(stream, 'b')
+        self.registry.set_state('a', 1, True)
+        assert everything.writer.chunks[0] is only_a.writer.chunks[0]
+        assert b'"device":"a"' in everything.writer.chunks[0]
+        assert only_b.writer.chunks == []
+
+    def test_slow_client_is_resynced(self, loop):
+        stream = EventStream(loop, self.registry, buffer_size=100, ping_interval=0)
+        self.registry.add_listener(stream.on_transition)
+        client = self.subscribe(stream)
+        client.writer.transport.buffered = 90
+        self.registry.set_state('a', 1, True)
+        assert client.stale and client.writer.chunks == []
+        client.writer.transport.buffered = 0
+        self.registry.set_state('a', 1, False)
+        assert client.writer.chunks[0].startswith(b'id: ')
+        assert b'event: snapshot' in client.writer.chunks[0]
+        assert (stream.dropped, stream.resynced) == (1, 1)
+
+    def test_slow_client_is_dropped(self, loop):
+        stream = EventStream(loop, self.registry, buffer_size=100,
+                             overflow=OVERFLOW_DROP, ping_interval=0)
+        self.registry.add_listener(stream.on_transition)
+        client = self.subscribe(stream)
+        client.writer.transport.buffered = 90
+        self.registry.set_state('a', 1, True)
+        assert client.writer.transport.aborted
+        assert len(stream) == 0
+
+    def test_ping_resyncs_shared_registry(self, loop):
+        arena = SharedArena(64, writers=2)
+        registry, other = arena.registry(0), arena.registry(1)
+        for each in (registry, other):
+            each.add_device('a', [1])
+        stream = EventStream(loop, registry, ping_interval=0)
+        client, second = self.subscribe(stream), self.subscribe(stream)
+        stream._send_pings()
+        assert client.writer.chunks[-1] == PING
+        other.set_state('a', 1, True)
+        stream._send_pings()
+        assert b'event: snapshot' in client.writer.chunks[-1]
+        assert b'"a":{"1":true}' in client.writer.chunks[-1]
+        # Serialized once for all the clients of the same filter.
+        assert second.writer.chunks[-1] is client.writer.chunks[-1]
+        stream._send_pings()
+        assert client.writer.chunks[-1] == PING
+        stream._remove(client)
+        stream._remove(second)
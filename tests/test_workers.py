@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import signal
+import socket
+import time
+
+import pytest
+
+from pymegad.workers import SharedArena, run_workers
+
+
+class TestSharedArena(object):
+    def test_same_layout_in_every_registry(self):
+        arena = SharedArena(64)
+        first, second = arena.registry(), arena.registry()
+        for registry in (first, second):
+            registry.add_device('10.0.0.1', [1, 2])
+            registry.add_device('10.0.0.2', [3])
+        first.set_state('10.0.0.2', 3, True)
+        assert second.get_state('10.0.0.2', 3) is True
+        assert second.get_state('10.0.0.1', 2) is False
+        assert not second.cache_statuses
+
+    def test_states_are_shared_with_forked_process(self):
+        arena = SharedArena(64)
+        registry = arena.registry()
+        registry.add_device('10.0.0.1', [1, 2])
+        pid = os.fork()
+        if pid == 0:
+            child = arena.registry()
+            child.add_device('10.0.0.1', [1, 2])
+            child.ingest_statuses('10.0.0.1', 'OFF;ON')
+            os._exit(0)
+        os.waitpid(pid, 0)
+        assert registry.device_states('10.0.0.1') == {1: False, 2: True}
+
+    def test_version_is_shared(self):
+        arena = SharedArena(64, writers=2)
+        registry = arena.registry(0)
+        registry.add_device('10.0.0.1', [1, 2])
+        version = registry.version
+        pid = os.fork()
+        if pid == 0:
+            child = arena.registry(1)
+            child.add_device('10.0.0.1', [1, 2])
+            child.set_state('10.0.0.1', 2, True)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        assert registry.version == version + 2
+        registry.set_state('10.0.0.1', 1, True)
+        assert registry.version == version + 3
+
+    def test_full_arena(self):
+        registry = SharedArena(8).registry()
+        with pytest.raises(MemoryError):
+            registry.add_device('10.0.0.1', [10])
+
+
+class TestRunWorkers(object):
+    def test_startup_failure_is_logged(self, tmpdir):
+        path = str(tmpdir.join('workers.log'))
+        config = {'switch': [{'platform': 'megad', 'ip': '127.0.0.1', 'ports': {10: {}}}]}
+        root = logging.getLogger()
+        handlers, level = list(root.handlers), root.level
+        try:
+            run_workers('127.0.0.1', 0, 2, config=config, arena_size=8,
+                        log_handlers=[logging.FileHandler(path)])
+        finally:
+            root.handlers, root.level = handlers, level
+        with open(path) as log:
+            failures = [line for line in log if 'failed' in line]
+        assert len(failures) == 2
+
+    def test_metrics_with_several_workers(self, tmpdir):
+        path = str(tmpdir.join('workers.log'))
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            metrics_port = probe.getsockname()[1]
+        config = {'switch': [{'platform': 'megad', 'ip': '127.0.0.1', 'ports': {1: {}}}],
+                  'server': {'metrics_port': metrics_port}}
+        pid = os.fork()
+        if pid == 0:
+            logging.getLogger().setLevel(logging.INFO)
+            run_workers('127.0.0.1', 0, 2, config=config,
+                        log_handlers=[logging.FileHandler(path)])
+            os._exit(0)
+        try:
+            deadline = time.monotonic() + 5.0
+            while time.monotonic() < deadline:
+                if os.path.exists(path):
+                    with open(path) as log:
+                        if log.read().count('Listening established') == 2:
+                            break
+                time.sleep(0.01)
+            with socket.create_connection(('127.0.0.1', metrics_port), 2.0) as client:
+                client.sendall(b'GET /metrics HTTP/1.1\r\n\r\n')
+                assert client.recv(4096).startswith(b'HTTP/1.1 200 OK')
+            time.sleep(0.1)
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        with open(path) as log:
+            lines = log.readlines()
+        assert sum('Listening established' in line for line in lines) == 2
+        assert sum('Metrics available' in line for line in lines) == 1
+        assert not [line for line in lines if 'failed' in line]